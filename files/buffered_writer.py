@@ -0,0 +1,158 @@
+# buffered_writer.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Long-lived, buffered writer for the log files and databases of
+# mqtt_node_client.py and mqtt_server_client.py.
+#
+# Instead of opening and closing the file for every single entry, the file is
+# kept open and the entries are buffered in memory until one of the limits of
+# the flush policy (number of bytes, number of entries or time since the last
+# flush) is reached, thus reducing the number of syscalls and write cycles on
+# the SD card. Files rotated or removed by another program (e.g. the cleanup
+# scripts, that replace the file by a truncated copy) are detected on every
+# flush and reopened automatically.
+
+import threading
+import atexit
+import time
+import os
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Buffered_Writer(object):
+    '''
+    Long-lived, buffered and thread-safe writer appending entries to a file,
+    that is flushed according to a configurable flush policy and reopened if
+    it has been rotated.
+    '''
+
+    # Initialization method; set the flush policy and open the file
+    def __init__(self, path, **kwargs):
+        '''
+        Initialization method; set the flush policy and open the file
+
+        Permitted transfer parameters:
+        - flush_bytes       (default: 4096; flush if at least this many bytes
+                            are buffered)
+        - flush_records     (default: 50; flush if at least this many entries
+                            are buffered)
+        - flush_interval    (default: 30; flush if the last flush is at least
+                            this many seconds ago; 0 disables the time limit)
+        - fsync             (default: 0; if set, force the data to be written
+                            to the storage device on every flush)
+        - flush_thread      (default: 1; if set, a separate thread flushes the
+                            buffered entries every flush interval; otherwise,
+                            flush_if_due() has to be called periodically, e.g.
+                            by an event loop)
+        '''
+        # Evaluate the transfer parameters
+        self._flush_bytes = kwargs.get('flush_bytes', 4096)
+        self._flush_records = kwargs.get('flush_records', 50)
+        self._flush_interval = kwargs.get('flush_interval', 30)
+        self._fsync = kwargs.get('fsync', 0)
+        flush_thread = kwargs.get('flush_thread', 1)
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending_bytes = 0
+        self._pending_records = 0
+        self._last_flush = time.monotonic()
+
+        self._open()
+
+        # Flush the buffered entries periodically, so they don't stay in the
+        # buffer if no new entries arrive
+        self._closed = threading.Event()
+        if (self._flush_interval and flush_thread):
+            thread = threading.Thread(target=self._flush_loop, daemon=True)
+            thread.start()
+
+        # Make sure, that the buffered entries aren't lost on exit
+        atexit.register(self.close)
+
+    # Open the file and remember its identity to be able to detect a rotation
+    def _open(self):
+        '''Open the file and remember its identity to be able to detect a rotation'''
+        self._file = open(self.path, 'a', buffering=max(self._flush_bytes*2, 8192))
+        status = os.fstat(self._file.fileno())
+        self._identity = (status.st_dev, status.st_ino)
+
+    # Check, if the file has been rotated resp. removed, and reopen it if so
+    def _reopen_if_rotated(self):
+        '''Check, if the file has been rotated resp. removed, and reopen it if so'''
+        try:
+            status = os.stat(self.path)
+            if ((status.st_dev, status.st_ino) == self._identity):
+                return
+        except FileNotFoundError:
+            pass
+
+        self._file.close()
+        self._open()
+
+    # Flush the buffered entries (the lock has to be held by the caller)
+    def _flush(self):
+        '''Flush the buffered entries'''
+        if (self._pending_records):
+            self._file.flush()
+            if (self._fsync):
+                os.fsync(self._file.fileno())
+
+        self._pending_bytes = 0
+        self._pending_records = 0
+        self._last_flush = time.monotonic()
+
+        self._reopen_if_rotated()
+
+    # Append the given entry to the file and flush the buffer, if one of the
+    # limits of the flush policy is reached
+    def write(self, entry):
+        '''Append the given entry to the file and flush the buffer, if one of the limits of the flush policy is reached'''
+        with self._lock:
+            if (self._file == None):
+                raise Exception('Writer already closed!')
+
+            self._file.write(entry)
+            self._pending_bytes+=len(entry)
+            self._pending_records+=1
+
+            if (self._pending_bytes >= self._flush_bytes or self._pending_records >= self._flush_records or (self._flush_interval and time.monotonic()-self._last_flush >= self._flush_interval)):
+                self._flush()
+
+    # Flush the buffered entries every flush interval until the writer is closed
+    def _flush_loop(self):
+        '''Flush the buffered entries every flush interval until the writer is closed'''
+        while (not self._closed.wait(self._flush_interval)):
+            self.flush_if_due()
+
+    # Flush the buffered entries, if the flush interval has elapsed
+    def flush_if_due(self):
+        '''Flush the buffered entries, if the flush interval has elapsed'''
+        with self._lock:
+            if (self._file != None and self._pending_records and time.monotonic()-self._last_flush >= self._flush_interval):
+                self._flush()
+
+    # Flush the buffered entries immediately
+    def flush(self):
+        '''Flush the buffered entries immediately'''
+        with self._lock:
+            if (self._file != None):
+                self._flush()
+
+    # Flush the buffered entries and close the file
+    def close(self):
+        '''Flush the buffered entries and close the file'''
+        self._closed.set()
+
+        with self._lock:
+            if (self._file != None):
+                self._flush()
+                self._file.close()
+                self._file = None
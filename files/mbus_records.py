@@ -0,0 +1,184 @@
+# mbus_records.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Decoding of the M-Bus telegrams read by mqtt_node_client.py into
+# typed records.
+#
+# libmbus returns every telegram as an XML document describing the slave and
+# all of its data records. Instead of passing the whole document on, the
+# decoder extracts the single data records (function, storage number, tariff,
+# unit and value), scales the values according to their unit and names them, so
+# every record can be stored and published as a single number on its own topic
+# (e.g. emra/<username>/<topic>/energy). The layout of the records (names,
+# units, scale factors) only depends on the device and its manufacturer, so it
+# is derived once and cached; the following telegrams of the same device are
+# only checked against the cached layout and their values extracted.
+#
+# Example of a data record (cf. mbus-protocol.c of libmbus):
+#
+#   <DataRecord id="0">
+#       <Function>Instantaneous value</Function>
+#       <StorageNumber>0</StorageNumber>
+#       <Tariff>1</Tariff>
+#       <Device>0</Device>
+#       <Unit>Energy (10 Wh)</Unit>
+#       <Value>1234567</Value>
+#   </DataRecord>
+
+import xml.etree.ElementTree as ElementTree
+import math
+import re
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Unit strings of libmbus, e.g. 'Energy (10 Wh)' or 'Volume (1e-2  m^3)'
+_UNIT=re.compile(r'^\s*([^(]*?)\s*(?:\(\s*([-+0-9.e]+)?\s*([^)]*?)\s*\))?\s*$')
+
+# Suffixes of the names of the records depending on their function
+_FUNCTIONS={
+    'Instantaneous value': '',
+    'Maximum value': '_max',
+    'Minimum value': '_min',
+    'Value during error state': '_error',
+}
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Split the given unit string of libmbus into the quantity, the scale factor and
+# the actual unit
+def parse_unit(unit):
+    '''Split the given unit string of libmbus into the quantity, the scale factor and the actual unit'''
+    match = _UNIT.match(unit or '')
+    if (match == None):
+        return (unit, 1, '')
+
+    quantity, scale, symbol = match.groups()
+    try:
+        scale = float(scale) if scale else 1
+    except ValueError:
+        # No scale factor, but a description (e.g. 'Time Point (date & time)')
+        symbol = scale+' '+symbol
+        scale = 1
+    if (scale == int(scale)):
+        scale = int(scale)
+
+    return (quantity, scale, symbol or '')
+
+# Derive a name usable as topic level from the given quantity (e.g. 'Volume
+# flow' -> 'volume_flow')
+def _slug(quantity):
+    '''Derive a name usable as topic level from the given quantity'''
+    return re.sub(r'[^a-z0-9]+', '_', quantity.lower()).strip('_') or 'value'
+
+class Record_Decoder(object):
+    '''
+    Decoder turning the XML documents of libmbus into typed records, that
+    caches the record layout per device and manufacturer.
+    '''
+
+    # Initialization method; initialize the layout cache
+    def __init__(self):
+        '''Initialization method; initialize the layout cache'''
+        # Record layouts per device (address, identification number,
+        # manufacturer, version and medium)
+        self._layouts = {}
+
+        # Statistics
+        self.layouts_built = 0
+
+    # Derive the layout of the given data records of the given device table
+    # entry; return a list of tuples (unit string, record, device table entry
+    # to publish the value on; None if the record isn't published)
+    def _build_layout(self, device, elements):
+        '''Derive the layout of the given data records of the given device table entry'''
+        selected = device.get('records', None)
+        layout = []
+        names = {}
+
+        for element in elements:
+            unit = element.findtext('Unit', '')
+            quantity, scale, symbol = parse_unit(unit)
+            record = {
+                'id': int(element.get('id', len(layout))),
+                'function': element.findtext('Function', ''),
+                'storage': int(element.findtext('StorageNumber', '0') or 0),
+                'tariff': int(element.findtext('Tariff', '0') or 0),
+                'subunit': int(element.findtext('Device', '0') or 0),
+                'quantity': quantity,
+                'unit': symbol,
+                'scale': scale,
+                'digits': max(0, -int(math.floor(math.log10(abs(scale))))) if scale else 0,
+            }
+
+            # Name the record after its quantity, function, storage number,
+            # tariff and subunit (e.g. energy_max_s1_t2)
+            name = _slug(quantity)+_FUNCTIONS.get(record['function'], '_'+_slug(record['function']))
+            for key, prefix in (('storage', '_s'), ('tariff', '_t'), ('subunit', '_d')):
+                if (record[key]):
+                    name+=prefix+str(record[key])
+            if (name in names):
+                name+='_'+str(record['id'])
+            names[name] = record
+            record['name'] = name
+
+            # Derive the device table entry to publish the value of the record
+            # on from the entry of the device
+            entry = None
+            if (selected == None or record['id'] in selected or name in selected):
+                entry = dict(device)
+                entry['topic'] = device['topic']+'/'+name if 'topic' in device else name
+                entry['record'] = record
+            layout.append((unit, record, entry))
+
+        self.layouts_built+=1
+        return layout
+
+    # Decode the given XML document read from the given device table entry;
+    # return a list of tuples (device table entry of the record, value) of all
+    # numeric records published
+    def decode(self, device, document):
+        '''Decode the given XML document read from the given device table entry'''
+        if (isinstance(document, bytes)):
+            document = document.decode('utf-8', 'replace')
+        root = ElementTree.fromstring(document)
+
+        # Identify the device to look up its record layout
+        slave = root.find('SlaveInformation')
+        key = (device['address'],)
+        if (slave != None):
+            key+=tuple(slave.findtext(tag, '') for tag in ('Id', 'Manufacturer', 'Version', 'Medium'))
+        elements = root.findall('DataRecord')
+
+        # Check, if the cached layout still matches the records received and
+        # derive it anew, if not
+        layout = self._layouts.get(key)
+        if (layout == None or len(layout) != len(elements) or any(element.findtext('Unit', '') != unit for element, (unit, record, entry) in zip(elements, layout))):
+            layout = self._build_layout(device, elements)
+            self._layouts[key] = layout
+
+        # Extract and scale the numeric values of the records published
+        values = []
+        for element, (unit, record, entry) in zip(elements, layout):
+            if (entry == None):
+                continue
+            text = element.findtext('Value', '').strip()
+            try:
+                value = int(text)
+            except ValueError:
+                try:
+                    value = float(text)
+                except ValueError:
+                    # Non-numeric values (e.g. dates) are skipped
+                    continue
+            if (record['scale'] != 1):
+                value = round(value*record['scale'], record['digits'])
+            values.append((entry, value))
+
+        return values
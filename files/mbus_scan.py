@@ -0,0 +1,235 @@
+# mbus_scan.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Discovery of the M-Bus devices connected to the bus read out by
+# mqtt_node_client.py.
+#
+# The bus can be scanned either by primary addresses (every address from 0 to
+# 250 is pinged) or by secondary addresses (wildcard search over the
+# identification numbers, cf. mbus_scan_2nd_address_range(...) of libmbus).
+# Every device found is identified by its secondary address (identification
+# number, manufacturer, version and medium; 16 hex digits), which, unlike the
+# primary address, doesn't change if meters are swapped or readdressed. Since a
+# full scan takes minutes at low baud rates, the map of the secondary addresses
+# to the primary addresses found is persisted and only renewed on demand (by
+# removing the file) or after a configurable time-interval.
+
+import json
+import time
+import os
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Address used to address the device selected via its secondary address
+ADDRESS_NETWORK_LAYER=253
+
+# Results of mbus_select_secondary_address(...)
+PROBE_ERROR=-1
+PROBE_NOTHING=0
+PROBE_SINGLE=1
+PROBE_COLLISION=2
+
+# Result of recv_frame(...), if no answer was received within the timeout (cf.
+# MBUS_RECV_RESULT_TIMEOUT of libmbus; other negative results denote invalid
+# frames resp. errors)
+RECV_TIMEOUT=-3
+
+# Range of the primary addresses
+_PRIMARY_ADDRESSES=range(0, 251)
+
+# Digits probed at the positions of the secondary address: BCD digits of the
+# identification number, hex digits of the manufacturer, version and medium (F
+# is the wildcard and can't be probed on its own)
+_ID_DIGITS='0123456789'
+_HEX_DIGITS='0123456789ABCDE'
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Address_Map(object):
+    '''
+    Persistent map of the secondary addresses of the M-Bus devices found to
+    their primary addresses (None, if a device is only addressable by its
+    secondary address).
+    '''
+
+    # Initialization method; load the map stored at the given path
+    def __init__(self, path):
+        '''Initialization method; load the map stored at the given path'''
+        self.path = path
+        self.devices = {}
+        self.scanned = None
+
+        try:
+            with open(self.path, 'r') as map_file:
+                content = json.load(map_file)
+            self.devices = content['devices']
+            self.scanned = content['scanned']
+        except (IOError, OSError, ValueError, KeyError):
+            # No map stored yet resp. invalid map; the bus has to be scanned
+            pass
+
+    # Check, if the bus has to be (re)scanned
+    def due(self, interval):
+        '''Check, if the bus has to be (re)scanned'''
+        if (self.scanned == None):
+            return True
+        return (interval > 0 and time.time()-self.scanned >= interval)
+
+    # Get the primary address of the device with the given secondary address
+    # (None, if it isn't known)
+    def primary(self, secondary):
+        '''Get the primary address of the device with the given secondary address'''
+        secondary = secondary.upper()
+        if (secondary in self.devices):
+            return self.devices[secondary]
+
+        # Look up the first device matching the secondary address given with
+        # wildcards
+        for found, primary in sorted(self.devices.items()):
+            if (matches(secondary, found)):
+                return primary
+        return None
+
+    # Replace the map by the given devices found by a scan and persist it
+    def update(self, devices):
+        '''Replace the map by the given devices found by a scan and persist it'''
+        self.devices = dict((secondary.upper(), primary) for secondary, primary in devices.items())
+        self.scanned = time.time()
+
+        # Replace the stored map atomically
+        directory = os.path.dirname(self.path)
+        if (directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path+'.temp', 'w') as map_file:
+            json.dump({'scanned': self.scanned, 'devices': self.devices}, map_file, indent=1, sort_keys=True)
+            map_file.flush()
+            os.fsync(map_file.fileno())
+        os.rename(self.path+'.temp', self.path)
+
+# Receive the answer of the device currently addressed; return the secondary
+# address of the device (None, if no valid answer was received)
+def _recv_secondary(master, frame_type):
+    '''Receive the answer of the device currently addressed; return its secondary address'''
+    frame = frame_type()
+    if (master._libmbus.recv_frame(master.handle, frame) < 0):
+        return None
+
+    secondary = master._libmbus.frame_get_secondary_address(frame)
+    if (isinstance(secondary, bytes)):
+        secondary = secondary.decode('ascii')
+    return secondary.upper() if secondary else None
+
+# Scan the primary addresses of the bus; return a dictionary mapping the
+# secondary addresses of the devices found to their primary addresses
+def scan_primary(master, frame_type, **kwargs):
+    '''
+    Scan the primary addresses of the bus; return a dictionary mapping the
+    secondary addresses of the devices found to their primary addresses
+
+    Permitted transfer parameters:
+    - addresses (default: 0-250)
+    '''
+    # Evaluate the transfer parameters
+    addresses = kwargs.get('addresses', _PRIMARY_ADDRESSES)
+
+    devices = {}
+    for address in addresses:
+        # Check, if a device answers on the address
+        if (master._libmbus.send_ping_frame(master.handle, address, 1) < 0):
+            continue
+        frame = frame_type()
+        if (master._libmbus.recv_frame(master.handle, frame) < 0):
+            continue
+
+        # Identify the device by the data it responds with
+        master.send_request_frame(address=address)
+        secondary = _recv_secondary(master, frame_type)
+        if (secondary != None):
+            devices[secondary] = address
+
+    return devices
+
+# Scan the secondary addresses of the bus by a wildcard search over the
+# identification numbers (resp. the manufacturer, version and medium of devices
+# sharing an identification number); return a dictionary mapping the secondary
+# addresses of the devices found to None
+def scan_secondary(master, frame_type, **kwargs):
+    '''
+    Scan the secondary addresses of the bus by a wildcard search over the
+    identification numbers (resp. the manufacturer, version and medium of
+    devices sharing an identification number); return a dictionary mapping the
+    secondary addresses of the devices found to None
+
+    Permitted transfer parameters:
+    - mask          (default: FFFFFFFFFFFFFFFF; secondary address to start the
+                    search with, e.g. to restrict it to one manufacturer)
+    - collisions    (default: None; list the masks, that more than one device
+                    still answers to after all the digits have been narrowed,
+                    are appended to; these devices can't be told apart and
+                    aren't returned)
+    '''
+    # Evaluate the transfer parameters
+    mask = kwargs.get('mask', 'FFFFFFFFFFFFFFFF').upper()
+    collisions = kwargs.get('collisions', None)
+
+    devices = {}
+
+    # Replace the wildcards of the identification number digit by digit and
+    # continue with the manufacturer, version and medium, if devices share an
+    # identification number; only the masks, that more than one device answers
+    # to, are narrowed further
+    pending = [(mask, 0)]
+    while (pending):
+        mask, position = pending.pop()
+        while (position < 16 and mask[position] != 'F'):
+            position+=1
+        if (position == 16):
+            # The devices only differ in digits F (resp. are configured with
+            # the same secondary address)
+            if (collisions != None):
+                collisions.append(mask)
+            continue
+
+        answered = 0
+        for digit in (_ID_DIGITS if position < 8 else _HEX_DIGITS):
+            probe = mask[:position]+digit+mask[position+1:]
+            result = master._libmbus.select_secondary_address(master.handle, probe.encode('ascii'))
+
+            if (result == PROBE_SINGLE):
+                answered+=1
+                master.send_request_frame(address=ADDRESS_NETWORK_LAYER)
+                secondary = _recv_secondary(master, frame_type)
+                if (secondary != None):
+                    devices[secondary] = None
+            elif (result == PROBE_COLLISION):
+                answered+=2
+                pending.append((probe, position+1))
+
+        # Less than the two devices answering to the mask have been found, so
+        # the remaining ones have the digit F at this position of the
+        # manufacturer, version or medium; keep the wildcard and narrow the
+        # next position
+        if (position >= 8 and answered < 2):
+            pending.append((mask, position+1))
+
+    return devices
+
+# Select the device with the given secondary address (wildcards allowed); return
+# True, if exactly one device answered
+def select(master, secondary):
+    '''Select the device with the given secondary address'''
+    return master._libmbus.select_secondary_address(master.handle, secondary.upper().encode('ascii')) == PROBE_SINGLE
+
+# Check, if the given secondary address matches the given mask (wildcards F)
+def matches(mask, secondary):
+    '''Check, if the given secondary address matches the given mask'''
+    mask = mask.upper()
+    secondary = secondary.upper()
+    return len(mask) == len(secondary) and all(m == 'F' or m == s for m, s in zip(mask, secondary))
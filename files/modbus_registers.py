@@ -0,0 +1,275 @@
+# modbus_registers.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Helpers to handle the registers of Modbus RTU devices read out by
+# mqtt_node_client.py independently of the bus master used.
+#
+# The read planner merges the register ranges of all values to read from the
+# same device with the same function code (coils, discrete inputs, holding or
+# input registers) into as few read requests as possible, thus minimizing the
+# number of round trips on the bus (every request costs the request/response
+# turnaround as well as the inter-frame gap, which is considerable at low baud
+# rates), and splits the registers resp. bits received back into the individual
+# values afterwards. The plan is compiled once per device table, so reading it
+# out only costs the requests themselves.
+#
+# The register decoder converts the registers of a value into the actual number
+# according to its data type, word and byte order and scale factor. The decoding
+# is precompiled once per value and performed via struct directly on the raw
+# bytes of the response.
+
+import operator
+import struct
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Maximum number of registers resp. bits (coils and discrete inputs) that can be
+# read with one request (limited by the maximum length of a Modbus RTU frame of
+# 256 bytes)
+MAX_REGISTER_COUNT=125
+MAX_BIT_COUNT=2000
+
+# Supported function codes and the corresponding read requests of the bus
+# master (cf. pymodbus)
+FUNCTIONS={
+    1:  'read_coils',
+    2:  'read_discrete_inputs',
+    3:  'read_holding_registers',
+    4:  'read_input_registers',
+}
+
+# Function codes reading bits instead of registers
+BIT_FUNCTIONS=(1, 2)
+
+# Keys of the decoding specification, that only apply to registers
+_REGISTER_KEYS=('type', 'signed', 'word_order', 'byte_order', 'scale')
+
+# Supported data types; struct format character and number of registers
+TYPES={
+    'int16':    ('h', 1),
+    'uint16':   ('H', 1),
+    'int32':    ('i', 2),
+    'uint32':   ('I', 2),
+    'int64':    ('q', 4),
+    'uint64':   ('Q', 4),
+    'float32':  ('f', 2),
+    'float64':  ('d', 4),
+}
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Register_Decoder(object):
+    '''
+    Precompiled decoder converting the registers of one value into the actual
+    number according to its data type, word and byte order and scale factor.
+    '''
+
+    # Initialization method; evaluate the decoding specification of the given
+    # value and precompile the corresponding struct
+    def __init__(self, point, **kwargs):
+        '''
+        Initialization method; evaluate the decoding specification of the given
+        value and precompile the corresponding struct
+
+        The decoding is defined by the keys type (cf. TYPES), word_order ('big'
+        if the first register contains the most significant word, else
+        'little'), byte_order (order of the bytes within the registers; 'big' or
+        'little') and scale (factor the value is multiplied with) of point. If
+        type isn't set, an integer type is derived from the keys register_count
+        and signed.
+
+        Permitted transfer parameters (defaults for keys not set in point):
+        - word_order    (default: big)
+        - byte_order    (default: big)
+        '''
+        # Evaluate the decoding specification
+        if ('type' in point):
+            data_type = point['type']
+        else:
+            data_type = ('' if point.get('signed', 0) else 'u')+'int'+str(16*point.get('register_count', 1))
+        word_order = point.get('word_order', kwargs.get('word_order', 'big'))
+        byte_order = point.get('byte_order', kwargs.get('byte_order', 'big'))
+        self._scale = point.get('scale', 1)
+
+        if (data_type not in TYPES):
+            raise Exception('Invalid data type '+str(data_type)+'!')
+        if (word_order not in ('big', 'little') or byte_order not in ('big', 'little')):
+            raise Exception('Invalid word resp. byte order!')
+
+        fmt, self.register_count = TYPES[data_type]
+        if (point.get('register_count', self.register_count) != self.register_count):
+            raise Exception('Register count doesn\'t match data type '+data_type+'!')
+        self.size = 2*self.register_count
+
+        # Orders, that are equivalent to a plain big resp. little endian value,
+        # can be unpacked directly from the response; any other combination
+        # requires the bytes to be rearranged first
+        self._order = None
+        if (word_order == byte_order or self.register_count == 1):
+            self._struct = struct.Struct(('>' if byte_order == 'big' else '<')+fmt)
+        else:
+            self._struct = struct.Struct('>'+fmt)
+            words = range(self.register_count)
+            if (word_order == 'little'):
+                words = reversed(words)
+            self._order = operator.itemgetter(*[2*word+byte for word in words for byte in ((0, 1) if byte_order == 'big' else (1, 0))])
+
+    # Decode the value starting at offset (in bytes) in the raw data given
+    def decode(self, data, offset=0):
+        '''Decode the value starting at offset (in bytes) in the raw data given'''
+        if (self._order == None):
+            value = self._struct.unpack_from(data, offset)[0]
+        else:
+            value = self._struct.unpack(bytes(self._order(data[offset:offset+self.size])))[0]
+
+        if (self._scale != 1):
+            return value*self._scale
+        return value
+
+class Bit_Decoder(object):
+    '''
+    Decoder converting the coils resp. discrete inputs of one value into an
+    integer (the first bit being the least significant one).
+    '''
+
+    # Initialization method; evaluate the number of bits of the given value
+    def __init__(self, point):
+        '''Initialization method; evaluate the number of bits of the given value'''
+        if (any(key in point for key in _REGISTER_KEYS)):
+            raise Exception('The keys '+', '.join(_REGISTER_KEYS)+' only apply to registers!')
+
+        self.register_count = point.get('register_count', 1)
+        if (not 1 <= self.register_count <= 64):
+            raise Exception('Invalid number of bits!')
+
+    # Decode the value starting at offset (in bits) in the bits given
+    def decode(self, bits, offset=0):
+        '''Decode the value starting at offset (in bits) in the bits given'''
+        if (self.register_count == 1):
+            return int(bool(bits[offset]))
+
+        value = 0
+        for index in range(self.register_count):
+            if (bits[offset+index]):
+                value|=1<<index
+        return value
+
+# Compile the decoder of the given value according to its function code (key
+# function; default: 3); cf. Register_Decoder resp. Bit_Decoder
+def decoder(point, **kwargs):
+    '''Compile the decoder of the given value according to its function code'''
+    function = point.get('function', 3)
+    if (function not in FUNCTIONS):
+        raise Exception('Invalid function code '+str(function)+'!')
+
+    if (function in BIT_FUNCTIONS):
+        return Bit_Decoder(point)
+    return Register_Decoder(point, **kwargs)
+
+class Read_Block(object):
+    '''
+    One read request covering a contiguous range of registers (resp. coils or
+    discrete inputs) of a single device, that contains the registers of one or
+    more values to read out.
+    '''
+
+    # Initialization method; set the device address, the first register of the
+    # block and the function code to read it with
+    def __init__(self, unit, register, function=3):
+        '''Initialization method; set the device address, the first register of the block and the function code'''
+        self.unit = unit
+        self.register = register
+        self.function = function
+        self.count = 0
+
+        # Name of the request of the bus master and type of the response
+        # (registers resp. bits)
+        self.request = FUNCTIONS[function]
+        self.bits = function in BIT_FUNCTIONS
+
+        # Values contained in the block (tuples (point, decoder, offset
+        # relative to register))
+        self.points = []
+
+    # Add the given value to the block and extend the range of registers to read
+    # accordingly
+    def add(self, point, decoder):
+        '''Add the given value to the block and extend the range of registers to read accordingly'''
+        offset = point['register']-self.register
+        self.points.append((point, decoder, offset))
+        self.count = max(self.count, offset+decoder.register_count)
+
+    # Decode all values contained in the block from the registers (resp. bits)
+    # read in one pass; return a list of tuples (point, value)
+    def decode(self, registers):
+        '''Decode all values contained in the block from the registers read in one pass'''
+        if (self.bits):
+            return [(point, decoder.decode(registers, offset)) for point, decoder, offset in self.points]
+
+        data = struct.pack('>'+str(len(registers))+'H', *registers)
+        return [(point, decoder.decode(data, 2*offset)) for point, decoder, offset in self.points]
+
+# Merge the register ranges of the given values into the smallest number of read
+# requests possible
+def plan_reads(points, **kwargs):
+    '''
+    Merge the register ranges of the given values into the smallest number of
+    read requests possible and return them as a list of Read_Block instances
+
+    Each entry of points has to define the keys address and register as well as
+    the keys register_count or type (cf. Register_Decoder resp. Bit_Decoder,
+    which every value is compiled to) and may define the key function (function
+    code; default: 3). Values of the same device and function code are merged,
+    as long as the resulting request doesn't exceed max_count registers (resp.
+    max_bit_count bits) and there are no more than max_gap unused registers
+    (resp. 16 times as many bits) between them (these are read as well but
+    discarded afterwards). The requests are ordered by the first appearance of
+    the device address in points, by function code and by register.
+
+    Permitted transfer parameters:
+    - max_gap       (default: 0)
+    - max_count     (default: 125)
+    - max_bit_count (default: 2000)
+    - word_order    (default: big)
+    - byte_order    (default: big)
+    '''
+    # Evaluate the transfer parameters
+    max_gap = kwargs.get('max_gap', 0)
+    max_count = kwargs.get('max_count', MAX_REGISTER_COUNT)
+    max_bit_count = kwargs.get('max_bit_count', MAX_BIT_COUNT)
+
+    # Compile the decoders and group the values by device address and function
+    # code while preserving the order of the device table
+    units = []
+    points_by_unit = {}
+    for point in points:
+        point_decoder = decoder(point, word_order=kwargs.get('word_order', 'big'), byte_order=kwargs.get('byte_order', 'big'))
+
+        if (point['address'] not in points_by_unit):
+            units.append(point['address'])
+            points_by_unit[point['address']] = {}
+        points_by_unit[point['address']].setdefault(point.get('function', 3), []).append((point, point_decoder))
+
+    # Merge the register ranges of every device and function code greedily in
+    # ascending order, which results in the minimal number of requests for the
+    # given limits
+    blocks = []
+    for unit in units:
+        for function, entries in sorted(points_by_unit[unit].items()):
+            gap, count = (16*max_gap, max_bit_count) if function in BIT_FUNCTIONS else (max_gap, max_count)
+            block = None
+            for point, point_decoder in sorted(entries, key=lambda entry: entry[0]['register']):
+                end = point['register']+point_decoder.register_count
+                if (block == None or point['register']-(block.register+block.count) > gap or max(end, block.register+block.count)-block.register > count):
+                    block = Read_Block(unit, point['register'], function)
+                    blocks.append(block)
+                block.add(point, point_decoder)
+
+    return blocks
@@ -19,8 +19,27 @@
 # capable device.
 
 import paho.mqtt.client as mqtt
+import buffered_writer
+import queue_logger
 import pymodbus.client.sync as modbus
 import mbus.MBus as mbus
+import modbus_registers
+import node_scheduler
+import node_storage
+import mqtt_payload
+import node_filter
+import node_aggregate
+import mbus_records
+import mbus_scan
+import node_health
+import node_metrics
+import node_modbus_server
+import node_config
+import node_hotplug
+import concurrent.futures
+import threading
+import asyncio
+import signal
 import time
 import ssl
 import sys
@@ -35,28 +54,65 @@ import os
 # System paths
 _LOG='/var/log/mqtt_node_client/mqtt_node_client.log'
 _DB='/var/lib/mqtt_node_client/mqtt_node_client.db.csv'
+_HISTORY='/var/lib/mqtt_node_client/mqtt_node_client.history'
+_QUEUE='/var/lib/mqtt_node_client/queue'
 
 _USER_CREDENTIALS='/usr/local/etc/mqtt_node_client/user_credentials'
 _CA='/usr/local/share/ca-certificates/ca_cert.pem'
 
 _LIBMBUS_SO='/usr/local/lib/libmbus.so'
 
+# Engine driving the node
+# 0 - Threads (one thread per bus, the network thread of the MQTT client and
+#     further threads draining the outbound queue and flushing the files)
+# 1 - asyncio event loop (the readout schedules, the network traffic of the MQTT
+#     client, the outbound queue and the flushes of the files are handled by
+#     one event loop; only the blocking bus requests are run in one executor
+#     thread per bus)
+_ENGINE_MODE=1
+
 # MQTT:
 
-# User credentials
-with open(_USER_CREDENTIALS, 'r') as user_credentials:
-    _USERNAME=user_credentials.readline().rstrip('\n')
-    _PASSWORD=user_credentials.readline().rstrip('\n')
+# Topic to publish to (None - emra/<username>; the username is read from
+# _USER_CREDENTIALS); if the node disconnects unexpectedly, the broker publishes
+# its will on _TOPIC followed by /$node
+_TOPIC=None
 
-# Topic to publish to
-_TOPIC='emra/'+_USERNAME
+# Local storage of the values read
+# 0 - Fixed-size ring buffer (_HISTORY; once full, the oldest values are
+#     overwritten)
+# 1 - CSV database (_DB; grows without bound and has to be trimmed periodically
+#     by mqtt_node_client_cleanup.sh)
+_STORAGE_MODE=0
+
+# Capacity of the ring buffer (in values; every value occupies 20 bytes)
+_HISTORY_CAPACITY=500000
 
 # CSV delimiter
 _CSV_DELIMITER=','
 
-# Local IP-address to bind the MQTT client to
-with os.popen('ifconfig wlan0 | grep "inet\ addr" | cut -d: -f2 | cut -d" " -f1', 'r') as ip_addr_local:
-    _IP_ADDR_LOCAL=ip_addr_local.read()
+# Flush policy of the log file and the database; the entries are buffered in
+# memory and written to the files as soon as one of the following limits is
+# reached
+# Number of bytes buffered
+_FLUSH_BYTES=4096
+# Number of entries buffered
+_FLUSH_RECORDS=50
+# Time since the last flush (in s)
+_FLUSH_INTERVAL=30
+
+# Severity level of the messages written to the log file ('debug', 'info',
+# 'warning' or 'error')
+_LOG_LEVEL='info'
+
+# Maximum number of log messages per second of the given functions (e.g. one
+# per value read resp. per message published); further messages are suppressed
+# and counted (cf. queue_logger.py)
+_LOG_RATE_LIMITS={'_process_data': 1, '_on_publish_cb': 1}
+
+# Network interface to bind the MQTT client to (its IP-address is looked up on
+# start-up; '' - any interface)
+_LOCAL_INTERFACE='wlan0'
 
 # Remote IP-address of the MQTT broker
 _IP_ADDR_REMOTE='192.168.42.1'
@@ -69,6 +125,51 @@ _MQTT_PORT=8883
 # client pings the broker)
 _MQTT_TIMEOUT=60
 
+# Store-and-forward of the messages to publish
+# 0 - Hand the messages to the MQTT client directly (messages not yet published
+#     are lost if the program is restarted while the broker is unreachable)
+# 1 - Store the messages in an on-disk queue (_QUEUE) first and publish them
+#     from there; the queue survives restarts and is drained in order as soon
+#     as the connection to the broker is (re-)established
+_QUEUE_MODE=1
+
+# Maximum size of the on-disk queue (in bytes; if exceeded, the oldest messages
+# are dropped)
+_QUEUE_MAX_BYTES=67108864
+
+# Maximum number of messages published from the queue per second (0 - no limit)
+_DRAIN_RATE=20
+
+# Maximum number of messages published, but not yet acknowledged by the broker
+_MAX_INFLIGHT=20
+
+# Batching of the values to publish
+# 0 - Publish every value as a separate message in plain text
+# 1 - Collect the values and publish them together as one message in a compact
+#     binary format (cf. mqtt_payload.py) on emra/<username>/$batch, which is
+#     unpacked again by mqtt_server_client.py
+_BATCH_MODE=1
+
+# Maximum number of values per batch
+_BATCH_SIZE=60
+
+# Maximum time-interval the values are collected for before the batch is
+# published (in s)
+_BATCH_INTERVAL=60
+
+# Compression of the batches via zlib
+# 0 - Uncompressed
+# 1 - Compressed
+_BATCH_COMPRESS=1
+
+# Version of the format of the batches (cf. mqtt_payload.py; the server has to
+# support the version)
+# 1 - Fixed-size values (int64, float64) and timestamps
+# 2 - Values and timestamps of every topic as differences to their
+#     predecessors in varints; energy counters and periodical timestamps shrink
+#     to one or two bytes per value
+_BATCH_VERSION=2
+
 # Modbus RTU/M-Bus (general):
 
 # Operation mode; determines which bus-protocol is chosen
@@ -82,36 +183,170 @@ _BUS_PORT='/dev/ttyUSB0'
 # Baud rate to use
 _BAUDRATE=9600
 
-# Address of the Modbus RTU resp. M-Bus device to read from
-_BUS_ADDRESS=1
-
-# Time-interval between the readout procedures (in s)
+# Time-interval between the readout procedures (in s; default period of the
+# entries of the device table, cf. the keys interval and group)
 _READ_INTERVAL=5
 
-# Modbus RTU:
-
-# (Start-)Register to read out (Modbus specific)
-_MODBUS_REGISTER=50536
+# Alignment of the readout procedures to the wall clock
+# 0 - Start the first readout procedure immediately
+# 1 - Align the readout procedures to multiples of _READ_INTERVAL of the wall
+#     clock (e.g. to every full 5 seconds), so that the devices of different
+#     nodes are read out at the same instant (requires synchronized clocks)
+_READ_ALIGN=1
+
+# Share of _READ_INTERVAL the requests of one readout procedure may occupy the
+# bus for (0 - no limit). The time every request occupies the bus is measured;
+# if the requests don't fit into the budget (e.g. too many devices for a low
+# baud rate), the entries of low priority (cf. the key priority of the device
+# table) are only read out during every 2nd, 4th, ... readout procedure and a
+# warning is logged, so the critical entries are never starved.
+_BUS_BUDGET=0.8
+
+# Poll groups, that the entries of the device table can be assigned to via the
+# key group instead of setting the keys interval and priority individually
+_POLL_GROUPS={
+    'fast': {'interval': 1, 'priority': 0},
+    'counters': {'interval': 900},
+    'nameplate': {'interval': 86400, 'priority': 2},
+}
+
+# Device table; every entry describes one value to read out from the bus. All
+# entries are polled round-robin by the same bus master during every readout
+# procedure, so any number of devices connected to the same bus can be served
+# by one client. Multiple entries may refer to the same device address.
+#
+# Keys (general):
+# - address         Address of the Modbus RTU resp. M-Bus device to read from
+# - topic           Suffix appended to _TOPIC to publish the value on (e.g.
+#                   emra/<username>/<topic>); also used as identifier in the
+#                   database (optional; if not set, the value is published on
+#                   _TOPIC directly)
+# - deadband, deadband_percent, max_silence
+#                   Rules of the report-by-exception filter for this entry
+#                   (optional; cf. below; defaults: _DEADBAND,
+#                   _DEADBAND_PERCENT and _MAX_SILENCE)
+# - aggregate       Aggregation of the values of this entry (optional; cf.
+#                   _AGGREGATE_MODE for the possible values; only effective, if
+#                   _AGGREGATE_MODE isn't 0; default: _AGGREGATE_MODE)
+# - priority        Priority of the entry, if the bus is oversubscribed (cf.
+#                   _BUS_BUDGET; optional; default: 1)
+#                   0 - Critical (read out during every readout procedure)
+#                   1, 2, ... - The entries of the highest number are the
+#                   first to be read out less often
+#                   Entries of a higher priority are always read out before
+#                   the ones of a lower priority, that are due at the same time.
+# - interval        Period to read out the entry with (in s; optional; default:
+#                   _READ_INTERVAL). The entries due are read out earliest
+#                   deadline first; the bus is polled at the shortest period of
+#                   all entries, so the periods should be multiples of it.
+# - group           Name of a poll group to take the keys interval and priority
+#                   from (cf. _POLL_GROUPS; optional; keys set in the entry
+#                   itself take precedence)
+#
+# Keys (Modbus RTU specific):
+# - function        Function code to read the entry with (optional; default: 3)
+#                   1 - Read coils
+#                   2 - Read discrete inputs
+#                   3 - Read holding registers
+#                   4 - Read input registers
+#                   Coils and discrete inputs are read as integers (the bit at
+#                   register being the least significant one); the keys type,
+#                   signed, word_order, byte_order and scale only apply to
+#                   registers.
+# - register        (Start-)Register (resp. coil or discrete input) to read out
+# - register_count  Number of registers (resp. bits; optional; default: 1) to
+#                   read out starting from register
+#                   One register is of 16 bits length, so to e.g. read out a 32
+#                   bit long variable, register_count has to be set to 2 and so
+#                   on.
+# - type            Data type of the value (int16, uint16, int32, uint32,
+#                   int64, uint64, float32 or float64; optional; if not set, an
+#                   unsigned resp. signed integer type matching register_count
+#                   is used)
+# - signed          Signing of the default integer type (optional)
+#                   0 - Unsigned
+#                   1 - Signed
+# - word_order, byte_order
+#                   Order of the registers resp. of the bytes within the
+#                   registers (optional; cf. below for the possible values;
+#                   defaults: _MODBUS_WORD_ORDER and _MODBUS_BYTE_ORDER)
+# - scale           Factor the value is multiplied with (optional)
+#
+# Keys (M-Bus specific):
+# - secondary       Secondary address of the device (16 hex digits;
+#                   identification number, manufacturer, version and medium; F
+#                   as wildcard, e.g. 12345678FFFFFFFF); the device is addressed
+#                   by it instead of by address, so it can be found regardless
+#                   of its primary address (via the primary address found by
+#                   the last scan, if any)
+# - records         Ids resp. names of the data records of the device to
+#                   publish (optional; if not set, all numeric records are
+#                   published). Every record is published on its own sub-topic
+#                   named after its quantity, function, storage number, tariff
+#                   and subunit (e.g. emra/<username>/<topic>/energy_s1_t2).
+_DEVICES=[
+    {'address': 1, 'topic': 'meter1', 'register': 50536, 'register_count': 2},
+]
+
+# Report-by-exception filtering of the values read (cf. node_filter.py)
+# 0 - Store and publish every value read
+# 1 - Only store and publish values, that differ from the value reported last
+#     of the same entry by more than the deadband, or if no value of the entry
+#     has been reported for _MAX_SILENCE seconds
+_FILTER_MODE=1
+
+# Default absolute deadband (values deviating from the value reported last by
+# no more than this are suppressed; 0 - only unchanged values are suppressed)
+_DEADBAND=0
+
+# Default deadband in percent of the value reported last (the larger one of
+# both deadbands applies)
+_DEADBAND_PERCENT=0
+
+# Default maximum time-interval without a value of an entry being reported (in
+# s; heartbeat; 0 - no heartbeat)
+_MAX_SILENCE=900
+
+# Aggregation of the values read over time windows (cf. node_aggregate.py)
+# 0 - Store and publish the values read only
+# 1 - Only store and publish the statistics of the windows (non-numeric values,
+#     e.g. error messages, are still reported as read)
+# 2 - Store and publish both the values read and the statistics of the windows
+# The statistics are published on sub-topics of the topic of the entry named
+# after the window and the statistic (e.g. emra/<username>/meter1/60s/max) and
+# aren't subject to the report-by-exception filter.
+_AGGREGATE_MODE=0
+
+# Windows to aggregate the values over; every window is defined by its length
+# (in s), the time-interval its statistics are reported after (hop (in s);
+# default: length - tumbling window, otherwise sliding window; the length has
+# to be a multiple of the hop) and its name (default: <length>s). The windows
+# are aligned to the epoch (e.g. a window of 60 s ends on every full minute).
+_AGGREGATE_WINDOWS=[
+    {'length': 60},
+]
+
+# Statistics reported per window (min, max, mean, last, count)
+_AGGREGATE_STATISTICS=['min', 'max', 'mean', 'last']
 
-# Number of registers to read out starting from _MODBUS_REGISTER
-# One register is of 16 bits length, so to e.g. read out a 32 bit long variable,
-# _MODBUS_REGISTER_COUNT has to be set to 2 and so on.
-_MODBUS_REGISTER_COUNT=2
+# Modbus RTU:
 
-# Signed
-# 0 - Unsigned
-# 1 - Signed
-_MODBUS_SIGNED=0
+# Maximum number of unused registers between two values of the same device that
+# are read over in order to merge them into one request (the registers in
+# between have to be readable, though; set to 0 for devices that respond with an
+# exception to reads covering unmapped registers)
+_MODBUS_MAX_GAP=10
 
-# Endianness
-# 0 - Big Endian
-# 1 - Little Endian
-_MODBUS_ENDIANNESS=0
+# Default word order (order of the registers of values spanning more than one
+# register)
+# big    - Most significant register first
+# little - Least significant register first
+_MODBUS_WORD_ORDER='big'
 
-# Bit significance
-# 0 - MSB
-# 1 - LSB
-_MODBUS_BIT_SIGNIFICANCE=0
+# Default byte order (order of the bytes within the single registers)
+# big    - Most significant byte first
+# little - Least significant byte first
+_MODBUS_BYTE_ORDER='big'
 
 # Number of stop bits
 _MODBUS_STOPBITS=1
@@ -129,10 +364,162 @@ _MODBUS_PARITY='N'
 # period of time, the master asserts that the slave timed out and raises an error)
 _MODBUS_TIMEOUT=3
 
+# M-Bus:
+
+# Discovery of the devices connected to the bus; the devices found are read out
+# in addition to the devices of the device table (published on
+# emra/<username>/<identification number>)
+# 0 - Only read out the devices of the device table
+# 1 - Scan the primary addresses (0-250)
+# 2 - Scan the secondary addresses (wildcard search)
+_MBUS_SCAN=0
+
+# Location of the map of the addresses found by the scan (the name of the port
+# is appended, e.g. mbus_addresses_ttyUSB0.json); remove the file to trigger a
+# new scan
+_MBUS_ADDRESS_MAP='/var/lib/mqtt_node_client/mbus_addresses'
+
+# Time-interval between two scans (in s; a full scan can take several minutes
+# at low baud rates; 0 - only scan, if there's no map yet)
+_MBUS_SCAN_INTERVAL=0
+
+# Unresponsive devices (cf. node_health.py):
+
+# Adaptation of the timeout to the response times of every single device
+# 0 - Always wait for the full timeout (_MODBUS_TIMEOUT)
+# 1 - Wait for 1.5 times the 95th percentile of the response times of the
+#     device plus 0.1 s (at most _MODBUS_TIMEOUT; Modbus RTU only, the timeout
+#     of libmbus isn't configurable)
+_ADAPTIVE_TIMEOUT=1
+
+# Number of failed requests in a row after which a device is considered
+# offline; offline devices are only probed after an exponentially growing
+# interval (starting at _READ_INTERVAL, at most _MAX_BACKOFF s). The transitions
+# between online and offline are published once on _TOPIC followed by
+# /$state/<topic> (resp. /$state/<address>, if the entry doesn't define a topic),
+# so they never share a path with the values of the device.
+_OFFLINE_AFTER=3
+_MAX_BACKOFF=3600
+
+# Metrics (cf. node_metrics.py):
+
+# Port of the local HTTP endpoint exposing the metrics of the node (latencies of
+# the bus requests, errors per device, latency of the publishes until the broker
+# acknowledged them, depth of the outbound queue, overruns, ...) in the
+# Prometheus text format on http://<host>:<port>/metrics (0 - disabled)
+_METRICS_PORT=9480
+
+# Address to bind the endpoint to (127.0.0.1 - local access only; '' - all
+# interfaces)
+_METRICS_HOST='127.0.0.1'
+
+# Time-interval between two publishes of the metrics on
+# emra/<username>/$metrics (in s; 0 - never)
+_METRICS_INTERVAL=0
+
+# Modbus TCP server:
+
+# Port of the local Modbus TCP server serving the registers (resp. coils and
+# discrete inputs) of the Modbus RTU devices read last from memory, so other
+# clients (e.g. a SCADA system) can read them without additional load on the bus
+# (cf. node_modbus_server.py; every device is served as the unit of its address
+# plus the key unit_offset of its bus, cf. _BUSES; 0 - disabled)
+_MODBUS_SERVER_PORT=0
+
+# Address to bind the server to (127.0.0.1 - local access only; '' - all
+# interfaces)
+_MODBUS_SERVER_HOST='127.0.0.1'
+
+# Maximum age of the values served (in s; older values, e.g. of offline
+# devices, are answered with an exception; 0 - no limit)
+_MODBUS_SERVER_MAX_AGE=60
+
+# Multiple buses:
+
+# Additional buses to read out concurrently to the bus defined above (e.g. a
+# Modbus RTU bus on /dev/ttyUSB0 and an M-Bus on /dev/ttyUSB1). Every bus is
+# served by its own worker thread with its own readout schedule, while the
+# values read from all buses are stored and published by the same client.
+#
+# Keys:
+# - op_mode         Operation mode of the bus (cf. _OP_MODE)
+# - port            Port which the devices are connected to
+# - devices         Device table of the bus (cf. _DEVICES; the topics have to be
+#                   unique across all buses)
+# - baudrate, read_interval, align, ...
+#                   Settings of the bus (optional; cf. the transfer parameters
+#                   of bus_add(...); defaults: the respective settings above)
+_BUSES=[
+    # {'op_mode': 1, 'port': '/dev/ttyUSB1', 'devices': [{'address': 1, 'topic': 'heat1'}]},
+]
+
+# Hot-plugging of the serial ports (cf. node_hotplug.py)
+# 0 - A bus is given up, once its port has disappeared
+# 1 - The ports are watched via inotify; while the port of a bus is missing,
+#     the bus isn't polled (the values of the other buses are still published
+#     resp. queued and the devices of the bus are reported offline), and it's
+#     reopened as soon as the port reappears. A port missing on start-up is
+#     opened once it appears.
+_HOTPLUG_MODE=1
+
+# Configuration file:
+
+# Configuration file in the JSON format overriding the settings above (cf.
+# node_config.py; the keys are the names of the settings in lower case without
+# the leading underscore, e.g. {"read_interval": 10, "devices": [...]}). The
+# file is read again on SIGHUP (service mqtt_node_client reload); changes of
+# the device tables, the readout schedules and the filter rules are applied
+# without closing the serial ports or the connection to the MQTT broker, while
+# any other changes take effect after a restart. The path can be overridden by
+# the environment variable MQTT_NODE_CLIENT_CONFIG (e.g. to run the node against
+# simulated buses, cf. scripts/node_benchmark.py).
+_CONFIG=os.environ.get('MQTT_NODE_CLIENT_CONFIG', '/usr/local/etc/mqtt_node_client/config.json')
+
 #------------------------------#
 ######## Implementation ########
 #------------------------------#
 
+class Bus_Worker(object):
+    '''
+    State of one bus read out by MQTT_Node_Client: the bus master, the device
+    table, the readout schedule and the worker thread driving it.
+    '''
+
+    # Initialization method; set the operation mode, the port and the device
+    # table of the bus
+    def __init__(self, op_mode, port, devices):
+        '''Initialization method; set the operation mode, the port and the device table of the bus'''
+        self.op_mode = op_mode
+        self.port = port
+        self.devices = devices
+        self.configured = devices
+
+        self.master = None
+        self.protocol = None
+        self.read = None
+        self.read_interval = 5
+        self.interval = None
+        self.align = 0
+        self.pending = None
+        self.hotplug = 0
+        self.present = True
+        self.open_kwargs = {}
+        self.scheduler = None
+        self.rates = None
+        self.read_plan = None
+        self.unit_offset = 0
+        self.decoder = None
+        self.address_map = None
+        self.scan = 0
+        self.scan_interval = 0
+        self.health = {}
+        self.health_policy = {}
+        self.budget = None
+        self.budget_share = 0
+        self.thread = None
+        self.executor = None
+        self.overruns = 0
+
 class MQTT_Node_Client(object):
     '''
     This combined implementation of the Python paho-mqtt client, pymodbus and
@@ -164,25 +551,146 @@ class MQTT_Node_Client(object):
         Permitted transfer parameters:
         - log_file      (default: /var/log/mqtt_node_client/mqtt_node_client.log)
         - database      (default: /var/lib/mqtt_node_client/mqtt_node_client.db.csv)
+        - history       (default: None; if set, the values read are stored in a
+                        ring buffer at this path instead of in database)
+        - history_capacity (default: 500000)
         - delimiter     (default: ,)
+        - flush_bytes   (default: 4096)
+        - flush_records (default: 50)
+        - flush_interval (default: 30)
+        - log_level     (default: info)
+        - log_rate_limits (default: {})
+        - deadband      (default: None; if set (resp. if deadband_percent or
+                        max_silence is set), values are filtered by a report-
+                        by-exception filter with these default rules)
+        - deadband_percent (default: 0)
+        - max_silence   (default: 0)
+        - aggregate     (default: 0; if set, the values are aggregated over
+                        time windows; cf. _AGGREGATE_MODE)
+        - windows       (default: [{'length': 60}]; cf. _AGGREGATE_WINDOWS)
+        - statistics    (default: min, max, mean, last; cf.
+                        _AGGREGATE_STATISTICS)
+        - engine        (default: 0; 0 - threads, 1 - asyncio event loop; cf.
+                        _ENGINE_MODE)
         '''
         # Evaluate the transfer parameters
-        self._log = kwargs.get('log_file', '/var/log/mqtt_node_client/mqtt_node_client.log')
-        self._db = kwargs.get('database', '/var/lib/mqtt_node_client/mqtt_node_client.db.csv')
+        log_file = kwargs.get('log_file', '/var/log/mqtt_node_client/mqtt_node_client.log')
+        database = kwargs.get('database', '/var/lib/mqtt_node_client/mqtt_node_client.db.csv')
+        history = kwargs.get('history', None)
+        history_capacity = kwargs.get('history_capacity', 500000)
         self._csv_delimiter = kwargs.get('csv_delimiter', ',')
-
-        # Set the start time and initialize _client and _bus_master
+        flush_bytes = kwargs.get('flush_bytes', 4096)
+        flush_records = kwargs.get('flush_records', 50)
+        flush_interval = kwargs.get('flush_interval', 30)
+        log_level = kwargs.get('log_level', 'info')
+        log_rate_limits = kwargs.get('log_rate_limits', {})
+        deadband = kwargs.get('deadband', None)
+        deadband_percent = kwargs.get('deadband_percent', 0)
+        max_silence = kwargs.get('max_silence', 0)
+        self._aggregate_mode = kwargs.get('aggregate', 0)
+        windows = kwargs.get('windows', [{'length': 60}])
+        statistics = kwargs.get('statistics', ['min', 'max', 'mean', 'last'])
+        self._engine = kwargs.get('engine', 0)
+
+        # Set the start time (the log messages are stamped with the uptime)
         self._startTime = time.time()
+
+        # Open the log file and the database resp. the ring buffer; the files
+        # are kept open and the text files are written to in a buffered way
+        # (cf. buffered_writer.py and node_storage.py); with the asyncio engine,
+        # the files are flushed by the event loop instead of separate threads;
+        # the log messages are written by a separate thread in either case, so
+        # logging doesn't delay the bus requests or the MQTT client (cf.
+        # queue_logger.py)
+        self._log = queue_logger.Queue_Logger(log_file, level=queue_logger.LEVELS[log_level], rate_limits=log_rate_limits, stamp=self.get_uptime, flush_bytes=flush_bytes, flush_records=flush_records, flush_interval=flush_interval)
+        self._db = None
+        self._history = None
+        if (history != None):
+            self._history = node_storage.Ring_Buffer_Store(history, history_capacity)
+        else:
+            self._db = buffered_writer.Buffered_Writer(database, flush_bytes=flush_bytes, flush_records=flush_records, flush_interval=flush_interval, flush_thread=(self._engine == 0))
+
+        # Initialize _client, _topic and _buses
         self._client = None
-        self._bus_master = None
+        self._topic = ''
+        self._buses = []
+
+        # The values read by the worker threads of the single buses are
+        # processed one after another
+        self._process_lock = threading.Lock()
+
+        # Initialize the event loop of the asyncio engine
+        self._loop = None
+        self._async_drain_event = None
+        self._stopping = False
+        self._mqtt_socket = None
+        self._mqtt_fd = None
+        self._flush_interval = flush_interval
+
+        # Write the records of the ring buffer to the storage device every flush
+        # interval (with the asyncio engine, cf. _flush_task(...))
+        if (self._history != None and self._engine == 0):
+            history_thread = threading.Thread(target=self._history_loop, daemon=True)
+            history_thread.start()
+
+        # Initialize the outbound queue and the bookkeeping of the messages
+        # published, but not yet acknowledged by the broker
+        self._queue = None
+        self._connected = threading.Event()
+        self._drain_event = threading.Event()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._early_acks = set()
+
+        # Initialize the batch of values to publish
+        self._batch = []
+        self._batch_start = None
+        self._batch_size = 0
+
+        # Initialize the report-by-exception filter
+        self._filter = None
+        if (deadband != None or deadband_percent or max_silence):
+            self._filter = node_filter.Deadband_Filter(deadband=deadband or 0, deadband_percent=deadband_percent, max_silence=max_silence)
+
+        # Initialize the aggregation of the values over time windows
+        self._aggregator = None
+        if (self._aggregate_mode):
+            self._aggregator = node_aggregate.Window_Aggregator(windows=windows, statistics=statistics)
+
+        # Initialize the metrics of the node (exposed resp. published by
+        # metrics_init(...))
+        self._metrics = node_metrics.Metrics_Registry()
+        self._metrics.define('node_uptime_seconds', 'gauge', 'Uptime of the process.')
+        self._metrics.define('node_bus_request_seconds', 'histogram', 'Duration of the bus requests answered by the device.')
+        self._metrics.define('node_bus_errors_total', 'counter', 'Failed bus requests by kind (timeout - no answer, invalid - corrupt answer (e.g. CRC error), exception - exception response).')
+        self._metrics.define('node_device_online', 'gauge', 'State of the bus device (1 - online, 0 - offline).')
+        self._metrics.define('node_bus_overruns_total', 'counter', 'Readout procedures, that overran their interval.')
+        self._metrics.define('node_bus_skipped_ticks_total', 'counter', 'Ticks of the readout schedule skipped due to overruns.')
+        self._metrics.define('node_bus_missed_deadlines_total', 'counter', 'Requests sent after the end of their period.')
+        self._metrics.define('node_bus_utilisation_ratio', 'gauge', 'Share of the interval the bus was occupied by the last readout procedure.')
+        self._metrics.define('node_bus_demand_ratio', 'gauge', 'Share of the interval the requests of the bus require without stretching.')
+        self._metrics.define('node_publish_seconds', 'histogram', 'Duration from handing a message to the MQTT client until the broker acknowledged it.', buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+        self._metrics.define('node_inflight_messages', 'gauge', 'Messages published, but not yet acknowledged by the broker.')
+        self._metrics.define('node_queue_depth', 'gauge', 'Messages in the outbound queue not yet acknowledged by the broker.')
+        self._metrics.define('node_queue_dropped_segments_total', 'counter', 'Segments of the outbound queue dropped because it exceeded its maximum size.')
+        self._metrics.define('node_filter_values_total', 'counter', 'Values checked by the report-by-exception filter by result.')
+        self._metrics.define('node_modbus_server_requests_total', 'counter', 'Requests answered by the Modbus TCP server.')
+        self._metrics.define('node_modbus_server_exceptions_total', 'counter', 'Requests answered with an exception by the Modbus TCP server.')
+        self._metrics.collector(self._collect_metrics)
+        self._metrics_server = None
+        self._metrics_interval = 0
+
+        # Register image of the Modbus TCP server (cf. modbus_server_init(...))
+        self._modbus_image = None
+        self._modbus_server = None
 
         try:
             # Create the references between the externally usable API elements
             # and the corresponging internal functions depending on the chosen
             # operation mode, thus covering up internal complexity and
-            # simplifying the usage of the class, whilst making sure, that only
-            # one bus master is activ at the same time (cf. facade pattern
-            # (software design pattern))
+            # simplifying the usage of the class for nodes serving a single bus
+            # (cf. facade pattern (software design pattern)); multiple buses of
+            # any operation mode can be served via bus_add(...) and bus_run()
             # 0 - Modbus RTU
             # 1 - M-Bus
             if (op_mode == 0):
@@ -196,8 +704,7 @@ class MQTT_Node_Client(object):
                 raise Exception('Invalid operation mode!')
         except:
             # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' __init__: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('__init__', 'Error: '+str(sys.exc_info()[1]))
 
             # Exit the program
             sys.exit()
@@ -205,9 +712,279 @@ class MQTT_Node_Client(object):
     # General:
 
     # Get the uptime of the process and format the output
-    def get_uptime(self):
-        '''Get the uptime of the process and format the output'''
-        return str(int(time.time()-self._startTime))
+    def get_uptime(self, timestamp=None):
+        '''Get the uptime of the process (resp. at the given time) and format the output'''
+        return str(int((time.time() if timestamp == None else timestamp)-self._startTime))
+
+    # Get the topic to publish the values read from the given device table
+    # entry on
+    def _device_topic(self, device):
+        '''Get the topic to publish the values read from the given device table entry on'''
+        if ('topic' in device):
+            return self._topic+'/'+device['topic']
+        return self._topic
+
+    # Get the topic to publish the state (online resp. offline) of the device of
+    # the given device table entry on; the states are kept apart from the values
+    # (cf. mqtt_server_client.py, which stores every topic as a file)
+    def _state_topic(self, device):
+        '''Get the topic to publish the state of the device of the given device table entry on'''
+        return self._topic+'/$state/'+str(device.get('topic', device['address']))
+
+    # Log, store and publish the value read from the given device table entry
+    # (called by the worker threads of all buses)
+    def _process_data(self, device, data):
+        '''Log, store and publish the value read from the given device table entry'''
+        with self._process_lock:
+            self._process(device, data)
+
+    # Log, store and publish the value read from the given device table entry
+    # (the lock has to be held by the caller)
+    def _process(self, device, data):
+        '''Log, store and publish the value read from the given device table entry'''
+        topic = self._device_topic(device)
+
+        # Aggregate the value over the time windows (cf. node_aggregate.py);
+        # only the statistics of numeric values are reported instead of the
+        # values themselves, if so configured
+        if (self._aggregator != None):
+            mode = device.get('aggregate', self._aggregate_mode)
+            now = time.time()
+            self._aggregate_report(now)
+            if (mode and self._aggregator.add(topic, data, now) and mode == 1):
+                return
+
+        # Drop values, that don't have to be reported (cf. node_filter.py)
+        if (self._filter != None):
+            rules = {}
+            for key in ('deadband', 'deadband_percent', 'max_silence'):
+                if (key in device):
+                    rules[key] = device[key]
+            if (not self._filter.check(topic, data, **rules)):
+                return
+
+        # Write the message read to the log file
+        self._log.info('_process_data', 'Data read from device ', device['address'], ': ', data)
+
+        self._report(topic, data, 'device '+str(device['address']))
+
+    # Store and publish the statistics of the time windows, that have ended up
+    # to the given time (the lock has to be held by the caller)
+    def _aggregate_report(self, now):
+        '''Store and publish the statistics of the time windows, that have ended up to the given time'''
+        for topic, window, statistics, end in self._aggregator.due(now):
+            for statistic, value in sorted(statistics.items()):
+                self._report(topic+'/'+window+'/'+statistic, value, 'window '+window+' of '+topic)
+
+    # Store and publish the given value on the given topic; source describes the
+    # origin of the value in error messages (the lock has to be held by the
+    # caller)
+    def _report(self, topic, data, source):
+        '''Store and publish the given value on the given topic'''
+        # Write the message read to the ring buffer resp. the database; the
+        # value is identified by its topic relative to the topic of the node
+        # (e.g. meter1 resp. heat1/energy)
+        name = topic[len(self._topic)+1:] or topic[topic.rfind('/')+1:]
+        if (self._history != None):
+            try:
+                self._history.append(time.time(), node_storage.point_id(name), float(data))
+            except (TypeError, ValueError):
+                self._log.error('_process_data', 'Error: Non-numeric data of '+source+' can\'t be stored in the ring buffer!')
+        else:
+            self._db.write(self.get_uptime()+self._csv_delimiter+name+self._csv_delimiter+str(data)+'\n')
+
+        # Check, if the MQTT client has already been initialized
+        if self._client != None:
+            if self._batch_size:
+                # Add the data received from the device to the current batch
+                self._batch_append(topic, data)
+            else:
+                # Publish the data received from the device
+                self.mqtt_publish(data, topic=topic)
+
+    # Add the given value to the current batch and publish the batch, if it is
+    # full or if the values have been collected for long enough
+    def _batch_append(self, topic, data):
+        '''Add the given value to the current batch and publish the batch, if it is full or if the values have been collected for long enough'''
+        if (not self._batch):
+            self._batch_start = time.monotonic()
+        self._batch.append((topic[len(self._topic)+1:], time.time(), data))
+
+        if (len(self._batch) >= self._batch_size or time.monotonic()-self._batch_start >= self._batch_interval):
+            self._batch_publish()
+
+    # Get the time (in s) until the current batch has to be published (the batch
+    # interval, if the batch is empty)
+    def _batch_delay(self):
+        '''Get the time until the current batch has to be published'''
+        if (not self._batch):
+            return self._batch_interval
+        return max(0, self._batch_start+self._batch_interval-time.monotonic())
+
+    # Publish the current batch, if the values have been collected for long
+    # enough, even if no further value is added (e.g. because of the report-
+    # by-exception filter)
+    def _batch_due(self):
+        '''Publish the current batch, if the values have been collected for long enough'''
+        with self._process_lock:
+            if (self._batch and self._batch_delay() == 0):
+                self._batch_publish()
+
+    # Write the records of the ring buffer to the storage device every flush
+    # interval (runs in a separate thread)
+    def _history_loop(self):
+        '''Write the records of the ring buffer to the storage device every flush interval'''
+        while (True):
+            time.sleep(self._flush_interval or 30)
+            try:
+                self._history.flush()
+            except:
+                # Log occuring errors
+                self._log.error('_history_loop', 'Error: '+str(sys.exc_info()[1]))
+
+    # Publish the due batches (runs in a separate thread)
+    def _batch_loop(self):
+        '''Publish the due batches'''
+        while (True):
+            time.sleep(self._batch_delay() or 0.1)
+            try:
+                self._batch_due()
+            except:
+                # Log occuring errors
+                self._log.error('_batch_loop', 'Error: '+str(sys.exc_info()[1]))
+
+    # Publish the values collected as one batch
+    def _batch_publish(self):
+        '''Publish the values collected as one batch'''
+        if (self._batch):
+            self.mqtt_publish(mqtt_payload.encode_batch(self._batch, compress=self._batch_compress, version=self._batch_version), topic=self._topic+'/$batch')
+            self._batch = []
+
+    # Wait for the next tick of the readout schedule of the given bus; log
+    # overruns of the previous readout procedure as well as skipped ticks
+    def _wait_for_tick(self, bus):
+        '''Wait for the next tick of the readout schedule of the given bus'''
+        self._tick_fired(bus, bus.scheduler.wait())
+
+    # Log overruns of the previous readout procedure of the given bus as well as
+    # the given number of skipped ticks
+    def _tick_fired(self, bus, skipped):
+        '''Log overruns of the previous readout procedure of the given bus'''
+        if (bus.scheduler.overruns > bus.overruns):
+            bus.overruns = bus.scheduler.overruns
+            self._log.warning('_wait_for_tick', 'Readout procedure on '+str(bus.port)+' overran its interval by '+str(round(bus.scheduler.lateness, 3))+' s; skipped '+str(skipped)+' tick(s) (total overruns: '+str(bus.scheduler.overruns)+', total skipped ticks: '+str(bus.scheduler.skipped)+')!')
+
+    # Metrics:
+
+    # Start the HTTP endpoint exposing the metrics of the node and the periodical
+    # publishing of the metrics
+    def metrics_init(self, **kwargs):
+        '''
+        Start the HTTP endpoint exposing the metrics of the node and the
+        periodical publishing of the metrics
+
+        Permitted transfer parameters:
+        - port      (default: 0; port of the HTTP endpoint; 0 - disabled)
+        - host      (default: 127.0.0.1)
+        - interval  (default: 0; time-interval (in s) between two publishes of
+                    the metrics on <topic>/$metrics; 0 - never)
+        '''
+        # Evaluate the transfer parameters
+        port = kwargs.get('port', 0)
+        host = kwargs.get('host', '127.0.0.1')
+        self._metrics_interval = kwargs.get('interval', 0)
+
+        try:
+            if (port):
+                self._metrics_server = node_metrics.Metrics_Server(self._metrics, host, port)
+                self._log.info('metrics_init', 'Serving the metrics on http://'+(host or '0.0.0.0')+':'+str(port)+'/metrics')
+
+            # With the asyncio engine, the metrics are published by the event
+            # loop (cf. _metrics_task(...))
+            if (self._metrics_interval and self._engine == 0):
+                metrics_thread = threading.Thread(target=self._metrics_loop, daemon=True)
+                metrics_thread.start()
+        except:
+            # Log occuring errors; the node works without metrics
+            self._log.error('metrics_init', 'Error: '+str(sys.exc_info()[1]))
+
+    # Start the Modbus TCP server serving the registers (resp. coils and
+    # discrete inputs) of the Modbus RTU devices read last
+    def modbus_server_init(self, **kwargs):
+        '''
+        Start the Modbus TCP server serving the registers of the Modbus RTU
+        devices read last
+
+        Permitted transfer parameters:
+        - port      (default: 0; port of the server; 0 - disabled)
+        - host      (default: 127.0.0.1)
+        - max_age   (default: 60; maximum age (in s) of the values served; 0 -
+                    no limit)
+        '''
+        # Evaluate the transfer parameters
+        port = kwargs.get('port', 0)
+        host = kwargs.get('host', '127.0.0.1')
+        max_age = kwargs.get('max_age', 60)
+
+        if (not port):
+            return
+
+        try:
+            image = node_modbus_server.Register_Image(max_age=max_age)
+            self._modbus_server = node_modbus_server.Modbus_Server(image, host, port)
+            self._modbus_image = image
+            self._log.info('modbus_server_init', 'Serving the registers read on modbus://'+(host or '0.0.0.0')+':'+str(port))
+        except:
+            # Log occuring errors; the node works without the server
+            self._log.error('modbus_server_init', 'Error: '+str(sys.exc_info()[1]))
+
+    # Update the metrics counted elsewhere (called right before the metrics are
+    # rendered)
+    def _collect_metrics(self, metrics):
+        '''Update the metrics counted elsewhere'''
+        metrics.set('node_uptime_seconds', time.time()-self._startTime)
+        if (self._modbus_image != None):
+            metrics.set('node_modbus_server_requests_total', self._modbus_image.requests)
+            metrics.set('node_modbus_server_exceptions_total', self._modbus_image.exceptions)
+
+        for bus in self._buses:
+            if (bus.scheduler != None):
+                metrics.set('node_bus_overruns_total', bus.scheduler.overruns, port=bus.port)
+                metrics.set('node_bus_skipped_ticks_total', bus.scheduler.skipped, port=bus.port)
+            if (bus.rates != None):
+                metrics.set('node_bus_missed_deadlines_total', bus.rates.missed, port=bus.port)
+            if (bus.budget != None):
+                metrics.set('node_bus_utilisation_ratio', bus.budget.utilisation, port=bus.port)
+                metrics.set('node_bus_demand_ratio', bus.budget.demand, port=bus.port)
+            for address, health in list(bus.health.items()):
+                if (health.state != None):
+                    metrics.set('node_device_online', int(health.state == node_health.ONLINE), port=bus.port, address=address)
+
+        with self._inflight_lock:
+            metrics.set('node_inflight_messages', len(self._inflight))
+        if (self._queue != None):
+            metrics.set('node_queue_depth', self._queue.depth())
+            metrics.set('node_queue_dropped_segments_total', self._queue.dropped)
+        if (self._filter != None):
+            metrics.set('node_filter_values_total', self._filter.reported, result='reported')
+            metrics.set('node_filter_values_total', self._filter.suppressed, result='suppressed')
+
+    # Publish the metrics on <topic>/$metrics
+    def _metrics_publish(self):
+        '''Publish the metrics on <topic>/$metrics'''
+        if (self._client != None):
+            self.mqtt_publish(self._metrics.render(), topic=self._topic+'/$metrics')
+
+    # Publish the metrics every metrics interval (runs in a separate thread)
+    def _metrics_loop(self):
+        '''Publish the metrics every metrics interval'''
+        while (True):
+            time.sleep(self._metrics_interval)
+            try:
+                self._metrics_publish()
+            except:
+                # Log occuring errors
+                self._log.error('_metrics_loop', 'Error: '+str(sys.exc_info()[1]))
 
     # MQTT:
 
@@ -216,20 +993,20 @@ class MQTT_Node_Client(object):
     # by the loop thread)
     def _on_connect_cb(self, client_instance, userdata, flags, return_code):
         '''Callback function, which is called after an attempt to connect to the MQTT broker'''
-        log_buffer=(self.get_uptime()+' _on_connect_cb: Return code: '+mqtt.connack_string(return_code)+'\n')
+        self._log.info('_on_connect_cb', 'Return code: '+mqtt.connack_string(return_code))
 
         # Connection attempt was successfull
         if return_code == mqtt.CONNACK_ACCEPTED:
-            log_buffer+=(self.get_uptime()+' _on_connect_cb: Subscribing to the defined topics!\n')
+            self._log.info('_on_connect_cb', 'Subscribing to the defined topics!')
+
+            # Resume draining the outbound queue
+            if self._queue != None:
+                self._log.info('_on_connect_cb', 'Messages in the outbound queue: '+str(self._queue.depth()))
+            self._connected.set()
+            self._notify_drain()
         # Connection attempt wasn't successfull
         else:
-            log_buffer+=(self.get_uptime()+' _on_connect_cb: Trying again!\n')
-
-        # Write the buffer to the log (the usage of a buffer allows to minimalize
-        # file is opened (and therewith occupied) by the program, thus reducing
-        # the risk of an access conflict)
-        with open(self._log, 'a') as log:
-            log.write(log_buffer)
+            self._log.warning('_on_connect_cb', 'Trying again!')
 
     # Callback function, which is called after the client disconnected the MQTT
     # broker; evaluate the connection result and, in case of an intended disconnect,
@@ -237,11 +1014,23 @@ class MQTT_Node_Client(object):
     # case)
     def _on_disconnect_cb(self, client_instance, userdata, return_code):
         '''Callback function, which is called after the client disconnected the MQTT broker'''
-        log_buffer=(self.get_uptime()+' _on_disconnect_cb: Disconnected from the broker! Return code: '+mqtt.error_string(return_code)+'\n')
+        self._log.info('_on_disconnect_cb', 'Disconnected from the broker! Return code: '+mqtt.error_string(return_code))
+
+        # Pause draining the outbound queue; the messages not yet acknowledged
+        # stay in the queue and are sent again in order by the MQTT client
+        # after reconnecting
+        self._connected.clear()
+        if self._queue != None:
+            self._log.info('_on_disconnect_cb', 'Messages in the outbound queue: '+str(self._queue.depth()))
 
         # Exit the program if the disconnect was caused by client.disconnect()
-        if return_code == mqtt.MQTT_ERR_SUCCESS:
-            log_buffer+=(self.get_uptime()+' _on_disconnect_cb: Stopping the loop thread and exiting the program!\n')
+        if (return_code == mqtt.MQTT_ERR_SUCCESS and self._loop != None):
+            # The asyncio engine stops by itself, once the MQTT client has
+            # been disconnected (instead of exiting from the callback)
+            self._stopping = True
+            self._log.info('_on_disconnect_cb', 'Stopping the engine!')
+        elif return_code == mqtt.MQTT_ERR_SUCCESS:
+            self._log.info('_on_disconnect_cb', 'Stopping the loop thread and exiting the program!')
 
             # Stop the MQTT client thread
             self._client.loop_stop()
@@ -249,25 +1038,123 @@ class MQTT_Node_Client(object):
             # Exit the program
             sys.exit()
         else:
-            log_buffer+=(self.get_uptime()+' _on_disconnect_cb: Trying to reconnect!\n')
-
-        # Write the buffer to the log (the usage of a buffer allows to minimalize
-        # file is opened (and therewith occupied) by the program, thus reducing
-        # the risk of an access conflict)
-        with open(self._log, 'a') as log:
-            log.write(log_buffer)
+            self._log.warning('_on_disconnect_cb', 'Trying to reconnect!')
 
     # Callback function, that is called everytime a new message is published by
-    # the client; log the message sent and write it to the data-exchange-file
+    # the client (i.e. its reception has been acknowledged by the broker); log the
+    # message sent and remove it from the outbound queue
     def _on_publish_cb(self, client_instance, userdata, mid):
         '''Callback function, that is called everytime a new message is published by the client'''
+        with self._inflight_lock:
+            message = self._inflight.pop(mid, None)
+
+            # The acknowledgement may arrive before _send(...) registered the
+            # message; it is evaluated there in this case
+            if (message == None):
+                self._early_acks.add(mid)
+                return
+
+        self._published(message)
+
+    # Evaluate the acknowledgement of the given message (topic, payload, token,
+    # time it was handed to the MQTT client)
+    def _published(self, message):
+        '''Evaluate the acknowledgement of the given message'''
+        topic, payload, token, sent = message
+        self._metrics.observe('node_publish_seconds', time.monotonic()-sent)
+
+        # Remove the message from the outbound queue and continue draining it
+        if (token != None):
+            self._queue.ack(token)
+            self._notify_drain()
+
         # Write the message sent to the log file
-        with open(self._log, 'a') as log:
-            log.write(self.get_uptime()+' _on_publish_cb: Published message '+str(userdata)+' on topic '+self._topic+'\n')
+        if (mqtt_payload.is_batch(payload)):
+            self._log.info('_on_publish_cb', 'Published batch (', len(payload), ' bytes) on topic ', topic)
+        else:
+            self._log.info('_on_publish_cb', 'Published message ', payload, ' on topic ', topic)
+
+    # Hand the given message over to the MQTT client and register it until its
+    # reception is acknowledged by the broker
+    def _send(self, topic, payload, token):
+        '''Hand the given message over to the MQTT client'''
+        sent = time.monotonic()
+        message_info = self._client.publish(topic=topic, payload=payload, qos=1)
+
+        # Let the event loop write the remainder of the message, if it couldn't
+        # be sent at once
+        if (self._loop != None):
+            self._mqtt_want_write()
+
+        with self._inflight_lock:
+            if (message_info.mid not in self._early_acks):
+                self._inflight[message_info.mid] = (topic, payload, token, sent)
+                return
+            self._early_acks.remove(message_info.mid)
+
+        self._published((topic, payload, token, sent))
+
+    # Notify the drain thread resp. task, that messages can be published from the
+    # outbound queue
+    def _notify_drain(self):
+        '''Notify the drain thread resp. task, that messages can be published from the outbound queue'''
+        self._drain_event.set()
+        if (self._async_drain_event != None):
+            self._async_drain_event.set()
+
+    # Publish the next message stored in the outbound queue; return False, if
+    # there is no message to publish or too many messages haven't been
+    # acknowledged yet
+    def _drain_once(self):
+        '''Publish the next message stored in the outbound queue'''
+        # Limit the number of messages not yet acknowledged
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+        if (inflight >= self._max_inflight):
+            return False
+
+        message = self._queue.get()
+        if (message == None):
+            return False
+
+        token, topic, payload = message
+        self._send(topic, payload, token)
+        return True
+
+    # Publish the messages stored in the outbound queue in order, as long as the
+    # connection to the broker is established (runs in a separate thread)
+    def _drain_loop(self):
+        '''Publish the messages stored in the outbound queue in order'''
+        while (True):
+            try:
+                # Wait for the connection to the broker
+                self._connected.wait()
+
+                # Wait for new messages resp. acknowledgements, if no message
+                # can be published at the moment
+                self._drain_event.clear()
+                if (not self._drain_once()):
+                    self._drain_event.wait(1)
+                    continue
+
+                # Limit the throughput
+                if (self._drain_rate):
+                    time.sleep(1.0/self._drain_rate)
+            except:
+                # Log occuring errors
+                self._log.error('_drain_loop', 'Error: '+str(sys.exc_info()[1]))
+                time.sleep(1)
 
     # Publish the message given as transfer parameter
-    def mqtt_publish(self, msg):
-        '''Publish the message given as transfer parameter'''
+    def mqtt_publish(self, msg, **kwargs):
+        '''
+        Publish the message given as transfer parameter
+
+        Permitted transfer parameters:
+        - topic (default: topic set in mqtt_node_client_init)
+        '''
+        # Evaluate the transfer parameters
+        topic = kwargs.get('topic', self._topic)
 
         # Check, if the MQTT client has already been initialized
         if self._client != None:
@@ -275,15 +1162,17 @@ class MQTT_Node_Client(object):
                 if (msg == None):
                     raise Exception('Invalid transfer parameter!')
 
-                # Set msg as transfer parameter for the on-publish callback-
-                # function
-                self._client.user_data_set(msg)
-                # Publish the message
-                self._client.publish(topic=self._topic, payload=msg, qos=1)
+                if self._queue != None:
+                    # Append the message to the outbound queue and notify the
+                    # drain thread
+                    self._queue.put(topic, msg)
+                    self._notify_drain()
+                else:
+                    # Publish the message
+                    self._send(topic, msg, None)
             except:
                 # Log occuring errors
-                with open(self._log, 'a') as log:
-                    log.write(self.get_uptime()+' mqtt_publish: Error: '+str(sys.exc_info()[1])+'\n')
+                self._log.error('mqtt_publish', 'Error: '+str(sys.exc_info()[1]))
 
 
     # Initialize and configure the MQTT client
@@ -292,22 +1181,40 @@ class MQTT_Node_Client(object):
         Initialize and configure the MQTT client
 
         Permitted transfer parameters:
-        - client_id (default: value of username)
-        - ca        (default: None)
-        - timeout   (default: 60)
+        - client_id         (default: value of username)
+        - ca                (default: None)
+        - timeout           (default: 60)
+        - queue             (default: None; if set, the messages are stored in
+                            an on-disk queue in this directory and published
+                            from there)
+        - queue_max_bytes   (default: 67108864)
+        - drain_rate        (default: 0; maximum number of messages published
+                            from the queue per second; 0 - no limit)
+        - max_inflight      (default: 20)
+        - batch_size        (default: 0; if set, the values read are published
+                            in batches of up to this many values)
+        - batch_interval    (default: 60; maximum time-interval (in s) the
+                            values are collected for)
+        - batch_compress    (default: 0)
+        - batch_version     (default: 1; version of the format of the batches)
         '''
         # Evaluate the transfer parameters
         cl_id = kwargs.get('client_id', username)
         ca = kwargs.get('ca', None)
         timeout = kwargs.get('timeout', 60)
+        queue = kwargs.get('queue', None)
+        queue_max_bytes = kwargs.get('queue_max_bytes', 67108864)
+        self._drain_rate = kwargs.get('drain_rate', 0)
+        self._max_inflight = kwargs.get('max_inflight', 20)
+        self._batch_size = kwargs.get('batch_size', 0)
+        self._batch_interval = kwargs.get('batch_interval', 60)
+        self._batch_compress = kwargs.get('batch_compress', 0)
+        self._batch_version = kwargs.get('batch_version', 1)
 
         self._topic = topic
 
-        with open(self._log, 'a') as log:
-            log.write(
-                self.get_uptime()+' mqtt_node_client_init: Initializing and configuring the MQTT client!\n'+
-                self.get_uptime()+' mqtt_node_client_init: Local IP: '+local_ip+'   Remote IP: '+remote_ip+'   Port: '+str(port)+'\n'
-            )
+        self._log.info('mqtt_node_client_init', 'Initializing and configuring the MQTT client!')
+        self._log.info('mqtt_node_client_init', 'Local IP: '+local_ip+'   Remote IP: '+remote_ip+'   Port: '+str(port))
 
         try:
             # Initialize the MQTT client and set the respective callback functions
@@ -315,11 +1222,28 @@ class MQTT_Node_Client(object):
             self._client.on_connect = self._on_connect_cb
             self._client.on_disconnect = self._on_disconnect_cb
             self._client.on_publish = self._on_publish_cb
+            self._client.max_inflight_messages_set(self._max_inflight)
+
+            if queue != None:
+                # Open the outbound queue and start the thread publishing the
+                # messages stored in it (messages left over from a previous run
+                # are replayed as soon as the connection is established)
+                self._queue = node_storage.Outbound_Queue(queue, max_bytes=queue_max_bytes)
+                if (self._engine == 0):
+                    drain_thread = threading.Thread(target=self._drain_loop, daemon=True)
+                    drain_thread.start()
+
+            # Publish the batches after the batch interval even if no further
+            # value is read (with the asyncio engine, cf. _flush_task(...))
+            if (self._batch_size and self._engine == 0):
+                batch_thread = threading.Thread(target=self._batch_loop, daemon=True)
+                batch_thread.start()
 
             # Set a will to be sent to the MQTT broker. If the client disconnects
             # without calling disconnect(), the broker will publish the message
-            # on its behalf.
-            self._client.will_set(topic=self._topic, payload='Node disconnected!', qos=0)
+            # on its behalf (on a sub-topic of its own, since the topic of the
+            # node is the parent of the topics of the values).
+            self._client.will_set(topic=self._topic+'/$node', payload='Node disconnected!', qos=0)
 
             if ca != None:
                 # Configure the encryption related settings like which TLS version
@@ -334,12 +1258,14 @@ class MQTT_Node_Client(object):
             # thread to keep the connection alive afterwards. This thread also
             # automatically handles the reconnection to the broker in case the
             # connection is lost without explicitly calling client.disconnect().
+            # With the asyncio engine, the connection is established and kept
+            # alive by the event loop instead (cf. _mqtt_task(...)).
             self._client.connect_async(host=remote_ip, port=port, keepalive=timeout, bind_address=local_ip)
-            self._client.loop_start()
+            if (self._engine == 0):
+                self._client.loop_start()
         except:
             # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' mqtt_node_client_init: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('mqtt_node_client_init', 'Error: '+str(sys.exc_info()[1]))
 
             # Check, if the MQTT client has already been initialized
             if self._client != None:
@@ -349,286 +1275,1178 @@ class MQTT_Node_Client(object):
                 # Exit the program directly (instead of from _on_disconnect_cb(...))
                 sys.exit()
 
-    # Modbus RTU:
+    # Buses:
 
-    # Periodical readout of the defined Modbus RTU device
-    def _modbus_rtu_loop(self):
-        '''Start the periodical readout of the defined Modbus RTU device'''
-        with open(self._log, 'a') as log:
-            log.write(self.get_uptime()+' _modbus_rtu_loop: Starting periodical readout of the defined Modbus RTU device!\n')
+    # Initialize the master of a bus of the given operation mode and start a
+    # worker thread reading out the given devices periodically
+    def bus_add(self, op_mode, devices, **kwargs):
+        '''
+        Initialize the master of a bus of the given operation mode and start a
+        worker thread reading out the given devices periodically (with the
+        asyncio engine, the readout is started by bus_run())
+
+        Permitted transfer parameters:
+        - port              (default: /dev/ttyUSB0)
+        - read_interval     (default: 5; default period of the devices)
+        - align             (default: 0)
+        - groups            (default: {}; poll groups the devices can be
+                            assigned to via the key group, cf. _POLL_GROUPS)
+        - adaptive_timeout  (default: 1; cf. node_health.py)
+        - offline_after     (default: 3)
+        - max_backoff       (default: 3600)
+        - budget            (default: 0; share of read_interval the requests
+                            may occupy the bus for; 0 - no limit; cf.
+                            node_scheduler.Poll_Budget)
+        - hotplug           (default: 0; if set, the bus is reopened once its
+                            port reappears after it has been removed; cf.
+                            _HOTPLUG_MODE)
+        - unit_offset       (default: 0; added to the device addresses to get
+                            the units of the devices on the Modbus TCP server,
+                            cf. modbus_server_init(...))
+        - further parameters depending on the operation mode (cf.
+          _modbus_rtu_open(...) resp. _mbus_open(...))
+        '''
+        # Evaluate the transfer parameters
+        bus = Bus_Worker(op_mode, kwargs.get('port', '/dev/ttyUSB0'), devices)
+        bus.hotplug = kwargs.get('hotplug', 0)
+        bus.open_kwargs = kwargs
 
         try:
-            while (True):
-                # Read _MODBUS_REGISTER_COUNT registers starting from
-                # _MODBUS_REGISTER from device _BUS_ADDRESS
-                data_raw = self._bus_master.read_holding_registers(unit=self._address, address=self._modbus_register, count=self._modbus_register_count)
+            # Set the protocol of the bus depending on its operation mode
+            # 0 - Modbus RTU
+            # 1 - M-Bus
+            if (op_mode == 0):
+                bus.protocol = 'Modbus RTU'
+                bus.read = self._modbus_rtu_read
+            elif (op_mode == 1):
+                bus.protocol = 'M-Bus'
+                bus.read = self._mbus_read
+            else:
+                # Invalid operation mode
+                raise Exception('Invalid operation mode!')
 
-                # Check, if the read operation was successfull and try again if not
-                if (not data_raw):
-                    # Check, if the MQTT client has already been initialized
-                    if self._client != None:
-                        self.mqtt_publish('No device connected at address '+str(self._address)+'\n')
+            # Initialize the Modbus RTU resp. M-Bus master; with hot-plugging,
+            # a bus, whose port is missing, is opened once the port appears
+            if (bus.hotplug and not os.path.exists(bus.port)):
+                bus.present = False
+                self._log.warning('bus_add', 'Port '+str(bus.port)+' is missing; waiting for it to appear!')
+            else:
+                self._bus_open(bus)
 
-                    # Sleep for self._read_interval seconds
-                    time.sleep(self._read_interval)
+            # Plan and schedule the requests of the devices
+            self._bus_configure(bus, devices, **kwargs)
 
-                    continue
+            if (self._engine == 0):
+                # Start the periodical readout of the defined devices in a
+                # separate thread
+                bus.thread = threading.Thread(target=self._bus_loop, args=(bus,), daemon=True)
+                bus.thread.start()
+            else:
+                # The bus requests block, so they are run in a separate executor
+                # thread of the bus by the asyncio engine
+                bus.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self._buses.append(bus)
+        except:
+            # Log occuring errors
+            self._log.error('bus_add', 'Error on '+str(bus.port)+': '+str(sys.exc_info()[1]))
 
-                # Change the byte order to little endian
-                if (not self._modbus_endianness):
-                    # Change the order of the registers
-                    data_raw.registers = data_raw.registers[::-1]
-                    # Change the order of the bytes within the single registers
-                    for idx in range(len(data_raw.registers)):
-                        data_raw.registers[idx] = int(bin(data_raw.registers[idx])[10:]+bin(data_raw.registers[idx])[2:10], 2)
-
-                # Change the bit significance to MSB
-                if (self._modbus_bit_significance):
-                    for idx in range(len(data_raw.registers)):
-                        data_raw.registers[idx] = int(bin(data_raw.registers[idx])[:1:-1] ,2)
-
-                # Calculate the actual (combined) value of the registers read
-                data = 0
-                for idx in range(len(data_raw.registers)):
-                    data+=data_raw.registers[idx]<<((len(data_raw.registers)-idx-1)*16)
-
-                # Evaluate the signing
-                if (self._modbus_signed):
-                    if (bin(data)[2]):
-                        data = -((data-1)^int('FFFF'*self._modbus_register_count, 16))
-
-                # Write the message read to the log file
-                with open(self._log, 'a') as log:
-                    log.write(self.get_uptime()+' _mbus_loop: Data read from device '+str(self._address)+': '+str(data)+'\n')
-
-                # Write the message read to the database
-                with open(self._db, 'a') as database:
-                    database.write(self.get_uptime()+self._csv_delimiter+self._topic[self._topic.rfind('/')+1:]+self._csv_delimiter+str(data)+'\n')
-
-                # Check, if the MQTT client has already been initialized
-                if self._client != None:
-                    # Publish the data received from the device
-                    self.mqtt_publish(data)
-
-                # Sleep for self._read_interval seconds
-                time.sleep(self._read_interval)
+            # Disconnect from the bus and free all occupied resources
+            self._bus_close(bus)
+
+    # Plan and schedule the requests of the given devices of the given bus
+    # (cf. bus_add(...) for the permitted transfer parameters)
+    def _bus_configure(self, bus, devices, **kwargs):
+        '''Plan and schedule the requests of the given devices of the given bus'''
+        # Evaluate the transfer parameters
+        read_interval = kwargs.get('read_interval', 5)
+        align = kwargs.get('align', 0)
+        groups = kwargs.get('groups', {})
+        budget = kwargs.get('budget', 0)
+        bus.unit_offset = kwargs.get('unit_offset', 0)
+
+        # Resolve the poll groups of the devices
+        for device in devices:
+            if ('group' in device and device['group'] not in groups):
+                raise Exception('Invalid poll group '+str(device['group'])+'!')
+        devices = [dict(groups[device['group']], **device) if 'group' in device else device for device in devices]
+
+        # Set the policy of the adaptive timeouts and the backoff of offline
+        # devices
+        bus.health_policy = {'timeout': kwargs.get('timeout', 3), 'adaptive': kwargs.get('adaptive_timeout', 1), 'offline_after': kwargs.get('offline_after', 3), 'backoff': read_interval, 'max_backoff': kwargs.get('max_backoff', 3600)}
+        bus.read_interval = read_interval
+
+        # The schedule is kept, if neither the alignment nor the interval has
+        # changed
+        reschedule = (bus.scheduler == None or align != bus.align)
+        bus.align = align
+
+        # Plan the requests depending on the operation mode of the bus
+        if (bus.op_mode == 0):
+            self._modbus_rtu_plan(bus, devices, **kwargs)
+        else:
+            self._mbus_configure(bus, devices)
+
+        # Schedule the readout procedures at the shortest period of all
+        # devices; on every tick, only the requests due are sent (cf.
+        # bus.rates)
+        interval = min([read_interval]+[device.get('interval', read_interval) for device in bus.devices])
+        if (reschedule or interval != bus.interval):
+            bus.scheduler = node_scheduler.Deadline_Scheduler(interval, align=align)
+            bus.overruns = 0
+            bus.budget = None
+
+        # Account for the time the requests occupy the bus and read out the
+        # entries of low priority less often, if it's oversubscribed
+        if (not budget):
+            bus.budget = None
+        elif (bus.budget == None or budget != bus.budget_share):
+            bus.budget = node_scheduler.Poll_Budget(interval, budget=budget)
+
+        bus.interval = interval
+        bus.budget_share = budget
+
+    # Apply the given configuration of the buses (list of the transfer
+    # parameters of bus_add(...) including op_mode and devices) to the buses
+    # read out; the device tables and readout schedules of the buses are
+    # replaced right before their next readout procedure without closing the
+    # bus masters
+    def bus_reconfigure(self, buses):
+        '''Apply the given configuration of the buses to the buses read out'''
+        ports = []
+        for bus_kwargs in buses:
+            bus_kwargs = dict(bus_kwargs)
+            op_mode = bus_kwargs.pop('op_mode')
+            devices = bus_kwargs.pop('devices')
+            port = bus_kwargs.get('port', '/dev/ttyUSB0')
+            ports.append(port)
+
+            for bus in self._buses:
+                if (bus.port == port):
+                    break
+            else:
+                self._log.warning('bus_reconfigure', 'Bus '+str(port)+' isn\'t read out; adding buses requires a restart!')
+                continue
+
+            if (bus.op_mode != op_mode):
+                self._log.warning('bus_reconfigure', 'Changing the operation mode of '+str(port)+' requires a restart!')
+                continue
+
+            bus.pending = (devices, bus_kwargs)
+
+        for bus in self._buses:
+            if (bus.port not in ports):
+                self._log.warning('bus_reconfigure', 'Bus '+str(bus.port)+' isn\'t configured anymore; removing buses requires a restart!')
+
+    # Reload the configuration on SIGHUP by calling the given function
+    def reload_init(self, reload):
+        '''Reload the configuration on SIGHUP by calling the given function'''
+        self._reload = reload
+        signal.signal(signal.SIGHUP, self._on_sighup)
+
+    # Signal handler of SIGHUP; reload the configuration (deferred to the event
+    # loop with the asyncio engine, since the handler may interrupt it anywhere)
+    def _on_sighup(self, signum, frame):
+        '''Signal handler of SIGHUP'''
+        if (self._loop != None):
+            self._loop.call_soon_threadsafe(self._reload_config)
+        else:
+            self._reload_config()
+
+    # Reload the configuration; keep the current configuration, if the new one
+    # is invalid
+    def _reload_config(self):
+        '''Reload the configuration'''
+        self._log.info('_reload_config', 'Reloading the configuration!')
+        try:
+            self._reload()
         except:
             # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' _modbus_rtu_loop: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('_reload_config', 'Error: '+str(sys.exc_info()[1])+'; keeping the current configuration!')
+
+    # Replace the default rules of the report-by-exception filter
+    def filter_rules(self, **kwargs):
+        '''
+        Replace the default rules of the report-by-exception filter
 
-            # Check, if the Modbus RTU master has already been initialized
-            if self._bus_master != None:
-                # Disconnect from the bus and free all occupied resources
-                self._bus_master.close()
+        Permitted transfer parameters:
+        - deadband          (default: 0)
+        - deadband_percent  (default: 0)
+        - max_silence       (default: 0)
+        '''
+        if (self._filter == None):
+            self._log.warning('filter_rules', 'Enabling the filter requires a restart!')
+            return
+        self._filter.rules(**kwargs)
 
-            # Check, if the MQTT client has already been initialized
-            if self._client != None:
-                # Disconnect from the MQTT broker
-                self._client.disconnect()
+    # Replace the severity level and the rate limits of the log messages
+    def log_rules(self, **kwargs):
+        '''
+        Replace the severity level and the rate limits of the log messages
+
+        Permitted transfer parameters:
+        - level         (default: info)
+        - rate_limits   (default: {})
+        '''
+        self._log.set_level(queue_logger.LEVELS[kwargs.get('level', 'info')])
+        self._log.set_rate_limits(kwargs.get('rate_limits', {}))
+
+    # Read out the devices of the given bus once; apply the new configuration of
+    # the bus beforehand, if any (runs in the worker thread resp. the executor
+    # thread of the bus)
+    def _bus_read(self, bus):
+        '''Read out the devices of the given bus once'''
+        pending = bus.pending
+        if (pending != None):
+            bus.pending = None
+            state = dict(vars(bus))
+            try:
+                self._bus_configure(bus, pending[0], **pending[1])
+                self._log.info('_bus_read', 'Applied the new configuration of '+str(bus.port)+' ('+str(len(bus.devices))+' device table entries)!')
+            except:
+                # Log occuring errors and keep the previous configuration
+                vars(bus).update(state)
+                self._log.error('_bus_read', 'Error applying the new configuration of '+str(bus.port)+': '+str(sys.exc_info()[1]))
+
+        if (not bus.hotplug):
+            return bus.read(bus)
+
+        # Skip the readout procedure, while the port is missing, and reopen
+        # the bus, once it's back
+        bus.present = os.path.exists(bus.port)
+        if (bus.master == None):
+            if (not bus.present):
+                return ([], [])
+            try:
+                self._bus_open(bus)
+                self._log.info('_bus_read', 'Opened '+str(bus.port)+'!')
+            except:
+                # Log occuring errors and try again on the next tick
+                self._log.error('_bus_read', 'Error opening '+str(bus.port)+': '+str(sys.exc_info()[1]))
+                self._bus_close(bus)
+                return ([], [])
+
+        try:
+            readout = bus.read(bus)
+        except:
+            # Errors caused by the removal of the port aren't fatal
+            if (os.path.exists(bus.port)):
+                raise
+            return self._bus_lost(bus)
+
+        if (not bus.present or not os.path.exists(bus.port)):
+            return self._bus_lost(bus)
+        return readout
+
+    # Close the given bus, whose port has disappeared; return a readout
+    # reporting all devices of the bus offline
+    def _bus_lost(self, bus):
+        '''Close the given bus, whose port has disappeared'''
+        self._log.warning('_bus_lost', 'Port '+str(bus.port)+' has disappeared; waiting for it to reappear!')
+        self._bus_close(bus)
+        bus.present = False
+
+        # The devices come online again with the first answer after the bus
+        # has been reopened
+        events = []
+        for device in bus.devices:
+            health = bus.health.get(device['address'])
+            if (health != None and health.state != node_health.OFFLINE):
+                events.append((device, node_health.OFFLINE))
+        bus.health = {}
+
+        return ([], events)
+
+    # Start watching the ports of the buses with hot-plugging enabled
+    def _hotplug_start(self):
+        '''Start watching the ports of the buses with hot-plugging enabled'''
+        ports = [bus.port for bus in self._buses if bus.hotplug]
+        if (not ports):
+            return None
+
+        try:
+            watcher = node_hotplug.Port_Watcher(ports)
+        except:
+            # The existence of the ports is checked on every readout procedure
+            # anyway
+            self._log.error('_hotplug_start', 'Error: '+str(sys.exc_info()[1])+'; checking the ports on every readout procedure only!')
+            return None
+
+        if (self._engine == 0):
+            hotplug_thread = threading.Thread(target=self._hotplug_loop, args=(watcher,), daemon=True)
+            hotplug_thread.start()
+        else:
+            self._loop.add_reader(watcher.fileno(), lambda: self._ports_changed(watcher.events()))
+        return watcher
+
+    # Mark the buses of the ports given by the given events (tuples (port, True
+    # if the port exists)) as present resp. missing; the readout procedure of a
+    # bus, whose port has been removed, is aborted after the current request
+    def _ports_changed(self, events):
+        '''Mark the buses of the ports given by the given events as present resp. missing'''
+        for port, present in events:
+            self._log.info('_ports_changed', 'Port '+port+' has been '+('added' if present else 'removed')+'!')
+            for bus in self._buses:
+                if (bus.port == port):
+                    bus.present = present
+
+    # Watch the ports of the buses (runs in a separate thread)
+    def _hotplug_loop(self, watcher):
+        '''Watch the ports of the buses'''
+        while (True):
+            try:
+                self._ports_changed(watcher.wait())
+            except:
+                # Log occuring errors
+                self._log.error('_hotplug_loop', 'Error: '+str(sys.exc_info()[1]))
+                time.sleep(1)
+
+    # Wait until the worker threads of all buses have stopped (resp. run the
+    # event loop of the asyncio engine until then), then disconnect from the
+    # MQTT broker resp. exit the program
+    def bus_run(self):
+        '''Wait until the worker threads of all buses have stopped (resp. run the asyncio engine until then)'''
+        if (self._engine == 1):
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self._engine_run())
+            finally:
+                loop.close()
+            return
+
+        self._hotplug_start()
+
+        for bus in self._buses:
+            bus.thread.join()
+
+        self._log.info('bus_run', 'No bus left to read out!')
+
+        # Write the records of the ring buffer to the storage device
+        if (self._history != None):
+            self._history.close()
+
+        # Check, if the MQTT client has already been initialized
+        if self._client != None:
+            # Publish the values collected so far and disconnect from the MQTT
+            # broker
+            with self._process_lock:
+                self._batch_publish()
+            self._client.disconnect()
+        else:
+            # Exit the program directly (instead of from _on_disconnect_cb(...))
+            sys.exit()
+
+    # Initialize the Modbus RTU resp. M-Bus master of the given bus
+    def _bus_open(self, bus):
+        '''Initialize the Modbus RTU resp. M-Bus master of the given bus'''
+        if (bus.op_mode == 0):
+            self._modbus_rtu_open(bus, **bus.open_kwargs)
+        else:
+            self._mbus_open(bus, **bus.open_kwargs)
+
+            # Read out the devices found by the last scan (the device table
+            # may have been set while the port was missing)
+            if (bus.scan and bus.interval != None):
+                self._mbus_merge_devices(bus)
+
+    # Disconnect the master of the given bus from the bus and free all occupied
+    # resources
+    def _bus_close(self, bus):
+        '''Disconnect the master of the given bus from the bus'''
+        # Check, if the bus master has already been initialized
+        if bus.master != None:
+            try:
+                if (bus.op_mode == 0):
+                    bus.master.close()
+                else:
+                    bus.master.disconnect()
+            except:
+                # Log occuring errors
+                self._log.error('_bus_close', 'Error on '+str(bus.port)+': '+str(sys.exc_info()[1]))
+            bus.master = None
+
+    # Get the responsiveness of the device with the given address on the given
+    # bus
+    def _health(self, bus, address):
+        '''Get the responsiveness of the device with the given address on the given bus'''
+        if (address not in bus.health):
+            bus.health[address] = node_health.Device_Health(**bus.health_policy)
+        return bus.health[address]
+
+    # Record the result of a request to the device with the given address on the
+    # given bus (latency None, if the device didn't answer resp. the answer was
+    # invalid); append the state events of all the device table entries of the
+    # device to events, if the device went offline resp. came online
+    def _device_answered(self, bus, address, latency, events, **kwargs):
+        '''
+        Record the result of a request to the device with the given address on
+        the given bus
+
+        Permitted transfer parameters:
+        - error (default: None resp. timeout, if latency is None; kind of the
+                error counted in the metrics: timeout, invalid or exception)
+        '''
+        # Evaluate the transfer parameters
+        error = kwargs.get('error', None if latency != None else 'timeout')
+
+        if (error != None):
+            self._metrics.inc('node_bus_errors_total', port=bus.port, address=address, kind=error)
+
+        health = self._health(bus, address)
+        if (latency != None):
+            self._metrics.observe('node_bus_request_seconds', latency, port=bus.port, address=address)
+            state = health.success(latency)
+        else:
+            state = health.failure()
+
+        if (state != None):
+            self._log.info('_device_answered', 'Device '+str(address)+' on '+str(bus.port)+' is '+state+'!')
+            for device in bus.devices:
+                if (device['address'] == address):
+                    events.append((device, state))
+
+    # Start a new readout procedure of the given bus in the poll budget of the
+    # bus; log a warning, if the bus is oversubscribed resp. the reading of the
+    # entries of low priority has been stretched
+    def _budget_tick(self, bus):
+        '''Start a new readout procedure of the given bus in the poll budget of the bus'''
+        if (bus.budget == None):
+            return
+
+        if (bus.budget.tick()):
+            stretched = ', '.join('priority '+str(priority)+': every '+str(stretch)+'. readout' for priority, stretch in sorted(bus.budget.stretch.items()) if stretch > 1)
+            if (stretched):
+                self._log.warning('_budget_tick', 'Warning: Bus '+str(bus.port)+' is oversubscribed ('+str(int(bus.budget.demand*100))+'% of the interval required); reading '+stretched+'!')
             else:
-                # Exit the program directly (instead of from _on_disconnect_cb(...))
-                sys.exit()
+                self._log.info('_budget_tick', 'Bus '+str(bus.port)+' isn\'t oversubscribed anymore ('+str(int(bus.budget.demand*100))+'% of the interval required)!')
+
+    # Log, store and publish the values read out from the given bus by one
+    # readout procedure as well as the state events of the devices
+    def _handle_readout(self, bus, readout):
+        '''Log, store and publish the values read out from the given bus by one readout procedure'''
+        results, events = readout
+
+        # Check, if the MQTT client has already been initialized
+        if self._client != None:
+            for device, state in events:
+                self.mqtt_publish(state, topic=self._state_topic(device))
+
+        for device, data in results:
+            # Log, store and publish the value read
+            self._process_data(device, data)
+
+        # Report the time windows, that have ended in the meantime, even if no
+        # value has been read since (e.g. the devices are offline)
+        if (self._aggregator != None):
+            with self._process_lock:
+                self._aggregate_report(time.time())
+
+    # Periodical readout of the defined devices of the given bus (runs in the
+    # worker thread of the bus)
+    def _bus_loop(self, bus):
+        '''Start the periodical readout of the defined devices of the given bus'''
+        self._log.info('_bus_loop', 'Starting periodical readout of the defined '+bus.protocol+' devices on '+str(bus.port)+'!')
 
-    # Initialize the Modbus RTU master and start it
-    def _modbus_rtu_init(self, address, register, register_count, **kwargs):
+        try:
+            while (True):
+                # Wait for the next tick of the readout schedule
+                self._wait_for_tick(bus)
+
+                # Read out the devices and log, store and publish the values
+                self._handle_readout(bus, self._bus_read(bus))
+        except:
+            # Log occuring errors
+            self._log.error('_bus_loop', 'Error on '+str(bus.port)+': '+str(sys.exc_info()[1]))
+
+            # Disconnect from the bus and free all occupied resources
+            self._bus_close(bus)
+
+    # asyncio engine:
+
+    # Run the asyncio engine until the readout of all buses has stopped, then
+    # disconnect from the MQTT broker
+    async def _engine_run(self):
+        '''Run the asyncio engine until the readout of all buses has stopped'''
+        self._loop = asyncio.get_event_loop()
+        self._async_drain_event = asyncio.Event()
+
+        self._log.info('_engine_run', 'Starting the asyncio engine!')
+
+        # Watch the ports of the buses
+        watcher = self._hotplug_start()
+
+        # Start the tasks serving the MQTT client, the outbound queue and the
+        # files
+        tasks = [asyncio.ensure_future(self._flush_task())]
+        if self._client != None:
+            tasks.append(asyncio.ensure_future(self._mqtt_task()))
+            if self._queue != None:
+                tasks.append(asyncio.ensure_future(self._drain_task()))
+            if self._metrics_interval:
+                tasks.append(asyncio.ensure_future(self._metrics_task()))
+
+        # Read out the buses until all of them have stopped
+        await asyncio.gather(*[self._bus_task(bus) for bus in self._buses])
+
+        self._log.info('_engine_run', 'No bus left to read out!')
+
+        # Check, if the MQTT client has already been initialized
+        if self._client != None:
+            # Publish the values collected so far and disconnect from the MQTT
+            # broker
+            with self._process_lock:
+                self._batch_publish()
+            self._stopping = True
+            self._client.disconnect()
+            self._mqtt_want_write()
+
+            # Give the MQTT client the chance to send the disconnect
+            await asyncio.sleep(1)
+
+        # Stop the remaining tasks and executors
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for bus in self._buses:
+            bus.executor.shutdown(wait=False)
+        if (watcher != None):
+            self._loop.remove_reader(watcher.fileno())
+            watcher.close()
+
+        self._log.flush()
+        if (self._db != None):
+            self._db.flush()
+        if (self._history != None):
+            self._history.close()
+
+    # Periodical readout of the defined devices of the given bus; the bus
+    # requests are run in the executor thread of the bus
+    async def _bus_task(self, bus):
+        '''Start the periodical readout of the defined devices of the given bus'''
+        self._log.info('_bus_task', 'Starting periodical readout of the defined '+bus.protocol+' devices on '+str(bus.port)+'!')
+
+        try:
+            while (True):
+                # Wait for the next tick of the readout schedule
+                await asyncio.sleep(bus.scheduler.delay())
+                self._tick_fired(bus, bus.scheduler.fire())
+
+                # Read out the devices without blocking the event loop and log,
+                # store and publish the values
+                readout = await self._loop.run_in_executor(bus.executor, self._bus_read, bus)
+                self._handle_readout(bus, readout)
+        except:
+            # Log occuring errors
+            self._log.error('_bus_task', 'Error on '+str(bus.port)+': '+str(sys.exc_info()[1]))
+
+            # Disconnect from the bus and free all occupied resources
+            self._bus_close(bus)
+
+    # Flush the buffered entries of the database resp. the ring buffer every
+    # flush interval (the log file is flushed by the writer thread of the log,
+    # cf. queue_logger.py) and publish the due batches
+    async def _flush_task(self):
+        '''Flush the buffered entries of the database every flush interval and publish the due batches'''
+        history_flushed = time.monotonic()
+        while (True):
+            delay = self._flush_interval or 30
+            if (self._batch_size and self._client != None):
+                delay = min(delay, self._batch_delay() or 0.1)
+            await asyncio.sleep(delay)
+
+            if (self._db != None):
+                self._db.flush_if_due()
+            if (self._history != None and time.monotonic()-history_flushed >= (self._flush_interval or 30)):
+                # Writing the records to the storage device blocks
+                history_flushed = time.monotonic()
+                await self._loop.run_in_executor(None, self._history.flush)
+            if (self._batch_size and self._client != None):
+                self._batch_due()
+
+    # Publish the metrics every metrics interval
+    async def _metrics_task(self):
+        '''Publish the metrics every metrics interval'''
+        while (True):
+            await asyncio.sleep(self._metrics_interval)
+            try:
+                self._metrics_publish()
+            except:
+                # Log occuring errors
+                self._log.error('_metrics_task', 'Error: '+str(sys.exc_info()[1]))
+
+    # Publish the messages stored in the outbound queue in order, as long as the
+    # connection to the broker is established
+    async def _drain_task(self):
+        '''Publish the messages stored in the outbound queue in order'''
+        while (True):
+            try:
+                self._async_drain_event.clear()
+                if (self._connected.is_set() and self._drain_once()):
+                    # Limit the throughput (resp. give the other tasks the
+                    # chance to run in between)
+                    await asyncio.sleep(1.0/self._drain_rate if self._drain_rate else 0)
+                    continue
+            except:
+                # Log occuring errors
+                self._log.error('_drain_task', 'Error: '+str(sys.exc_info()[1]))
+
+            # Wait for new messages, acknowledgements resp. the connection to
+            # the broker
+            try:
+                await asyncio.wait_for(self._async_drain_event.wait(), 1)
+            except asyncio.TimeoutError:
+                pass
+
+    # Connect to the MQTT broker, handle the network traffic of the MQTT client
+    # on the event loop and reconnect, if the connection is lost
+    async def _mqtt_task(self):
+        '''Connect to the MQTT broker and handle the network traffic of the MQTT client on the event loop'''
+        reconnect_delay = 1
+
+        while (not self._stopping):
+            # Connect to the broker; the connection is established in an executor
+            # thread, since resolving the address and the TLS handshake block
+            try:
+                await self._loop.run_in_executor(None, self._client.reconnect)
+                reconnect_delay = 1
+            except:
+                # Log occuring errors and try again after an increasing delay
+                self._log.error('_mqtt_task', 'Error: '+str(sys.exc_info()[1])+'! Trying again in '+str(reconnect_delay)+' s!')
+                await asyncio.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay*2, 120)
+                continue
+
+            # Read from the socket whenever data is available, write to it
+            # whenever there are packets pending, and keep the connection alive
+            self._mqtt_socket = self._client.socket()
+            self._mqtt_fd = self._mqtt_socket.fileno()
+            self._mqtt_lost = asyncio.Event()
+            self._loop.add_reader(self._mqtt_fd, self._mqtt_read)
+            self._mqtt_want_write()
+
+            while (not self._mqtt_lost.is_set()):
+                try:
+                    await asyncio.wait_for(self._mqtt_lost.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+
+                if (self._client.loop_misc() != mqtt.MQTT_ERR_SUCCESS or self._client.socket() != self._mqtt_socket):
+                    break
+                self._mqtt_want_write()
+
+            self._mqtt_release()
+
+            if (not self._stopping):
+                await asyncio.sleep(reconnect_delay)
+
+    # Read the data available on the socket of the MQTT client (called by the
+    # event loop)
+    def _mqtt_read(self):
+        '''Read the data available on the socket of the MQTT client'''
+        return_code = self._client.loop_read()
+
+        # Data already decrypted by the TLS layer isn't signalled by the socket
+        while (return_code == mqtt.MQTT_ERR_SUCCESS and self._client.socket() == self._mqtt_socket and hasattr(self._mqtt_socket, 'pending') and self._mqtt_socket.pending()):
+            return_code = self._client.loop_read()
+
+        if (return_code != mqtt.MQTT_ERR_SUCCESS or self._client.socket() != self._mqtt_socket):
+            self._mqtt_release()
+        else:
+            self._mqtt_want_write()
+
+    # Write the pending packets of the MQTT client to its socket (called by the
+    # event loop)
+    def _mqtt_write(self):
+        '''Write the pending packets of the MQTT client to its socket'''
+        if (self._client.loop_write() != mqtt.MQTT_ERR_SUCCESS or self._client.socket() != self._mqtt_socket):
+            self._mqtt_release()
+        elif (not self._client.want_write()):
+            self._loop.remove_writer(self._mqtt_fd)
+
+    # Let the event loop write the pending packets of the MQTT client as soon as
+    # its socket is writable
+    def _mqtt_want_write(self):
+        '''Let the event loop write the pending packets of the MQTT client as soon as its socket is writable'''
+        if (self._mqtt_socket != None and self._client.socket() == self._mqtt_socket and self._client.want_write()):
+            self._loop.add_writer(self._mqtt_fd, self._mqtt_write)
+
+    # Stop watching the socket of the MQTT client after the connection has been
+    # lost resp. closed
+    def _mqtt_release(self):
+        '''Stop watching the socket of the MQTT client'''
+        if (self._mqtt_socket != None):
+            self._loop.remove_reader(self._mqtt_fd)
+            self._loop.remove_writer(self._mqtt_fd)
+            self._mqtt_socket = None
+            self._mqtt_lost.set()
+
+    # Modbus RTU:
+
+    # Read out the defined Modbus RTU devices of the given bus once; return a
+    # list of tuples (device table entry, value) and a list of tuples (device
+    # table entry, state) of the devices, that went offline resp. came online
+    def _modbus_rtu_read(self, bus):
+        '''Read out the defined Modbus RTU devices of the given bus once'''
+        results = []
+        events = []
+
+        self._budget_tick(bus)
+
+        # Poll the read requests due earliest deadline first; the next request
+        # is selected after every request, so requests of a higher priority
+        # released in the meantime are sent first
+        served = set()
+        while (True):
+            index = bus.rates.next(served)
+            if (index == None):
+                break
+            served.add(index)
+            block = bus.read_plan[index]
+
+            # Abort the readout procedure, if the port has been removed; the
+            # request stays released, so it's sent first once the port is back
+            if (not bus.present):
+                break
+
+            # Skip the requests of low priority, if the bus is oversubscribed
+            priority = block.priority
+            if (bus.budget != None and not bus.budget.due(index, priority)):
+                bus.rates.done(index)
+                continue
+
+            # Skip offline devices until their next probe is due
+            health = self._health(bus, block.unit)
+            if (not health.due()):
+                bus.rates.done(index)
+                continue
+
+            # Wait for the answer of the device no longer than it usually takes
+            # to answer
+            timeout = health.timeout()
+            if (bus.master.timeout != timeout):
+                bus.master.timeout = timeout
+                if (getattr(bus.master, 'socket', None) != None):
+                    bus.master.socket.timeout = timeout
+
+            # Read the registers (resp. bits) of all the device table entries
+            # merged into the block with a single request of its function code
+            start = time.monotonic()
+            data_raw = getattr(bus.master, block.request)(unit=block.unit, address=block.register, count=block.count)
+            latency = time.monotonic()-start
+            bus.rates.done(index)
+            if (bus.budget != None):
+                bus.budget.record(index, priority, latency, period=bus.rates.period(index))
+
+            # Check, if the read operation was successfull and continue with the
+            # next request if not; exception responses (e.g. illegal data
+            # address) are answers of the device nevertheless
+            if (not data_raw or not hasattr(data_raw, 'bits' if block.bits else 'registers')):
+                if (hasattr(data_raw, 'exception_code')):
+                    self._device_answered(bus, block.unit, latency, events, error='exception')
+                    self._log.error('_modbus_rtu_read', 'Error: Device '+str(block.unit)+' on '+str(bus.port)+' answered with exception code '+str(data_raw.exception_code)+' to the request of register '+str(block.register)+'!')
+                else:
+                    self._device_answered(bus, block.unit, None, events, error=self._modbus_error(data_raw))
+
+                continue
+
+            self._device_answered(bus, block.unit, latency, events)
+
+            # Decode the values of the single entries from the registers read
+            # and keep the registers for the Modbus TCP server
+            data = data_raw.bits[:block.count] if block.bits else data_raw.registers
+            results.extend(block.decode(data))
+            if (self._modbus_image != None):
+                self._modbus_image.update(block.unit+bus.unit_offset, block.function, block.register, data)
+
+        return (results, events)
+
+    # Classify the error returned by the Modbus master instead of an answer;
+    # return timeout, if the device didn't answer at all, otherwise invalid
+    # (e.g. incomplete answer or CRC error)
+    def _modbus_error(self, response):
+        '''Classify the error returned by the Modbus master instead of an answer'''
+        # pymodbus returns a ModbusIOException carrying the error of the
+        # transaction: an InvalidMessageReceivedException states, whether no
+        # bytes at all resp. too few bytes have been received; answers, that
+        # have been received completely but couldn't be decoded, are reported
+        # without it ("No Response received from the remote unit/Unable to
+        # decode response")
+        message = str(getattr(response, 'message', response))
+        if ('No response received' in message or '(0 received)' in message):
+            return 'timeout'
+        return 'invalid'
+
+    # Initialize the Modbus RTU master of the given bus
+    def _modbus_rtu_open(self, bus, **kwargs):
         '''
-        Initialize the Modbus RTU master and start it
+        Initialize the Modbus RTU master of the given bus
+
+        Each entry of the device table has to define the keys address and
+        register as well as register_count or type (cf. _DEVICES).
 
         Permitted transfer parameters:
-        - port              (default: /dev/ttyUSB0)
         - baudrate          (default: 9600)
-        - read_interval     (default: 5)
         - timeout           (default: 3)
         - stopbits          (default: 1)
         - bytesize          (default: 8)
         - parity            (default: N)
-        - signed            (default: 0)
-        - endianness        (default: 0)
-        - bit_significance  (default: 0)
         '''
         # Evaluate the transfer parameters
-        serial_port = kwargs.get('port', '/dev/ttyUSB0')
         baud = kwargs.get('baudrate', 9600)
         modbus_timeout = kwargs.get('timeout', 3)
         modbus_stopbits = kwargs.get('stopbits', 1)
         modbus_byte_size = kwargs.get('bytesize', 8)
         modbus_parity = kwargs.get('parity', 'N')
-        self._read_interval = kwargs.get('read_interval', 5)
-        self._modbus_signed = kwargs.get('signed', 0)
-        self._modbus_endianness = kwargs.get('endianness', 0)
-        self._modbus_bit_significance = kwargs.get('bit_significance', 0)
 
-        self._address = address
-        self._modbus_register = register
-        self._modbus_register_count = register_count
+        self._log.info('_modbus_rtu_open', 'Initializing the Modbus RTU master!')
+        self._log.info('_modbus_rtu_open', 'Port: '+str(bus.port))
 
-        with open(self._log, 'a') as log:
-            log.write(
-                self.get_uptime()+' _modbus_rtu_init: Initializing the Modbus RTU master and starting it!\n'+
-                self.get_uptime()+' _modbus_rtu_init: Port: '+str(serial_port)+'\n'
-            )
+        # Initialize the Modbus RTU master
+        bus.master = modbus.ModbusSerialClient(method='rtu', port=bus.port, baudrate=baud, timeout=modbus_timeout, stopbits=modbus_stopbits, bytesize=modbus_byte_size, parity=modbus_parity)
 
-        try:
-            # Initialize the Modbus RTU master
-            self._bus_master = modbus.ModbusSerialClient(method='rtu', port=serial_port, baudrate=baud, timeout=modbus_timeout, stopbits=modbus_stopbits, bytesize=modbus_byte_size, parity=modbus_parity)
-
-            # Connect the Modbus RTU master to the bus
-            self._bus_master.connect()
+        # Connect the Modbus RTU master to the bus
+        if (not bus.master.connect()):
+            raise Exception('Failed to open the port!')
 
-            # Start the periodical readout of the defined Modbus RTU device
-            self._modbus_rtu_loop()
-        except:
-            # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' _modbus_rtu_init: Error: '+str(sys.exc_info()[1])+'\n')
+    # Plan the read requests of the given devices of the given Modbus RTU bus
+    def _modbus_rtu_plan(self, bus, devices, **kwargs):
+        '''
+        Plan the read requests of the given devices of the given Modbus RTU bus
 
-            # Check, if the Modbus RTU master has already been initialized
-            if self._bus_master != None:
-                # Disconnect from the bus and free all occupied resources
-                self._bus_master.close()
+        Each entry of the device table has to define the keys address and
+        register as well as register_count or type and may define the key
+        function (cf. _DEVICES).
 
-            # Check, if the MQTT client has already been initialized
-            if self._client != None:
-                # Disconnect from the MQTT broker
-                self._client.disconnect()
-            else:
-                # Exit the program directly (instead of from _on_disconnect_cb(...))
-                sys.exit()
+        Permitted transfer parameters:
+        - max_gap           (default: 0)
+        - word_order        (default: big)
+        - byte_order        (default: big)
+        '''
+        # Evaluate the transfer parameters
+        max_gap = kwargs.get('max_gap', 0)
+        modbus_word_order = kwargs.get('word_order', 'big')
+        modbus_byte_order = kwargs.get('byte_order', 'big')
+
+        # Merge the registers of the entries of the device table read out with
+        # the same period and function code into as few read requests as
+        # possible, precompile the decoding of the single entries and schedule
+        # the requests; the plan is kept until the device table changes
+        read_plan = []
+        rates = node_scheduler.Rate_Scheduler(align=bus.align)
+        for interval in sorted(set(device.get('interval', bus.read_interval) for device in devices)):
+            points = [device for device in devices if device.get('interval', bus.read_interval) == interval]
+            for block in modbus_registers.plan_reads(points, max_gap=max_gap, word_order=modbus_word_order, byte_order=modbus_byte_order):
+                block.priority = min(point.get('priority', 1) for point, decoder, offset in block.points)
+                rates.add(len(read_plan), interval, block.priority)
+                read_plan.append(block)
+
+        bus.devices = bus.configured = devices
+        bus.read_plan = read_plan
+        bus.rates = rates
+
+        self._log.info('_modbus_rtu_plan', 'Reading '+str(len(bus.devices))+' device table entries of '+str(bus.port)+' with '+str(len(bus.read_plan))+' requests!')
+
+    # Initialize the Modbus RTU master and start it (blocks until the readout
+    # has stopped; cf. bus_add(...) and bus_run(...) to serve multiple buses)
+    def _modbus_rtu_init(self, devices, **kwargs):
+        '''Initialize the Modbus RTU master and start it (cf. bus_add(...))'''
+        self.bus_add(0, devices, **kwargs)
+        self.bus_run()
 
     # M-Bus:
 
-    # Periodical readout of the defined M-Bus device
-    def _mbus_loop(self):
-        '''Start the periodical readout of the defined M-Bus device'''
-        with open(self._log, 'a') as log:
-            log.write(self.get_uptime()+' _mbus_loop: Starting periodical readout of the defined M-Bus device!\n')
-
-        try:
-            while (True):
-                # Send a request frame to the device with address addr
-                self._bus_master.send_request_frame(address=self._address)
-
-                # Wait for an answer from the slave device and try again, if the
-                # read operation wasn't successfull
-                data_raw = mbus.MBusFrame()
-                if (self._bus_master._libmbus.recv_frame(self._bus_master.handle, data_raw) < 0):
-                    # Check, if the MQTT client has already been initialized
-                    if self._client != None:
-                        self.mqtt_publish('No device connected at address '+str(self._address)+'\n')
-
-                    # Sleep for self._read_interval seconds
-                    time.sleep(self._read_interval)
-
-                    continue
-
-                # Extract the actual data from the message received
-                data = self._bus_master.frame_data_parse(data_raw)
+    # Read out the defined M-Bus devices of the given bus once; return a list of
+    # tuples (device table entry, value) and a list of tuples (device table
+    # entry, state) of the devices, that went offline resp. came online
+    def _mbus_read(self, bus):
+        '''Read out the defined M-Bus devices of the given bus once'''
+        results = []
+        events = []
+
+        # Scan the bus for devices, if there's no up-to-date map of the
+        # addresses yet
+        if (bus.scan and bus.address_map.due(bus.scan_interval)):
+            self._mbus_scan(bus)
+
+        self._budget_tick(bus)
+
+        # Poll the entries of the device table due earliest deadline first (cf.
+        # _modbus_rtu_read(...))
+        served = set()
+        while (True):
+            index = bus.rates.next(served)
+            if (index == None):
+                break
+            served.add(index)
+            device = bus.devices[index]
+
+            # Abort the readout procedure, if the port has been removed (cf.
+            # _modbus_rtu_read(...))
+            if (not bus.present):
+                break
+
+            # Skip the entries of low priority, if the bus is oversubscribed
+            # (several entries may refer to the same device, so the budget is
+            # kept per entry)
+            priority = device.get('priority', 1)
+            if (bus.budget != None and not bus.budget.due(index, priority)):
+                bus.rates.done(index)
+                continue
+
+            # Skip offline devices until their next probe is due
+            if (not self._health(bus, device['address']).due()):
+                bus.rates.done(index)
+                continue
+
+            # Send a request frame to the device and wait for an answer; continue
+            # with the next device, if the read operation wasn't successfull
+            start = time.monotonic()
+            data_raw, error = self._mbus_request(bus, device)
+            latency = time.monotonic()-start
+            bus.rates.done(index)
+            if (bus.budget != None):
+                bus.budget.record(index, priority, latency, period=bus.rates.period(index))
+            if (data_raw == None):
+                self._device_answered(bus, device['address'], None, events, error=error)
+                continue
+            self._device_answered(bus, device['address'], latency, events)
+
+            # Extract the actual data from the message received and decode the
+            # single records (cf. mbus_records.py)
+            data = bus.master.frame_data_parse(data_raw)
+            try:
+                results.extend(bus.decoder.decode(device, data))
+            except:
+                # Log occuring errors
+                self._log.error('_mbus_read', 'Error decoding the data of device '+str(device['address'])+': '+str(sys.exc_info()[1]))
+            finally:
+                # Free the occupied resources (has to be done since the
+                # underlying c-program mallocs the storage space for the
+                # variables)
+                bus.master.frame_data_free(data)
+
+        return (results, events)
+
+    # Send a request frame to the given device table entry and receive the
+    # answer; return a tuple (frame received, kind of the error; the frame is
+    # None, if the read operation wasn't successfull)
+    def _mbus_request(self, bus, device):
+        '''Send a request frame to the given device table entry and receive the answer'''
+        address = device['address']
+
+        # Address the device via its primary address found by the last scan
+        # resp. select it via its secondary address
+        if ('secondary' in device):
+            address = None
+            if (bus.address_map != None):
+                address = bus.address_map.primary(device['secondary'])
+            if (address == None):
+                if (not mbus_scan.select(bus.master, device['secondary'])):
+                    return (None, 'timeout')
+                address = mbus_scan.ADDRESS_NETWORK_LAYER
+
+        # Send a request frame to the device with address addr
+        bus.master.send_request_frame(address=address)
+
+        # Wait for an answer from the slave device
+        data_raw = mbus.MBusFrame()
+        result = bus.master._libmbus.recv_frame(bus.master.handle, data_raw)
+        if (result < 0):
+            return (None, 'timeout' if result == mbus_scan.RECV_TIMEOUT else 'invalid')
+
+        return (data_raw, None)
+
+    # Scan the given bus for devices, persist the addresses found and add the
+    # devices, that aren't part of the device table yet, to the devices read
+    # out
+    def _mbus_scan(self, bus):
+        '''Scan the given bus for devices'''
+        self._log.info('_mbus_scan', 'Scanning the '+('primary' if bus.scan == 1 else 'secondary')+' addresses on '+str(bus.port)+'!')
+
+        start = time.monotonic()
+        collisions = []
+        if (bus.scan == 1):
+            devices = mbus_scan.scan_primary(bus.master, mbus.MBusFrame)
+        else:
+            devices = mbus_scan.scan_secondary(bus.master, mbus.MBusFrame, collisions=collisions)
+        bus.address_map.update(devices)
 
-                # Write the message read to the log file
-                with open(self._log, 'a') as log:
-                    log.write(self.get_uptime()+' _mbus_loop: Data read from device '+str(_BUS_ADDRESS)+': '+str(data)+'\n')
+        for mask in collisions:
+            self._log.warning('_mbus_scan', 'Several devices on '+str(bus.port)+' answer to the secondary address '+mask+' and can\'t be told apart!')
 
-                # Write the message read to the database
-                with open(self._db, 'a') as database:
-                        database.write(self.get_uptime()+self._csv_delimiter+self._topic[self._topic.rfind('/')+1:]+self._csv_delimiter+userdata+'\n')
+        self._log.info('_mbus_scan', 'Found '+str(len(devices))+' device(s) in '+str(int(time.monotonic()-start))+' s: '+', '.join(sorted(devices)))
 
-                # Check, if the MQTT client has already been initialized
-                if self._client != None:
-                    # Publish the data received from the device
-                    self.mqtt_publish(data)
+        self._mbus_merge_devices(bus)
 
-                # Free the occupied resources (has to be done since the underlying
-                # c-program mallocs the storage space for the variables)
-                self._bus_master.frame_data_free(data)
+    # Merge the device table of the given bus with the devices found by the
+    # last scan
+    def _mbus_merge_devices(self, bus):
+        '''Merge the device table of the given bus with the devices found by the last scan'''
+        bus.devices = list(bus.configured)
+        for secondary, address in sorted(bus.address_map.devices.items()):
+            # Skip the devices, that are already part of the device table
+            if (any(('secondary' in device and mbus_scan.matches(device['secondary'], secondary)) or (address != None and device.get('address') == address) for device in bus.configured)):
+                continue
 
-                # Sleep for self._read_interval seconds
-                time.sleep(self._read_interval)
-        except:
-            # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' _mbus_loop: Error: '+str(sys.exc_info()[1])+'\n')
+            bus.devices.append({'address': address if address != None else secondary, 'secondary': secondary, 'topic': secondary[:8]})
 
-            # Check, if the MBus master has already been initialized
-            if self._bus_master != None:
-                # Disconnect from the bus and free all occupied resources
-                self._bus_master.disconnect()
+        self._mbus_plan(bus)
 
-            # Check, if the MQTT client has already been initialized
-            if self._client != None:
-                # Disconnect from the MQTT broker
-                self._client.disconnect()
-            else:
-                # Exit the program directly (instead of from _on_disconnect_cb(...))
-                sys.exit()
+    # Schedule the requests of the entries of the device table of the given bus
+    def _mbus_plan(self, bus):
+        '''Schedule the requests of the entries of the device table of the given bus'''
+        bus.rates = node_scheduler.Rate_Scheduler(align=bus.align)
+        for index, device in enumerate(bus.devices):
+            bus.rates.add(index, device.get('interval', bus.read_interval), device.get('priority', 1))
 
-    # Initialize the M-Bus master and start it
-    def _mbus_init(self, address, **kwargs):
+    # Initialize the M-Bus master of the given bus
+    def _mbus_open(self, bus, **kwargs):
         '''
-        Initialize the M-Bus master and start it
+        Initialize the M-Bus master of the given bus
 
         Permitted transfer parameters:
-        - port          (default: /dev/ttyUSB0)
         - baudrate      (default: 9600)
-        - read_interval (default: 5)
+        - scan          (default: 0; 0 - no scan, 1 - scan the primary
+                        addresses, 2 - scan the secondary addresses)
+        - address_map   (default: /var/lib/mqtt_node_client/mbus_addresses;
+                        the name of the port is appended)
+        - scan_interval (default: 0; 0 - only scan, if there's no map yet)
         '''
         # Evaluate the transfer parameters
-        serial_port = kwargs.get('port', '/dev/ttyUSB0')
         baud = kwargs.get('baudrate', 9600)
-        self._read_interval = kwargs.get('read_interval', 5)
+        bus.scan = kwargs.get('scan', 0)
+        address_map = kwargs.get('address_map', '/var/lib/mqtt_node_client/mbus_addresses')
+        bus.scan_interval = kwargs.get('scan_interval', 0)
 
-        self._address = address
+        self._log.info('_mbus_open', 'Initializing the M-Bus master!')
+        self._log.info('_mbus_open', 'Port: '+str(bus.port))
 
-        with open(self._log, 'a') as log:
-            log.write(
-                self.get_uptime()+' _mbus_init: Initializing the M-Bus master and starting it!\n'+
-                self.get_uptime()+' _mbus_init: Port: '+str(serial_port)+'\n'
-            )
+        # Initialize the M-Bus master
+        bus.master = mbus.MBus(device=bus.port, libpath=_LIBMBUS_SO)
 
-        try:
-            # Initialize the M-Bus master
-            self._bus_master = mbus.MBus(device=serial_port, libpath=_LIBMBUS_SO)
+        # Connect the M-Bus master to the bus
+        bus.master.connect()
 
-            # Connect the M-Bus master to the bus
-            self._bus_master.connect()
+        # Set the baud rate to use
+        if (bus.master._libmbus.serial_set_baudrate(bus.master.handle, baud) == -1):
+            raise Exception('Failed to set the baudrate!')
 
-            # Set the baud rate to use
-            if (self._bus_master._libmbus.serial_set_baudrate(self._bus_master.handle, baud) == -1):
-                raise Exception('Failed to set the baudrate!')
+        # Decode the telegrams into typed records
+        bus.decoder = mbus_records.Record_Decoder()
 
-            # Start the periodical readout of the defined M-Bus device
-            self._mbus_loop()
-        except:
-            # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_uptime()+' _mbus_init: Error: '+str(sys.exc_info()[1])+'\n')
+        # Load the map of the addresses found by the last scan
+        if (bus.scan):
+            bus.address_map = mbus_scan.Address_Map(address_map+'_'+os.path.basename(bus.port)+'.json')
+
+    # Set the given devices of the given M-Bus bus and schedule their requests
+    def _mbus_configure(self, bus, devices):
+        '''
+        Set the given devices of the given M-Bus bus and schedule their requests
 
-            # Check, if the MBus master has already been initialized
-            if self._bus_master != None:
-                # Disconnect from the bus and free all occupied resources
-                self._bus_master.disconnect()
+        Each entry of the device table has to define the key address resp.
+        secondary (cf. _DEVICES). The telegrams read are decoded into single
+        records, that are published on sub-topics of the topic of the entry
+        (cf. mbus_records.py).
+        '''
+        # Entries addressed by their secondary address are identified by it
+        bus.configured = []
+        for device in devices:
+            if ('address' not in device):
+                device = dict(device, address=device['secondary'])
+            bus.configured.append(device)
+
+        # Read out the devices found by the last scan in addition to the
+        # device table
+        if (bus.scan):
+            self._mbus_merge_devices(bus)
+        else:
+            bus.devices = list(bus.configured)
+            self._mbus_plan(bus)
 
-            # Check, if the MQTT client has already been initialized
-            if self._client != None:
-                # Disconnect from the MQTT broker
-                self._client.disconnect()
-            else:
-                # Exit the program directly (instead of from _on_disconnect_cb(...))
-                sys.exit()
+    # Initialize the M-Bus master and start it (blocks until the readout has
+    # stopped; cf. bus_add(...) and bus_run(...) to serve multiple buses)
+    def _mbus_init(self, devices, **kwargs):
+        '''Initialize the M-Bus master and start it (cf. bus_add(...))'''
+        self.bus_add(1, devices, **kwargs)
+        self.bus_run()
 
 #------------------------------#
 ######### Main program #########
 #------------------------------#
 
+# Override the settings above by the ones of the configuration file
+_DEFAULTS=node_config.defaults(globals())
+try:
+    globals().update(node_config.load(_CONFIG, _DEFAULTS))
+except:
+    sys.exit(str(sys.exc_info()[1]))
+
+# User credentials
+with open(_USER_CREDENTIALS, 'r') as user_credentials:
+    _USERNAME=user_credentials.readline().rstrip('\n')
+    _PASSWORD=user_credentials.readline().rstrip('\n')
+if (_TOPIC == None):
+    _TOPIC='emra/'+_USERNAME
+
+# Get the buses to read out with the transfer parameters of bus_add(...) from
+# the settings
+def bus_table():
+    '''Get the buses to read out with the transfer parameters of bus_add(...) from the settings'''
+    buses = []
+    for bus in [{'op_mode': _OP_MODE, 'port': _BUS_PORT, 'devices': _DEVICES}]+_BUSES:
+        bus_kwargs = {'port': _BUS_PORT, 'baudrate': _BAUDRATE, 'read_interval': _READ_INTERVAL, 'align': _READ_ALIGN, 'groups': _POLL_GROUPS, 'budget': _BUS_BUDGET, 'adaptive_timeout': _ADAPTIVE_TIMEOUT, 'offline_after': _OFFLINE_AFTER, 'max_backoff': _MAX_BACKOFF, 'hotplug': _HOTPLUG_MODE}
+        if (bus['op_mode'] == 0):
+            bus_kwargs.update(max_gap=_MODBUS_MAX_GAP, timeout=_MODBUS_TIMEOUT, stopbits=_MODBUS_STOPBITS, bytesize=_MODBUS_BYTESIZE, parity=_MODBUS_PARITY, word_order=_MODBUS_WORD_ORDER, byte_order=_MODBUS_BYTE_ORDER)
+        elif (bus['op_mode'] == 1):
+            bus_kwargs.update(scan=_MBUS_SCAN, address_map=_MBUS_ADDRESS_MAP, scan_interval=_MBUS_SCAN_INTERVAL)
+        bus_kwargs.update(bus)
+        buses.append(bus_kwargs)
+    return buses
+
+# Reload the configuration file and apply the device tables, readout schedules
+# and filter rules to the running client
+def reload_settings():
+    '''Reload the configuration file and apply it to the running client'''
+    globals().update(node_config.load(_CONFIG, _DEFAULTS))
+    client.log_rules(level=_LOG_LEVEL, rate_limits=_LOG_RATE_LIMITS)
+    if (_FILTER_MODE == 1):
+        client.filter_rules(deadband=_DEADBAND, deadband_percent=_DEADBAND_PERCENT, max_silence=_MAX_SILENCE)
+    client.bus_reconfigure(bus_table())
+
 # Create a new instance of MQTT_Node_Client
-client = MQTT_Node_Client(op_mode=_OP_MODE, log_file=_LOG, database=_DB, csv_delimiter=_CSV_DELIMITER)
+client_kwargs = {'csv_delimiter': _CSV_DELIMITER, 'flush_bytes': _FLUSH_BYTES, 'flush_records': _FLUSH_RECORDS, 'flush_interval': _FLUSH_INTERVAL, 'log_level': _LOG_LEVEL, 'log_rate_limits': _LOG_RATE_LIMITS}
+if (_STORAGE_MODE == 0):
+    client_kwargs.update(history=_HISTORY, history_capacity=_HISTORY_CAPACITY)
+else:
+    client_kwargs.update(database=_DB)
+if (_FILTER_MODE == 1):
+    client_kwargs.update(deadband=_DEADBAND, deadband_percent=_DEADBAND_PERCENT, max_silence=_MAX_SILENCE)
+if (_AGGREGATE_MODE != 0):
+    client_kwargs.update(aggregate=_AGGREGATE_MODE, windows=_AGGREGATE_WINDOWS, statistics=_AGGREGATE_STATISTICS)
+client = MQTT_Node_Client(op_mode=_OP_MODE, log_file=_LOG, engine=_ENGINE_MODE, **client_kwargs)
 
 # Initialize the MQTT-client
-client.mqtt_node_client_init(remote_ip=_IP_ADDR_REMOTE, port=_MQTT_PORT, topic=_TOPIC, local_ip=_IP_ADDR_LOCAL, username=_USERNAME, password=_PASSWORD, ca=_CA, timeout=_MQTT_TIMEOUT)
-
-# Initialize the Modbus RTU resp. M-Bus master depending on the operation mode
-# and start the periodical readout of the defined devices
-if (_OP_MODE == 0):
-    client.bus_init(port=_BUS_PORT, address=_BUS_ADDRESS, baudrate=_BAUDRATE, read_interval=_READ_INTERVAL, register=_MODBUS_REGISTER, register_count=_MODBUS_REGISTER_COUNT, timeout=_MODBUS_TIMEOUT, stopbits=_MODBUS_STOPBITS, bytesize=_MODBUS_BYTESIZE, parity=_MODBUS_PARITY, signed=_MODBUS_SIGNED, endianness=_MODBUS_ENDIANNESS, bit_significance=_MODBUS_BIT_SIGNIFICANCE)
-elif (_OP_MODE == 1):
-    client.bus_init(port=_BUS_PORT, address=_BUS_ADDRESS, baudrate=_BAUDRATE, read_interval=_READ_INTERVAL)
+mqtt_kwargs = {'ca': _CA, 'timeout': _MQTT_TIMEOUT, 'max_inflight': _MAX_INFLIGHT}
+if (_QUEUE_MODE == 1):
+    mqtt_kwargs.update(queue=_QUEUE, queue_max_bytes=_QUEUE_MAX_BYTES, drain_rate=_DRAIN_RATE)
+if (_BATCH_MODE == 1):
+    mqtt_kwargs.update(batch_size=_BATCH_SIZE, batch_interval=_BATCH_INTERVAL, batch_compress=_BATCH_COMPRESS, batch_version=_BATCH_VERSION)
+client.mqtt_node_client_init(remote_ip=_IP_ADDR_REMOTE, port=_MQTT_PORT, topic=_TOPIC, local_ip=node_config.interface_address(_LOCAL_INTERFACE) if _LOCAL_INTERFACE else '', username=_USERNAME, password=_PASSWORD, **mqtt_kwargs)
+
+# Expose resp. publish the metrics of the node
+client.metrics_init(port=_METRICS_PORT, host=_METRICS_HOST, interval=_METRICS_INTERVAL)
+
+# Serve the registers read over Modbus TCP
+client.modbus_server_init(port=_MODBUS_SERVER_PORT, host=_MODBUS_SERVER_HOST, max_age=_MODBUS_SERVER_MAX_AGE)
+
+# Initialize the Modbus RTU resp. M-Bus masters depending on the operation modes
+# of the buses and start the periodical readout of the defined devices
+for bus_kwargs in bus_table():
+    client.bus_add(**bus_kwargs)
+
+# Reload the configuration file on SIGHUP
+client.reload_init(reload_settings)
+
+# Wait until all buses have stopped (resp. run the event loop of the asyncio
+# engine until then)
+client.bus_run()
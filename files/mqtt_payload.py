@@ -0,0 +1,364 @@
+# mqtt_payload.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Compact binary encoding of batches of values exchanged between
+# mqtt_node_client.py and mqtt_server_client.py.
+#
+# Instead of publishing every value read as a separate MQTT message (whose TLS
+# record, MQTT header and acknowledgement easily exceed the size of the value
+# itself), the node can collect multiple values and publish them as one batch.
+# A batch consists of a header (magic, version, flags, number of values) and a
+# body (name table, base timestamp and the values themselves packed via
+# struct), that may be compressed via zlib. Since the magic starts with a zero
+# byte, batches can't be confused with the plain text payloads published
+# otherwise.
+#
+# Format (version 1, all numbers big endian):
+# - header:     magic (b'\x00B'), version (uint8), flags (uint8), number of
+#               values (uint16)
+# - body:       number of names (uint16), names (uint8 length + UTF-8 each),
+#               base timestamp (float64; s since the epoch), values
+# - value:      index of the name (uint16), offset to the base timestamp
+#               (uint32; in ms), type (uint8), value (int64, float64 or uint16
+#               length + UTF-8, depending on the type)
+#
+# Version 2 stores the values of every name as a series instead: the values of
+# energy counters and the timestamps of periodical readouts hardly change from
+# one value to the next, so the differences (resp. the differences of the
+# differences) between consecutive values are small and are stored as zig-zag
+# encoded varints (LEB128) of mostly one or two bytes instead of eight bytes
+# each. Floats with few decimal places (e.g. 230.4 V) are stored as integers
+# scaled by a power of ten. Every series starts with its absolute values (key
+# frame), so every batch can be decoded on its own.
+#
+# Format (version 2; header, name table and base timestamp as in version 1):
+# - series:     one per name in the order of the name table: number of values
+#               (varint), timestamps (offsets to the base timestamp in ms;
+#               first offset, then differences of the differences (zig-zag
+#               varints)), encoding (uint8), values
+# - encoding:   type (upper four bits; 0 - integers, 1 - floats scaled by
+#               10^scale (followed by scale (uint8)), 2 - raw) and order of
+#               the differences of integers resp. scaled floats (lower four
+#               bits; 1 - differences, 2 - differences of the differences)
+# - values:     integers resp. scaled floats: first value, then differences of
+#               the given order (zig-zag varints); raw: type (uint8) and value
+#               as in version 1 each
+
+import struct
+import zlib
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Identification of a batch
+MAGIC=b'\x00B'
+
+# Current version of the format and versions, that can be decoded
+VERSION=2
+VERSIONS=(1, 2)
+
+# Flags
+FLAG_ZLIB=0x01
+
+# Types of the values
+_TYPE_INT=0
+_TYPE_FLOAT=1
+_TYPE_STRING=2
+
+# Types of the series of version 2
+_SERIES_INT=0
+_SERIES_SCALED=1
+_SERIES_RAW=2
+
+# Maximum number of decimal places of floats stored as scaled integers
+_MAX_SCALE=6
+
+_HEADER=struct.Struct('>2sBBH')
+_VALUE=struct.Struct('>HIB')
+_INT=struct.Struct('>q')
+_FLOAT=struct.Struct('>d')
+_LENGTH=struct.Struct('>H')
+_TIMESTAMP=struct.Struct('>d')
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Check, if the given payload is a batch
+def is_batch(payload):
+    '''Check, if the given payload is a batch'''
+    return isinstance(payload, bytes) and payload[:len(MAGIC)] == MAGIC
+
+# Encode the given non-negative integer as varint (LEB128)
+def _varint(number):
+    '''Encode the given non-negative integer as varint'''
+    encoded = bytearray()
+    while (number > 0x7f):
+        encoded.append((number & 0x7f) | 0x80)
+        number >>= 7
+    encoded.append(number)
+    return bytes(encoded)
+
+# Decode the varint at the given offset of data; return the integer and the
+# offset following it
+def _read_varint(data, offset):
+    '''Decode the varint at the given offset of data'''
+    number = 0
+    shift = 0
+    while (True):
+        byte = data[offset]
+        offset+=1
+        number|=(byte & 0x7f) << shift
+        if (not byte & 0x80):
+            return number, offset
+        shift+=7
+
+# Map the given integer to a non-negative integer (zig-zag encoding; 0, -1, 1,
+# -2, ... to 0, 1, 2, 3, ...)
+def _zigzag(number):
+    '''Map the given integer to a non-negative integer'''
+    return number*2 if number >= 0 else -number*2-1
+
+# Map the given non-negative integer back to the original integer (cf.
+# _zigzag(...))
+def _unzigzag(number):
+    '''Map the given non-negative integer back to the original integer'''
+    return number >> 1 if not number & 1 else -((number+1) >> 1)
+
+# Replace the given integers by their differences of the given order (the
+# first order values are kept as they are)
+def _differences(numbers, order):
+    '''Replace the given integers by their differences of the given order'''
+    for level in range(order):
+        numbers = numbers[:level+1]+[numbers[idx]-numbers[idx-1] for idx in range(level+1, len(numbers))]
+    return numbers
+
+# Restore the integers from their differences of the given order (cf.
+# _differences(...))
+def _integrate(numbers, order):
+    '''Restore the integers from their differences of the given order'''
+    numbers = list(numbers)
+    for level in reversed(range(order)):
+        for idx in range(level+1, len(numbers)):
+            numbers[idx]+=numbers[idx-1]
+    return numbers
+
+# Encode the given integers as differences of the order resulting in the
+# shorter encoding; return the order and the encoded integers
+def _encode_integers(numbers):
+    '''Encode the given integers as differences of the order resulting in the shorter encoding'''
+    encodings = []
+    for order in (1, 2):
+        encodings.append((order, b''.join(_varint(_zigzag(number)) for number in _differences(numbers, order))))
+    return min(encodings, key=lambda encoding: len(encoding[1]))
+
+# Get the number of decimal places, that the given floats can be stored with
+# as scaled integers without loss (None, if they can't)
+def _scale(values):
+    '''Get the number of decimal places the given floats can be stored with as scaled integers'''
+    for scale in range(_MAX_SCALE+1):
+        factor = 10**scale
+        try:
+            if (all(abs(value) < 2**53 and round(value*factor)/float(factor) == value for value in values)):
+                return scale
+        except (OverflowError, ValueError):
+            # Infinite resp. NaN values
+            return None
+    return None
+
+# Encode the given value as in version 1 (type and value)
+def _encode_value(value):
+    '''Encode the given value as in version 1'''
+    if (isinstance(value, int) and not isinstance(value, bool) and -2**63 <= value < 2**63):
+        return struct.pack('>B', _TYPE_INT)+_INT.pack(value)
+    elif (isinstance(value, (int, float))):
+        return struct.pack('>B', _TYPE_FLOAT)+_FLOAT.pack(value)
+    encoded = str(value).encode('utf-8')
+    return struct.pack('>B', _TYPE_STRING)+_LENGTH.pack(len(encoded))+encoded
+
+# Decode the value of the given type at the given offset of data as in version
+# 1; return the value and the offset following it
+def _decode_value(value_type, data, offset):
+    '''Decode the value of the given type at the given offset of data as in version 1'''
+    if (value_type == _TYPE_INT):
+        return _INT.unpack_from(data, offset)[0], offset+_INT.size
+    elif (value_type == _TYPE_FLOAT):
+        return _FLOAT.unpack_from(data, offset)[0], offset+_FLOAT.size
+    elif (value_type == _TYPE_STRING):
+        length = _LENGTH.unpack_from(data, offset)[0]
+        return data[offset+_LENGTH.size:offset+_LENGTH.size+length].decode('utf-8'), offset+_LENGTH.size+length
+    raise Exception('Invalid value type '+str(value_type)+'!')
+
+# Encode the given series of values (list of tuples (timestamp offset in ms,
+# value)) of one name (version 2)
+def _encode_series(series):
+    '''Encode the given series of values of one name'''
+    encoded = [_varint(len(series))]
+
+    # Timestamps
+    offsets = [offset for offset, value in series]
+    encoded.append(b''.join(_varint(_zigzag(number)) for number in _differences(offsets, 2)))
+
+    # Values
+    values = [value for offset, value in series]
+    if (all(isinstance(value, int) and not isinstance(value, bool) for value in values)):
+        order, numbers = _encode_integers(values)
+        encoded.append(struct.pack('>B', _SERIES_INT << 4 | order)+numbers)
+        return b''.join(encoded)
+
+    scale = None
+    if (all(isinstance(value, float) for value in values)):
+        scale = _scale(values)
+    if (scale != None):
+        order, numbers = _encode_integers([int(round(value*10**scale)) for value in values])
+        encoded.append(struct.pack('>BB', _SERIES_SCALED << 4 | order, scale)+numbers)
+    else:
+        encoded.append(struct.pack('>B', _SERIES_RAW << 4)+b''.join(_encode_value(value) for value in values))
+    return b''.join(encoded)
+
+# Decode the series of values at the given offset of data (version 2); return
+# a list of tuples (timestamp offset in ms, value) and the offset following it
+def _decode_series(data, offset):
+    '''Decode the series of values at the given offset of data'''
+    count, offset = _read_varint(data, offset)
+
+    # Timestamps
+    numbers = []
+    for idx in range(count):
+        number, offset = _read_varint(data, offset)
+        numbers.append(_unzigzag(number))
+    offsets = _integrate(numbers, 2)
+
+    # Values
+    encoding = data[offset]
+    offset+=1
+    series_type = encoding >> 4
+    order = encoding & 0x0f
+    if (series_type == _SERIES_RAW):
+        values = []
+        for idx in range(count):
+            value, offset = _decode_value(data[offset], data, offset+1)
+            values.append(value)
+        return list(zip(offsets, values)), offset
+
+    if (series_type == _SERIES_SCALED):
+        scale = data[offset]
+        offset+=1
+    elif (series_type != _SERIES_INT):
+        raise Exception('Invalid series type '+str(series_type)+'!')
+
+    numbers = []
+    for idx in range(count):
+        number, offset = _read_varint(data, offset)
+        numbers.append(_unzigzag(number))
+    values = _integrate(numbers, order)
+    if (series_type == _SERIES_SCALED):
+        values = [value/float(10**scale) for value in values]
+    return list(zip(offsets, values)), offset
+
+# Encode the given values as a batch
+def encode_batch(values, **kwargs):
+    '''
+    Encode the given values as a batch
+
+    values is a list of tuples (name, timestamp, value); name is e.g. the topic
+    suffix of the value (relative to the topic the batch is published on),
+    timestamp is given in s since the epoch and value can be an integer, a
+    float or a string.
+
+    Permitted transfer parameters:
+    - compress  (default: 0; if set, the body is compressed via zlib)
+    - version   (default: VERSION; version of the format)
+    '''
+    # Evaluate the transfer parameters
+    compress = kwargs.get('compress', 0)
+    version = kwargs.get('version', VERSION)
+
+    if (len(values) > 0xffff):
+        raise Exception('Too many values for one batch!')
+    if (version not in VERSIONS):
+        raise Exception('Unsupported batch version '+str(version)+'!')
+
+    # Build the name table
+    names = []
+    name_index = {}
+    for name, timestamp, value in values:
+        if (name not in name_index):
+            name_index[name] = len(names)
+            names.append(name)
+
+    body = [_LENGTH.pack(len(names))]
+    for name in names:
+        encoded = name.encode('utf-8')
+        body.append(struct.pack('>B', len(encoded))+encoded)
+
+    # Pack the values relative to the oldest timestamp
+    base = min([timestamp for name, timestamp, value in values]) if values else 0.0
+    body.append(_TIMESTAMP.pack(base))
+    if (version == 1):
+        for name, timestamp, value in values:
+            offset = int(round((timestamp-base)*1000))
+            body.append(struct.pack('>HI', name_index[name], offset)+_encode_value(value))
+    else:
+        series = [[] for name in names]
+        for name, timestamp, value in values:
+            series[name_index[name]].append((int(round((timestamp-base)*1000)), value))
+        for values_of_name in series:
+            body.append(_encode_series(values_of_name))
+    body = b''.join(body)
+
+    flags = 0
+    if (compress):
+        body = zlib.compress(body, 9)
+        flags|=FLAG_ZLIB
+
+    return _HEADER.pack(MAGIC, version, flags, len(values))+body
+
+# Decode the given batch
+def decode_batch(payload):
+    '''Decode the given batch; return a list of tuples (name, timestamp, value)'''
+    magic, version, flags, count = _HEADER.unpack_from(payload, 0)
+    if (magic != MAGIC):
+        raise Exception('Invalid batch!')
+    if (version not in VERSIONS):
+        raise Exception('Unsupported batch version '+str(version)+'!')
+
+    body = payload[_HEADER.size:]
+    if (flags & FLAG_ZLIB):
+        body = zlib.decompress(body)
+
+    # Read the name table
+    offset = 0
+    name_count = _LENGTH.unpack_from(body, offset)[0]
+    offset+=_LENGTH.size
+    names = []
+    for idx in range(name_count):
+        length = body[offset]
+        names.append(body[offset+1:offset+1+length].decode('utf-8'))
+        offset+=1+length
+
+    # Read the values
+    base = _TIMESTAMP.unpack_from(body, offset)[0]
+    offset+=_TIMESTAMP.size
+    values = []
+    if (version == 1):
+        for idx in range(count):
+            name, timestamp, value_type = _VALUE.unpack_from(body, offset)
+            value, offset = _decode_value(value_type, body, offset+_VALUE.size)
+            values.append((names[name], base+timestamp/1000.0, value))
+    else:
+        for name in names:
+            series, offset = _decode_series(body, offset)
+            values+=[(name, base+timestamp/1000.0, value) for timestamp, value in series]
+        if (len(values) != count):
+            raise Exception('Invalid number of values!')
+
+        # Restore the order of the values (the values of every name are
+        # grouped into a series)
+        values.sort(key=lambda value: value[1])
+
+    return values
@@ -14,6 +14,9 @@
 # published on the subscribed topics at all times.
 
 import paho.mqtt.client as mqtt
+import buffered_writer
+import queue_logger
+import mqtt_payload
 import time
 import ssl
 import sys
@@ -40,12 +43,35 @@ with open(_USER_CREDENTIALS, 'r') as user_credentials:
     _USERNAME=user_credentials.readline().rstrip('\n')
     _PASSWORD=user_credentials.readline().rstrip('\n')
 
-# Topics to subscribe to
-_TOPICS='emra/+'
+# Topics to subscribe to (the nodes publish on emra/<username> resp. on
+# emra/<username>/<topic> for every entry of their device tables; status
+# messages, that aren't measured values, are published on sub-topics starting
+# with $, e.g. the state of the devices on emra/<username>/$state/<topic> and the
+# will of the node on emra/<username>/$node; the metrics published on
+# emra/<username>/$metrics are skipped)
+_TOPICS='emra/#'
 
 # CSV delimiter
 _CSV_DELIMITER=','
 
+# Flush policy of the log file and the database; the entries are buffered in
+# memory and written to the files as soon as one of the following limits is
+# reached
+# Number of bytes buffered
+_FLUSH_BYTES=4096
+# Number of entries buffered
+_FLUSH_RECORDS=50
+# Time since the last flush (in s)
+_FLUSH_INTERVAL=30
+
+# Severity level of the messages written to the log file ('debug', 'info',
+# 'warning' or 'error')
+_LOG_LEVEL='info'
+
+# Maximum number of log messages per second of the given functions (e.g. one
+# per message received); further messages are suppressed and counted
+_LOG_RATE_LIMITS={'_on_message_cb': 1}
+
 # Local IP-address to bind the MQTT client to
 _IP_ADDR_LOCAL='127.0.0.1'
 
@@ -89,23 +115,40 @@ class MQTT_Server_Client(object):
         - database      (default: /var/lib/mqtt_node_client/mqtt_node_client.db.csv)
         - exchange_dir  (default: /usr/local/var/)
         - delimiter     (default: ,)
+        - flush_bytes   (default: 4096)
+        - flush_records (default: 50)
+        - flush_interval (default: 30)
+        - log_level     (default: info)
+        - log_rate_limits (default: {})
         '''
         # Evaluate the transfer parameters
-        self._log = kwargs.get('log_file', '/var/log/mqtt_node_client/mqtt_node_client.log')
-        self._db = kwargs.get('database', '/var/lib/mqtt_node_client/mqtt_node_client.db.csv')
+        log_file = kwargs.get('log_file', '/var/log/mqtt_node_client/mqtt_node_client.log')
+        database = kwargs.get('database', '/var/lib/mqtt_node_client/mqtt_node_client.db.csv')
         self._exchange_dir = kwargs.get('exchange_dir', '/usr/local/var/')
         self._csv_delimiter = kwargs.get('csv_delimiter', ',')
+        flush_bytes = kwargs.get('flush_bytes', 4096)
+        flush_records = kwargs.get('flush_records', 50)
+        flush_interval = kwargs.get('flush_interval', 30)
+        log_level = kwargs.get('log_level', 'info')
+        log_rate_limits = kwargs.get('log_rate_limits', {})
+
+        # Open the log file and the database; both are kept open and written
+        # to in a buffered way (cf. buffered_writer.py); the log messages are
+        # written by a separate thread, so logging doesn't delay the network
+        # loop (cf. queue_logger.py)
+        self._log = queue_logger.Queue_Logger(log_file, level=queue_logger.LEVELS[log_level], rate_limits=log_rate_limits, stamp=self.get_datetime, flush_bytes=flush_bytes, flush_records=flush_records, flush_interval=flush_interval)
+        self._db = buffered_writer.Buffered_Writer(database, flush_bytes=flush_bytes, flush_records=flush_records, flush_interval=flush_interval)
 
         # Initialize _client
         self._client = None
 
     # General:
 
-    # Get the current date and time and format the output
+    # Get the current (resp. the given) date and time and format the output
     # Format: yyyy-mm-dd hh:mm:ss
-    def get_datetime(self):
-        '''Get the current date and time and format the output'''
-        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())
+    def get_datetime(self, timestamp=None):
+        '''Get the current (resp. the given) date and time and format the output'''
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
 
     # MQTT:
 
@@ -115,29 +158,23 @@ class MQTT_Server_Client(object):
     # managed by the network loop in any other case)
     def _on_connect_cb(self, client_instance, userdata, flags, return_code):
         '''Callback function, which is called after an attempt to connect to the MQTT broker'''
-        log_buffer=(self.get_datetime()+'_on_connect_cb: Return code: '+mqtt.connack_string(return_code)+'\n')
+        self._log.info('_on_connect_cb', 'Return code: '+mqtt.connack_string(return_code))
 
         # Connection attempt was successfull
         if return_code == mqtt.CONNACK_ACCEPTED:
-            log_buffer+=(self.get_datetime()+'_on_connect_cb: Subscribing to the defined topics!\n')
+            self._log.info('_on_connect_cb', 'Subscribing to the defined topics!')
             # Subscribe to the defined topics; retry every 30 seconds if the
             # subscription fails
             try:
                 while (self._client.subscribe(topic=self._topics, qos=1)[0] != mqtt.MQTT_ERR_SUCCESS):
-                    log_buffer+=(self.get_datetime()+'_on_connect_cb: Subscription failed! No connection to the broker! Retrying in 30 seconds!\n')
+                    self._log.warning('_on_connect_cb', 'Subscription failed! No connection to the broker! Retrying in 30 seconds!')
                     time.sleep(30)
-                log_buffer+=(self.get_datetime()+'_on_connect_cb: Successfully subscribed to the defined topics!\n')
+                self._log.info('_on_connect_cb', 'Successfully subscribed to the defined topics!')
             except:
-                log_buffer+=(self.get_datetime()+'_on_connect_cb: Error: '+str(sys.exc_info()[1])+'\n')
+                self._log.error('_on_connect_cb', 'Error: '+str(sys.exc_info()[1]))
         # Connection attempt wasn't successfull
         else:
-            log_buffer+=(self.get_datetime()+'_on_connect_cb: Trying again!\n')
-
-        # Write the buffer to the log (the usage of a buffer allows to minimalize
-        # file is opened (and therewith occupied) by the program, thus reducing
-        # the risk of an access conflict)
-        with open(self._log, 'a') as log:
-            log.write(log_buffer)
+            self._log.warning('_on_connect_cb', 'Trying again!')
 
     # Callback function, which is called after the client disconnected the MQTT
     # broker; evaluate the connection result and, in case of an intended
@@ -145,43 +182,29 @@ class MQTT_Server_Client(object):
     # in any other case)
     def _on_disconnect_cb(self, client_instance, userdata, return_code):
         '''Callback function, which is called after the client disconnected the MQTT broker'''
-        log_buffer=(self.get_datetime()+' _on_disconnect_cb: Disconnected from the broker! Return code: '+mqtt.error_string(return_code)+'\n')
+        self._log.info('_on_disconnect_cb', 'Disconnected from the broker! Return code: '+mqtt.error_string(return_code))
 
         # Exit the program if the disconnect was caused by client.disconnect()
         if return_code == mqtt.MQTT_ERR_SUCCESS:
-            log_buffer+=(self.get_datetime()+' _on_disconnect_cb: Exiting the program!\n')
+            self._log.info('_on_disconnect_cb', 'Exiting the program!')
 
             # Exit the program
             sys.exit()
         else:
-            log_buffer+=(self.get_datetime()+' _on_disconnect_cb: Trying to reconnect!\n')
-
-        # Write the buffer to the log (the usage of a buffer allows to minimalize
-        # file is opened (and therewith occupied) by the program, thus reducing
-        # the risk of an access conflict)
-        with open(self._log, 'a') as log:
-            log.write(log_buffer)
-
-    # Callback function, that is called everytime a new message is published on
-    # a topic subscribed by the client; log the message received and write it to
-    # the data-exchange-file
-    def _on_message_cb(self, client_instance, userdata, msg):
-        '''Callback function, that is called everytime a new message is published on a topic subscribed by the client'''
-        log_buffer=(self.get_datetime()+'_on_message_cb: Obtained message '+str(msg.payload).lstrip('b').strip("'")+' on topic '+msg.topic+'\n')
-
-        # Write the message received to the database
-        with open(self._db, 'a') as database:
-            database.write(self.get_datetime()+self._csv_delimiter+msg.topic[msg.topic.rfind('/')+1:]+self._csv_delimiter+str(msg.payload).lstrip('b').strip("'")+'\n')
+            self._log.warning('_on_disconnect_cb', 'Trying to reconnect!')
 
+    # Write the given data to the data-exchange-file of the given topic
+    def _write_exchange_file(self, topic, data):
+        '''Write the given data to the data-exchange-file of the given topic'''
         try:
             # Create the respective sub-directories in the data-exchange-directory
             # if they don't exist yet
-            _exchange_file=self._exchange_dir+msg.topic
+            _exchange_file=self._exchange_dir+topic
             os.makedirs(_exchange_file[:_exchange_file.rfind('/')], exist_ok=True)
 
             # Generate a temporary file containing the data received
             with open(_exchange_file+'.temp', 'w') as data_exchange_file:
-                data_exchange_file.write(str(msg.payload).lstrip('b').strip("'"))
+                data_exchange_file.write(data)
                 data_exchange_file.flush()
                 os.fsync(data_exchange_file.fileno())
         except FileNotFoundError:
@@ -192,9 +215,11 @@ class MQTT_Server_Client(object):
             # wild runtime-condition occurs). The result is a FileNotFoundError.
             # In this case, the message received can still be found in the
             # database, but the respective data-exchange-file isn't created.
-            log_buffer+=(self.get_datetime()+'_on_message_cb: Error! No such file or directory: '+_exchange_file+'\n')
+            self._log.error('_on_message_cb', 'Error! No such file or directory: ', _exchange_file)
+            return
         except:
-            log_buffer+=(self.get_datetime()+'_on_message_cb: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('_on_message_cb', 'Error writing the data-exchange-file ', _exchange_file, ': ', sys.exc_info()[1])
+            return
 
         # Replace the current data-exchange-file with the temporary file
         #
@@ -212,13 +237,77 @@ class MQTT_Server_Client(object):
         try:
             os.rename(_exchange_file+'.temp', _exchange_file)
         except:
-            log_buffer+=(self.get_datetime()+'_on_message_cb: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('_on_message_cb', 'Error: ', sys.exc_info()[1])
+
+    # Unpack the given batch published by a node (cf. mqtt_payload.py) into the
+    # single values and write them to the database as well as to the data-
+    # exchange-files of their topics
+    def _process_batch(self, topic, payload):
+        '''Unpack the given batch published by a node into the single values'''
+        try:
+            values = mqtt_payload.decode_batch(payload)
+        except:
+            self._log.error('_on_message_cb', 'Error! Invalid batch on topic ', topic, ': ', sys.exc_info()[1])
+            return
+
+        self._log.info('_on_message_cb', 'Obtained batch of ', len(values), ' values on topic ', topic)
+
+        # The names of the values are given relative to the topic of the node
+        # (the topic the batch was published on without the last level)
+        node_topic = topic[:topic.rfind('/')]
+
+        # Write the values received to the database with the time they were read
+        # at and remember the most current value of every topic
+        latest = {}
+        for name, timestamp, value in values:
+            value_topic = node_topic+'/'+name if name else node_topic
+            self._db.write(self.get_datetime(timestamp)+self._csv_delimiter+value_topic[value_topic.find('/')+1:]+self._csv_delimiter+str(value)+'\n')
+            latest[value_topic] = value
+
+        # Only the most current value of every topic has to be written to the
+        # data-exchange-files
+        for value_topic, value in latest.items():
+            self._write_exchange_file(value_topic, str(value))
+
+    # Log the given status message published by a node (e.g. the state of a
+    # device or the will of the node) and write it to the data-exchange-file of
+    # its topic; status messages aren't written to the database
+    def _process_status(self, topic, payload):
+        '''Log the given status message published by a node and write it to the data-exchange-file'''
+        # The metrics of the nodes (Prometheus text format) are meant for
+        # monitoring (cf. the metrics endpoint of mqtt_node_client.py); they are
+        # neither measured values nor of use for the data-exchange-files
+        if (topic.endswith('/$metrics')):
+            self._log.debug('_on_message_cb', 'Obtained metrics on topic ', topic)
+            return
+
+        self._log.info('_on_message_cb', 'Obtained status ', payload, ' on topic ', topic)
+        self._write_exchange_file(topic, payload)
+
+    # Callback function, that is called everytime a new message is published on
+    # a topic subscribed by the client; log the message received and write it to
+    # the data-exchange-file
+    def _on_message_cb(self, client_instance, userdata, msg):
+        '''Callback function, that is called everytime a new message is published on a topic subscribed by the client'''
+        # Unpack batches of values published by the nodes
+        if (mqtt_payload.is_batch(msg.payload)):
+            self._process_batch(msg.topic, msg.payload)
+            return
+
+        payload = str(msg.payload).lstrip('b').strip("'")
+
+        # Status messages of the nodes aren't measured values
+        if ('/$' in msg.topic):
+            self._process_status(msg.topic, payload)
+            return
+
+        self._log.info('_on_message_cb', 'Obtained message ', payload, ' on topic ', msg.topic)
+
+        # Write the message received to the database
+        self._db.write(self.get_datetime()+self._csv_delimiter+msg.topic[msg.topic.find('/')+1:]+self._csv_delimiter+payload+'\n')
 
-        # Write the buffer to the log (the usage of a buffer allows to minimalize
-        # file is opened (and therewith occupied) by the program, thus reducing
-        # the risk of an access conflict)
-        with open(self._log, 'a') as log:
-            log.write(log_buffer)
+        # Write the message received to the data-exchange-file
+        self._write_exchange_file(msg.topic, payload)
 
     # Initialize and configure the MQTT client
     def mqtt_node_client_init(self, remote_ip, port, topics, local_ip, username, password, **kwargs):
@@ -237,11 +326,8 @@ class MQTT_Server_Client(object):
 
         self._topics = topics
 
-        with open(self._log, 'a') as log:
-            log.write(
-                self.get_datetime()+' mqtt_node_client_init: Initializing and configuring the MQTT client!\n'+
-                self.get_datetime()+' mqtt_node_client_init: Local IP: '+local_ip+'   Remote IP: '+remote_ip+'   Port: '+str(port)+'\n'
-            )
+        self._log.info('mqtt_node_client_init', 'Initializing and configuring the MQTT client!')
+        self._log.info('mqtt_node_client_init', 'Local IP: '+local_ip+'   Remote IP: '+remote_ip+'   Port: '+str(port))
 
         try:
             # Initialize the MQTT client and set the respective callback functions
@@ -267,8 +353,7 @@ class MQTT_Server_Client(object):
             self._client.loop_forever(retry_first_connection=True)
         except:
             # Log occuring errors
-            with open(self._log, 'a') as log:
-                log.write(self.get_datetime()+' mqtt_node_client_init: Error: '+str(sys.exc_info()[1])+'\n')
+            self._log.error('mqtt_node_client_init', 'Error: '+str(sys.exc_info()[1]))
 
             # Check, if the MQTT client has already been initialized
             if self._client != None:
@@ -283,7 +368,7 @@ class MQTT_Server_Client(object):
 #------------------------------#
 
 # Create a new instance of MQTT_Node_Client
-client = MQTT_Server_Client(log_file=_LOG, database=_DB, exchange_dir=_EXCHANGE_DIR, csv_delimiter=_CSV_DELIMITER)
+client = MQTT_Server_Client(log_file=_LOG, database=_DB, exchange_dir=_EXCHANGE_DIR, csv_delimiter=_CSV_DELIMITER, flush_bytes=_FLUSH_BYTES, flush_records=_FLUSH_RECORDS, flush_interval=_FLUSH_INTERVAL, log_level=_LOG_LEVEL, log_rate_limits=_LOG_RATE_LIMITS)
 
 # Initialize the MQTT-client
 client.mqtt_node_client_init(remote_ip=_IP_ADDR_REMOTE, port=_MQTT_PORT, topics=_TOPICS, local_ip=_IP_ADDR_LOCAL, username=_USERNAME, password=_PASSWORD, ca=_CA, timeout=_MQTT_TIMEOUT)
@@ -0,0 +1,229 @@
+# node_aggregate.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Aggregation of the values read by mqtt_node_client.py over time
+# windows.
+#
+# Instead of (resp. additionally to) every value read, the node can report
+# statistics (minimum, maximum, mean, last value and number of values) of every
+# point over time windows, which reduces the number of values transmitted to
+# the server while keeping the peaks, that reducing the sampling rate would
+# lose. A window is defined by its length and the time-interval (hop) its
+# statistics are reported after; windows, whose hop equals their length, are
+# tumbling windows, others are sliding windows. The windows are aligned to the
+# epoch (e.g. a window of 60 s ends on every full minute).
+#
+# The statistics are computed incrementally: every window is split into panes
+# of the length of its hop, each holding the statistics of the values that fell
+# into it, and the statistics of the window are combined from its panes when it
+# ends. Thereby, every window only occupies a fixed amount of memory per point
+# (one pane per hop within the length) regardless of the number of values read.
+
+import math
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Statistics available
+STATISTICS=('min', 'max', 'mean', 'last', 'count')
+
+# Indices of the statistics of a pane
+_INDEX=0
+_COUNT=1
+_SUM=2
+_MIN=3
+_MAX=4
+_LAST=5
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Validate the given window definitions and statistics; return the windows as
+# tuples (name, length, hop); raise an exception describing the first invalid
+# definition
+def windows(definitions, statistics):
+    '''Validate the given window definitions and statistics'''
+    if (not isinstance(definitions, list)):
+        raise Exception('Aggregation windows aren\'t a list!')
+    if (not isinstance(statistics, list) or any(statistic not in STATISTICS for statistic in statistics)):
+        raise Exception('Only the statistics '+', '.join(STATISTICS)+' are permitted!')
+
+    parsed = []
+    for index, definition in enumerate(definitions):
+        entry = 'Aggregation window '+str(index)
+        if (not isinstance(definition, dict) or any(key not in ('length', 'hop', 'name') for key in definition)):
+            raise Exception(entry+': Only the keys length, hop and name are permitted!')
+
+        length = definition.get('length')
+        hop = definition.get('hop', length)
+        if (not isinstance(length, (int, float)) or isinstance(length, bool) or length <= 0):
+            raise Exception(entry+': Invalid length!')
+        if (not isinstance(hop, (int, float)) or isinstance(hop, bool) or hop <= 0 or hop > length):
+            raise Exception(entry+': Invalid hop!')
+
+        # The window has to consist of whole panes
+        panes = length/float(hop)
+        if (abs(panes-round(panes)) > 1e-9):
+            raise Exception(entry+': The length has to be a multiple of the hop!')
+
+        name = definition.get('name', ('%g' % length)+'s')
+        if (not isinstance(name, str) or not name or '/' in name or '+' in name or '#' in name):
+            raise Exception(entry+': Invalid name!')
+        if (name in [window[0] for window in parsed]):
+            raise Exception(entry+': Duplicate name '+name+'!')
+
+        parsed.append((name, length, hop))
+    return parsed
+
+class _Window(object):
+    '''
+    Panes of one window of all points.
+    '''
+
+    # Initialization method; set the name, length and hop of the window
+    def __init__(self, name, length, hop):
+        '''Initialization method; set the name, length and hop of the window'''
+        self.name = name
+        self.hop = hop
+        self.panes = int(round(length/float(hop)))
+
+        # Panes of every point (ring of panes indexed by the number of the pane
+        # modulo the number of panes per window)
+        self.points = {}
+
+        # Number of the last pane, whose window has been reported (None until
+        # the first value has been added), and of the latest pane holding
+        # values
+        self.reported = None
+        self.latest = None
+
+    # Get the number of the pane the given time falls into
+    def pane(self, timestamp):
+        '''Get the number of the pane the given time falls into'''
+        return int(math.floor(timestamp/self.hop))
+
+class Window_Aggregator(object):
+    '''
+    Statistics of the values of every point over tumbling resp. sliding time
+    windows, computed incrementally from panes.
+    '''
+
+    # Initialization method; set the windows and the statistics to report
+    def __init__(self, **kwargs):
+        '''
+        Initialization method; set the windows and the statistics to report
+
+        Permitted transfer parameters:
+        - windows       (default: [{'length': 60}]; definitions of the
+                        windows, each with the keys length (in s), hop (in s;
+                        default: length) and name (default: <length>s))
+        - statistics    (default: min, max, mean, last; statistics reported per
+                        window)
+        '''
+        # Evaluate the transfer parameters
+        self._statistics = list(kwargs.get('statistics', ['min', 'max', 'mean', 'last']))
+        self._windows = [_Window(*window) for window in windows(kwargs.get('windows', [{'length': 60}]), self._statistics)]
+
+        # Time the next window ends (earliest of all windows)
+        self._next = math.inf
+
+        # Statistics
+        self.values = 0
+        self.aggregates = 0
+
+    # Add the given value of the given point read at the given time (in s since
+    # the epoch); return False, if the value isn't numeric and can't be
+    # aggregated
+    def add(self, point, value, timestamp):
+        '''Add the given value of the given point read at the given time'''
+        if (isinstance(value, bool) or not isinstance(value, (int, float))):
+            return False
+
+        self.values+=1
+        for window in self._windows:
+            index = window.pane(timestamp)
+            panes = window.points.get(point)
+            if (panes == None):
+                panes = window.points[point] = [None]*window.panes
+
+            # Start a new pane, if the slot holds an outdated one
+            pane = panes[index%window.panes]
+            if (pane == None or pane[_INDEX] != index):
+                panes[index%window.panes] = [index, 1, value, value, value, value]
+            else:
+                pane[_COUNT]+=1
+                pane[_SUM]+=value
+                if (value < pane[_MIN]):
+                    pane[_MIN] = value
+                if (value > pane[_MAX]):
+                    pane[_MAX] = value
+                pane[_LAST] = value
+
+            if (window.reported == None):
+                window.reported = index-1
+            window.latest = index if window.latest == None else max(window.latest, index)
+            self._next = min(self._next, (window.reported+2)*window.hop)
+
+        return True
+
+    # Get the statistics of the windows, that have ended up to the given time
+    # (in s since the epoch), as list of tuples (point, name of the window,
+    # statistics (dictionary), time the window ended); has to be called before
+    # a value read after the end of a window is added
+    def due(self, timestamp):
+        '''Get the statistics of the windows, that have ended up to the given time'''
+        if (timestamp < self._next):
+            return []
+
+        results = []
+        self._next = math.inf
+        for window in self._windows:
+            if (window.reported == None):
+                continue
+            current = window.pane(timestamp)
+
+            # Windows ending in the panes since the last report; windows more
+            # than one window length after the last value can't contain values
+            # anymore
+            for last in range(window.reported+1, min(current, window.latest+window.panes)):
+                for point, panes in window.points.items():
+                    statistics = self._combine([pane for pane in panes if pane != None and last-window.panes < pane[_INDEX] <= last])
+                    if (statistics != None):
+                        results.append((point, window.name, statistics, (last+1)*window.hop))
+
+            window.reported = max(window.reported, current-1)
+            self._next = min(self._next, (window.reported+2)*window.hop)
+
+        self.aggregates+=len(results)
+        return results
+
+    # Combine the statistics of the given panes; return the statistics to
+    # report (None, if there are no values)
+    def _combine(self, panes):
+        '''Combine the statistics of the given panes'''
+        if (not panes):
+            return None
+
+        count = sum(pane[_COUNT] for pane in panes)
+        combined = {
+            'min': min(pane[_MIN] for pane in panes),
+            'max': max(pane[_MAX] for pane in panes),
+            'mean': sum(pane[_SUM] for pane in panes)/float(count),
+            'last': max(panes, key=lambda pane: pane[_INDEX])[_LAST],
+            'count': count,
+        }
+        return dict((statistic, combined[statistic]) for statistic in self._statistics)
+
+    # Forget the panes of the given point resp. of all points
+    def reset(self, point=None):
+        '''Forget the panes of the given point resp. of all points'''
+        for window in self._windows:
+            if (point == None):
+                window.points = {}
+            else:
+                window.points.pop(point, None)
@@ -0,0 +1,208 @@
+# node_config.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Configuration file of mqtt_node_client.py.
+#
+# The settings at the top of mqtt_node_client.py serve as defaults, that can be
+# overridden by a configuration file in the JSON format, so the configuration
+# of a node (e.g. its device table) can be rolled out without editing the
+# program. Every key of the file is the name of a setting in lower case and
+# without the leading underscore, e.g.
+#
+#   {
+#       "read_interval": 10,
+#       "devices": [
+#           {"address": 1, "topic": "meter1", "register": 50536, "type": "uint32", "group": "counters"}
+#       ]
+#   }
+#
+# The file is validated as a whole (unknown settings, values of the wrong type
+# and invalid device table entries are rejected), so a faulty file never takes
+# effect partially. The file is read again on SIGHUP; changes of the device
+# tables and the readout schedules are applied without closing the serial ports
+# or the connection to the MQTT broker.
+
+import modbus_registers
+import node_aggregate
+import queue_logger
+import socket
+import fcntl
+import struct
+import json
+import sys
+import re
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Names of the settings (module constants in upper case with a leading
+# underscore)
+_SETTING=re.compile(r'^_[A-Z][A-Z0-9_]*$')
+
+# Keys of the device table entries and their types
+_DEVICE_KEYS={
+    'address':          (int, str),
+    'topic':            (str,),
+    'deadband':         (int, float),
+    'deadband_percent': (int, float),
+    'max_silence':      (int, float),
+    'aggregate':        (int,),
+    'priority':         (int,),
+    'interval':         (int, float),
+    'group':            (str,),
+    'function':         (int,),
+    'register':         (int,),
+    'register_count':   (int,),
+    'type':             (str,),
+    'signed':           (int,),
+    'word_order':       (str,),
+    'byte_order':       (str,),
+    'scale':            (int, float),
+    'secondary':        (str,),
+    'records':          (list,),
+}
+
+# Keys of the entries of the poll groups
+_GROUP_KEYS=('interval', 'priority')
+
+# Request of the address of a network interface (cf. netdevice(7))
+_SIOCGIFADDR=0x8915
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Get the settings (and their current values) defined in the given namespace
+# (e.g. globals() of mqtt_node_client.py)
+def defaults(namespace):
+    '''Get the settings defined in the given namespace'''
+    return dict((name, value) for name, value in namespace.items() if _SETTING.match(name) and not callable(value))
+
+# Check, if the given value may replace the given default value of a setting
+def _compatible(value, default):
+    '''Check, if the given value may replace the given default value of a setting'''
+    if (default == None or value == None):
+        return True
+    if (isinstance(default, bool) or isinstance(value, bool)):
+        return isinstance(value, bool) and isinstance(default, bool)
+    if (isinstance(default, (int, float))):
+        return isinstance(value, (int, float))
+    return isinstance(value, type(default))
+
+# Validate the given device table (of a bus of the given operation mode, cf.
+# _OP_MODE) against the given poll groups; raise an exception describing the
+# first invalid entry
+def validate_devices(op_mode, devices, groups):
+    '''Validate the given device table of a bus of the given operation mode'''
+    if (not isinstance(devices, list)):
+        raise Exception('Device table isn\'t a list!')
+
+    for index, device in enumerate(devices):
+        entry = 'Device table entry '+str(index)
+        if (not isinstance(device, dict)):
+            raise Exception(entry+' isn\'t an object!')
+
+        for key, value in device.items():
+            if (key not in _DEVICE_KEYS):
+                raise Exception(entry+': Unknown key '+key+'!')
+            if (not isinstance(value, _DEVICE_KEYS[key]) or isinstance(value, bool)):
+                raise Exception(entry+': Invalid value of '+key+'!')
+
+        if ('address' not in device and (op_mode == 0 or 'secondary' not in device)):
+            raise Exception(entry+': Missing address!')
+        if ('group' in device and device['group'] not in groups):
+            raise Exception(entry+': Unknown poll group '+device['group']+'!')
+        if (device.get('interval', 1) <= 0):
+            raise Exception(entry+': Invalid interval!')
+        if (device.get('priority', 0) < 0):
+            raise Exception(entry+': Invalid priority!')
+        if (device.get('aggregate', 0) not in (0, 1, 2)):
+            raise Exception(entry+': Invalid aggregation mode!')
+
+        if (op_mode == 0):
+            if ('register' not in device):
+                raise Exception(entry+': Missing register!')
+
+            # Compile the decoder of the entry to check its function code, data
+            # type, orders and register count
+            try:
+                modbus_registers.decoder(device)
+            except:
+                raise Exception(entry+': '+str(sys.exc_info()[1]))
+
+# Validate the given poll groups; raise an exception describing the first
+# invalid group
+def validate_groups(groups):
+    '''Validate the given poll groups'''
+    if (not isinstance(groups, dict)):
+        raise Exception('Poll groups aren\'t an object!')
+
+    for name, group in groups.items():
+        if (not isinstance(group, dict) or any(key not in _GROUP_KEYS for key in group)):
+            raise Exception('Poll group '+name+': Only the keys '+', '.join(_GROUP_KEYS)+' are permitted!')
+        if (not isinstance(group.get('interval', 1), (int, float)) or group.get('interval', 1) <= 0):
+            raise Exception('Poll group '+name+': Invalid interval!')
+        if (not isinstance(group.get('priority', 0), int) or group.get('priority', 0) < 0):
+            raise Exception('Poll group '+name+': Invalid priority!')
+
+# Load the configuration file at the given path and validate it against the
+# given default settings (cf. defaults(...)); return the resulting settings
+# (the defaults overridden by the settings of the file; only the defaults, if
+# there's no file)
+def load(path, settings):
+    '''Load the configuration file at the given path and validate it against the given default settings'''
+    settings = dict(settings)
+
+    try:
+        with open(path, 'r') as config_file:
+            content = json.load(config_file)
+    except FileNotFoundError:
+        return settings
+    except ValueError:
+        raise Exception('Invalid configuration file '+path+': '+str(sys.exc_info()[1]))
+
+    if (not isinstance(content, dict)):
+        raise Exception('Invalid configuration file '+path+': Not an object!')
+
+    # Override the defaults by the settings of the file
+    for key, value in content.items():
+        name = '_'+key.upper()
+        if (name not in settings):
+            raise Exception('Invalid configuration file '+path+': Unknown setting '+key+'!')
+        if (not _compatible(value, settings[name])):
+            raise Exception('Invalid configuration file '+path+': Invalid value of '+key+'!')
+        settings[name] = value
+
+    # Validate the device tables of all buses
+    try:
+        groups = settings.get('_POLL_GROUPS', {})
+        validate_groups(groups)
+        node_aggregate.windows(settings.get('_AGGREGATE_WINDOWS', []), settings.get('_AGGREGATE_STATISTICS', []))
+        if (settings.get('_LOG_LEVEL', 'info') not in queue_logger.LEVELS):
+            raise Exception('Only the log levels '+', '.join(queue_logger.LEVELS)+' are permitted!')
+        validate_devices(settings.get('_OP_MODE', 0), settings.get('_DEVICES', []), groups)
+        for index, bus in enumerate(settings.get('_BUSES', [])):
+            if (not isinstance(bus, dict) or 'op_mode' not in bus or 'port' not in bus or 'devices' not in bus):
+                raise Exception('Bus '+str(index)+': The keys op_mode, port and devices are required!')
+            validate_devices(bus['op_mode'], bus['devices'], bus.get('groups', groups))
+    except:
+        raise Exception('Invalid configuration file '+path+': '+str(sys.exc_info()[1]))
+
+    return settings
+
+# Get the IPv4 address of the network interface with the given name (empty
+# string, if the interface doesn't exist or has no address yet)
+def interface_address(name):
+    '''Get the IPv4 address of the network interface with the given name'''
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        request = struct.pack('256s', name[:15].encode('ascii'))
+        return socket.inet_ntoa(fcntl.ioctl(probe.fileno(), _SIOCGIFADDR, request)[20:24])
+    except (OSError, IOError):
+        return ''
+    finally:
+        probe.close()
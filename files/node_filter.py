@@ -0,0 +1,115 @@
+# node_filter.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Report-by-exception filtering of the values read by
+# mqtt_node_client.py.
+#
+# Most registers of energy meters change slowly, so most of the values read are
+# identical (or almost identical) to the value reported last. The deadband
+# filter only lets a value pass, if it differs from the value reported last by
+# more than the deadband of the point (given absolutely and/or as percentage of
+# the value reported last), if it isn't numeric and differs from the value
+# reported last at all, or if no value of the point has been reported for the
+# maximum silence interval (heartbeat, so the server can tell a constant value
+# from a dead node).
+
+import time
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Deadband_Filter(object):
+    '''
+    Report-by-exception filter letting only values pass, that have left the
+    deadband around the value reported last or are due for a heartbeat.
+    '''
+
+    # Initialization method; set the default rules of the filter
+    def __init__(self, **kwargs):
+        '''
+        Initialization method; set the default rules of the filter
+
+        Permitted transfer parameters:
+        - deadband          (default: 0; absolute deviation from the value
+                            reported last up to which values are suppressed)
+        - deadband_percent  (default: 0; deviation in percent of the value
+                            reported last up to which values are suppressed)
+        - max_silence       (default: 0; maximum time-interval (in s) without a
+                            value of a point being reported; 0 - no heartbeat)
+        '''
+        # Evaluate the transfer parameters
+        self._deadband = kwargs.get('deadband', 0)
+        self._deadband_percent = kwargs.get('deadband_percent', 0)
+        self._max_silence = kwargs.get('max_silence', 0)
+
+        # Value and (monotonic) time reported last per point
+        self._last = {}
+
+        # Statistics
+        self.reported = 0
+        self.suppressed = 0
+
+    # Replace the default rules of the filter (the values reported last are
+    # kept)
+    def rules(self, **kwargs):
+        '''
+        Replace the default rules of the filter
+
+        Permitted transfer parameters: cf. __init__(...)
+        '''
+        self._deadband = kwargs.get('deadband', 0)
+        self._deadband_percent = kwargs.get('deadband_percent', 0)
+        self._max_silence = kwargs.get('max_silence', 0)
+
+    # Check, if the given value of the given point has to be reported
+    def check(self, point, value, **kwargs):
+        '''
+        Check, if the given value of the given point has to be reported; return
+        True if so, False if the value is suppressed
+
+        Permitted transfer parameters (overriding the default rules):
+        - deadband
+        - deadband_percent
+        - max_silence
+        '''
+        # Evaluate the transfer parameters
+        deadband = kwargs.get('deadband', self._deadband)
+        deadband_percent = kwargs.get('deadband_percent', self._deadband_percent)
+        max_silence = kwargs.get('max_silence', self._max_silence)
+
+        now = time.monotonic()
+        last = self._last.get(point)
+
+        if (last == None):
+            report = True
+        elif (max_silence and now-last[1] >= max_silence):
+            report = True
+        else:
+            try:
+                threshold = max(deadband, abs(last[0])*deadband_percent/100.0)
+                report = abs(value-last[0]) > threshold
+            except TypeError:
+                # Non-numeric values (e.g. error messages) are only suppressed,
+                # if they are repeated
+                report = value != last[0]
+
+        if (report):
+            self._last[point] = (value, now)
+            self.reported+=1
+        else:
+            self.suppressed+=1
+
+        return report
+
+    # Forget the value reported last of the given point resp. of all points,
+    # so the next value is reported in any case
+    def reset(self, point=None):
+        '''Forget the value reported last of the given point resp. of all points'''
+        if (point == None):
+            self._last = {}
+        else:
+            self._last.pop(point, None)
@@ -0,0 +1,136 @@
+# node_health.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Tracking of the responsiveness of the bus devices read out by
+# mqtt_node_client.py.
+#
+# For every device, the response times of the last requests are recorded to
+# derive an adaptive timeout (a percentile of the response times plus a
+# margin), so a device that doesn't answer doesn't block the bus for the full
+# worst-case timeout. Devices, that didn't answer several requests in a row,
+# are considered offline and are only probed with an exponentially growing
+# interval until they answer again. The transitions between online and offline
+# are reported once instead of on every failed request.
+
+import collections
+import time
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# States of a device
+ONLINE='online'
+OFFLINE='offline'
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Device_Health(object):
+    '''
+    Responsiveness of one bus device: adaptive timeout derived from the
+    response times observed and exponential backoff while it's offline.
+    '''
+
+    # Initialization method; set the timeout and backoff policy
+    def __init__(self, **kwargs):
+        '''
+        Initialization method; set the timeout and backoff policy
+
+        Permitted transfer parameters:
+        - timeout       (default: 3; maximum timeout (in s), used until enough
+                        response times have been observed and for the probes
+                        of offline devices)
+        - min_timeout   (default: 0.2; minimum timeout (in s))
+        - adaptive      (default: 1; if not set, timeout is used for every
+                        request)
+        - percentile    (default: 95; percentile of the response times the
+                        adaptive timeout is based on)
+        - factor        (default: 1.5; factor the percentile is multiplied with)
+        - margin        (default: 0.1; margin (in s) added to the percentile)
+        - samples       (default: 50; number of response times recorded)
+        - offline_after (default: 3; number of failed requests in a row after
+                        which the device is considered offline)
+        - backoff       (default: 5; interval (in s) of the first probe of an
+                        offline device; doubled after every failed probe)
+        - max_backoff   (default: 3600; maximum interval (in s) between two
+                        probes)
+        '''
+        # Evaluate the transfer parameters
+        self._max_timeout = kwargs.get('timeout', 3)
+        self._min_timeout = kwargs.get('min_timeout', 0.2)
+        self._adaptive = kwargs.get('adaptive', 1)
+        self._percentile = kwargs.get('percentile', 95)
+        self._factor = kwargs.get('factor', 1.5)
+        self._margin = kwargs.get('margin', 0.1)
+        self._offline_after = kwargs.get('offline_after', 3)
+        self._backoff = kwargs.get('backoff', 5)
+        self._max_backoff = kwargs.get('max_backoff', 3600)
+
+        self._latencies = collections.deque(maxlen=kwargs.get('samples', 50))
+        self._timeout = self._max_timeout
+        self._next_probe = 0.0
+
+        # State (None until the first request has been evaluated) and
+        # statistics
+        self.state = None
+        self.failures = 0
+        self.requests = 0
+        self.timeouts = 0
+
+    # Check, if the device has to be requested now (always, unless it's offline
+    # and the next probe isn't due yet)
+    def due(self):
+        '''Check, if the device has to be requested now'''
+        return (self.state != OFFLINE or time.monotonic() >= self._next_probe)
+
+    # Get the timeout to use for the next request
+    def timeout(self):
+        '''Get the timeout to use for the next request'''
+        # Requests following a failed one (e.g. the device answered slower
+        # than usual) resp. probes of offline devices use the maximum timeout
+        if (self.failures or self.state == OFFLINE):
+            return self._max_timeout
+        return self._timeout
+
+    # Record a successfull request with the given response time (in s); return
+    # the new state, if the device came online
+    def success(self, latency):
+        '''Record a successfull request with the given response time'''
+        self.requests+=1
+        self.failures = 0
+        self._latencies.append(latency)
+
+        # Derive the adaptive timeout from the response times observed
+        if (self._adaptive and len(self._latencies) >= min(5, self._latencies.maxlen)):
+            ordered = sorted(self._latencies)
+            percentile = ordered[min(len(ordered)-1, int(len(ordered)*self._percentile/100.0))]
+            self._timeout = min(self._max_timeout, max(self._min_timeout, percentile*self._factor+self._margin))
+
+        if (self.state != ONLINE):
+            self.state = ONLINE
+            return ONLINE
+        return None
+
+    # Record a failed request; return the new state, if the device went offline
+    def failure(self):
+        '''Record a failed request'''
+        self.requests+=1
+        self.timeouts+=1
+        self.failures+=1
+
+        if (self.failures < self._offline_after):
+            return None
+
+        # Probe the device again after an exponentially growing interval
+        delay = min(self._max_backoff, self._backoff*2**min(self.failures-self._offline_after, 32))
+        self._next_probe = time.monotonic()+delay
+
+        if (self.state != OFFLINE):
+            self.state = OFFLINE
+            return OFFLINE
+        return None
@@ -0,0 +1,117 @@
+# node_hotplug.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Detection of serial ports appearing and disappearing for
+# mqtt_node_client.py.
+#
+# USB-RS485 resp. USB-M-Bus adapters can disappear at any time (loose
+# connectors, resets of the adapter, ...). Instead of restarting the whole node
+# (and with it the TLS session and the MQTT client), the directories the ports
+# reside in (e.g. /dev or /dev/serial/by-id) are watched via inotify, so the
+# node can stop polling a bus as soon as its port is removed and reopen it as
+# soon as it is added again, while the values read from the other buses are
+# still published resp. queued. If inotify isn't available, the node falls back
+# to checking the existence of the ports on every readout procedure.
+
+import ctypes.util
+import ctypes
+import struct
+import select
+import errno
+import os
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# inotify events (cf. inotify(7))
+_IN_ATTRIB=0x00000004
+_IN_MOVED_FROM=0x00000040
+_IN_MOVED_TO=0x00000080
+_IN_CREATE=0x00000100
+_IN_DELETE=0x00000200
+_IN_NONBLOCK=0x00000800
+_IN_CLOEXEC=0x00080000
+
+# Header of an inotify event (watch descriptor, mask, cookie, length of the
+# name)
+_EVENT=struct.Struct('iIII')
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Port_Watcher(object):
+    '''
+    Watcher reporting the creation and removal of the given ports via inotify.
+    '''
+
+    # Initialization method; watch the directories of the given ports
+    def __init__(self, ports):
+        '''Initialization method; watch the directories of the given ports'''
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if (self._fd < 0):
+            raise OSError(ctypes.get_errno(), 'inotify_init1: '+os.strerror(ctypes.get_errno()))
+
+        # Directories watched per watch descriptor
+        self._directories = {}
+        self._ports = set(ports)
+        for directory in sorted(set(os.path.dirname(port) for port in ports)):
+            watch = libc.inotify_add_watch(self._fd, directory.encode(), _IN_CREATE | _IN_DELETE | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO)
+            if (watch < 0):
+                os.close(self._fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch '+directory+': '+os.strerror(ctypes.get_errno()))
+            self._directories[watch] = directory
+
+    # Get the file descriptor to wait for events on (e.g. via select or an
+    # asyncio event loop)
+    def fileno(self):
+        '''Get the file descriptor to wait for events on'''
+        return self._fd
+
+    # Read the pending events without blocking; return a list of tuples (port,
+    # True if the port exists resp. False if it has been removed)
+    def events(self):
+        '''Read the pending events without blocking'''
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as error:
+            if (error.errno == errno.EAGAIN):
+                return []
+            raise
+
+        changed = []
+        offset = 0
+        while (offset+_EVENT.size <= len(data)):
+            watch, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset+_EVENT.size:offset+_EVENT.size+length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset+=_EVENT.size+length
+
+            port = os.path.join(self._directories.get(watch, ''), name)
+            if (port in self._ports and port not in changed):
+                changed.append(port)
+
+        # Report the current state of every port changed (the udev rules may
+        # create and rename the nodes in several steps)
+        return [(port, os.path.exists(port)) for port in changed]
+
+    # Block until events are pending or the given timeout (in s; None - no
+    # timeout) has passed; return the events (cf. events())
+    def wait(self, timeout=None):
+        '''Block until events are pending or the given timeout has passed'''
+        readable = select.select([self._fd], [], [], timeout)[0]
+        if (not readable):
+            return []
+        return self.events()
+
+    # Stop watching the ports
+    def close(self):
+        '''Stop watching the ports'''
+        if (self._fd >= 0):
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,203 @@
+# node_metrics.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: In-process metrics of mqtt_node_client.py.
+#
+# The registry holds counters, gauges and histograms, each of them optionally
+# split by labels (e.g. the port and the address of a bus device), and renders
+# them in the Prometheus text exposition format (version 0.0.4). Values, that
+# are already counted elsewhere (e.g. the overruns of the scheduler or the depth
+# of the outbound queue), are collected by callbacks right before rendering
+# instead of being duplicated. The metrics can be scraped from a small HTTP
+# endpoint served by a separate thread (http://<host>:<port>/metrics) and/or be
+# published periodically by the node itself.
+
+import http.server
+import threading
+import math
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Default buckets of the histograms (upper bounds in s)
+BUCKETS=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Content type of the text exposition format
+CONTENT_TYPE='text/plain; version=0.0.4; charset=utf-8'
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Format the given number as sample value
+def _format_value(value):
+    '''Format the given number as sample value'''
+    if (value == math.inf):
+        return '+Inf'
+    if (value == -math.inf):
+        return '-Inf'
+    if (isinstance(value, float) and value == int(value) and abs(value) < 1e15):
+        return str(int(value))
+    return repr(value)
+
+# Format the given labels (tuple of tuples (name, value)) as label set
+def _format_labels(labels):
+    '''Format the given labels as label set'''
+    if (not labels):
+        return ''
+    return '{'+','.join(name+'="'+str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')+'"' for name, value in labels)+'}'
+
+class Metrics_Registry(object):
+    '''
+    Registry of counters, gauges and histograms rendered in the Prometheus text
+    exposition format.
+    '''
+
+    # Initialization method; initialize the metrics and collectors
+    def __init__(self):
+        '''Initialization method; initialize the metrics and collectors'''
+        # Type, help text, buckets and samples (per label set) of every metric
+        # in order of definition
+        self._metrics = {}
+        self._order = []
+
+        # Callbacks updating metrics right before rendering
+        self._collectors = []
+
+        self._lock = threading.Lock()
+
+    # Define a metric of the given type (counter, gauge or histogram) with the
+    # given name and help text
+    def define(self, name, kind, help_text, **kwargs):
+        '''
+        Define a metric of the given type (counter, gauge or histogram) with the
+        given name and help text
+
+        Permitted transfer parameters:
+        - buckets   (default: BUCKETS; upper bounds of the buckets of a
+                    histogram)
+        '''
+        if (kind not in ('counter', 'gauge', 'histogram')):
+            raise Exception('Invalid metric type!')
+
+        with self._lock:
+            if (name not in self._metrics):
+                self._order.append(name)
+            self._metrics[name] = {'kind': kind, 'help': help_text, 'buckets': tuple(sorted(kwargs.get('buckets', BUCKETS))), 'samples': {}}
+
+    # Register the given callback, that is called (with the registry as transfer
+    # parameter) right before the metrics are rendered
+    def collector(self, callback):
+        '''Register the given callback, that is called right before the metrics are rendered'''
+        self._collectors.append(callback)
+
+    # Get the samples of the metric with the given name
+    def _samples(self, name):
+        '''Get the samples of the metric with the given name'''
+        if (name not in self._metrics):
+            raise Exception('Undefined metric '+name+'!')
+        return self._metrics[name]['samples']
+
+    # Increase the counter with the given name and labels by amount
+    def inc(self, name, amount=1, **labels):
+        '''Increase the counter with the given name and labels by amount'''
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._samples(name)
+            samples[key] = samples.get(key, 0)+amount
+
+    # Set the gauge (resp. the counter counted elsewhere) with the given name
+    # and labels to value
+    def set(self, name, value, **labels):
+        '''Set the gauge with the given name and labels to value'''
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._samples(name)[key] = value
+
+    # Record the given observation in the histogram with the given name and
+    # labels
+    def observe(self, name, value, **labels):
+        '''Record the given observation in the histogram with the given name and labels'''
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._samples(name)
+            buckets = self._metrics[name]['buckets']
+            if (key not in samples):
+                samples[key] = {'buckets': [0]*len(buckets), 'sum': 0.0, 'count': 0}
+            histogram = samples[key]
+            for index, bound in enumerate(buckets):
+                if (value <= bound):
+                    histogram['buckets'][index]+=1
+            histogram['sum']+=value
+            histogram['count']+=1
+
+    # Render all metrics in the Prometheus text exposition format
+    def render(self):
+        '''Render all metrics in the Prometheus text exposition format'''
+        for callback in self._collectors:
+            callback(self)
+
+        lines = []
+        with self._lock:
+            for name in self._order:
+                metric = self._metrics[name]
+                lines.append('# HELP '+name+' '+metric['help'].replace('\\', '\\\\').replace('\n', '\\n'))
+                lines.append('# TYPE '+name+' '+metric['kind'])
+
+                for key, sample in sorted(metric['samples'].items()):
+                    if (metric['kind'] != 'histogram'):
+                        lines.append(name+_format_labels(key)+' '+_format_value(sample))
+                        continue
+
+                    # The buckets of the histogram are cumulative
+                    for bound, count in zip(metric['buckets']+(math.inf,), sample['buckets']+[sample['count']]):
+                        lines.append(name+'_bucket'+_format_labels(key+(('le', _format_value(float(bound))),))+' '+str(count))
+                    lines.append(name+'_sum'+_format_labels(key)+' '+_format_value(sample['sum']))
+                    lines.append(name+'_count'+_format_labels(key)+' '+str(sample['count']))
+
+        return '\n'.join(lines)+'\n'
+
+class _Metrics_Handler(http.server.BaseHTTPRequestHandler):
+    '''
+    Request handler serving the metrics of the registry of the server.
+    '''
+
+    # Serve the metrics on GET requests
+    def do_GET(self):
+        '''Serve the metrics on GET requests'''
+        if (self.path.split('?')[0] not in ('/', '/metrics')):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Don't write the requests to stderr
+    def log_message(self, format, *args):
+        '''Don't write the requests to stderr'''
+        pass
+
+class Metrics_Server(http.server.ThreadingHTTPServer):
+    '''
+    HTTP endpoint serving the metrics of a registry in a separate thread.
+    '''
+
+    daemon_threads = True
+
+    # Initialization method; bind the endpoint to the given host and port and
+    # start serving the metrics of the given registry
+    def __init__(self, registry, host, port):
+        '''Initialization method; bind the endpoint to the given host and port and start serving the metrics of the given registry'''
+        self.registry = registry
+        http.server.ThreadingHTTPServer.__init__(self, (host, port), _Metrics_Handler)
+
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
@@ -0,0 +1,221 @@
+# node_modbus_server.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Modbus TCP server exposing the values read by
+# mqtt_node_client.py.
+#
+# The serial bus can only be driven by one master, so other clients on site
+# (e.g. a SCADA system or a commissioning laptop) can't read the devices while
+# the node is polling them. Instead, the node keeps an image of the registers
+# (resp. coils and discrete inputs) it has read last and serves it over Modbus
+# TCP from a separate thread: every device of a bus appears as a unit of the
+# server with its own address and register map, so the clients read it just
+# like the device itself (function codes 01-04), but without any additional
+# load on the bus. Registers, that aren't read by the node, are answered with
+# the exception illegal data address; units, that the node hasn't read yet
+# (resp. whose registers are outdated), with the exception gateway target
+# device failed to respond. The image is read-only; write requests are
+# answered with the exception illegal function.
+
+import socketserver
+import threading
+import struct
+import time
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Names of the tables of the function codes served; maximum number of registers
+# resp. bits, that can be read with one request
+TABLES={
+    1:  ('coils', 2000),
+    2:  ('discrete_inputs', 2000),
+    3:  ('holding_registers', 125),
+    4:  ('input_registers', 125),
+}
+
+# Exception codes
+_ILLEGAL_FUNCTION=0x01
+_ILLEGAL_DATA_ADDRESS=0x02
+_ILLEGAL_DATA_VALUE=0x03
+_GATEWAY_TARGET_FAILED=0x0B
+
+# MBAP header (transaction id, protocol id, length, unit id)
+_HEADER=struct.Struct('>HHHB')
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Register_Image(object):
+    '''
+    Image of the registers (resp. coils and discrete inputs) of every unit read
+    last, together with the time they were read at.
+    '''
+
+    # Initialization method; set the maximum age of the values served
+    def __init__(self, **kwargs):
+        '''
+        Initialization method; set the maximum age of the values served
+
+        Permitted transfer parameters:
+        - max_age   (default: 0; maximum age (in s) of the values served; older
+                    values are answered with an exception; 0 - no limit)
+        '''
+        # Evaluate the transfer parameters
+        self._max_age = kwargs.get('max_age', 0)
+
+        # Tables of every unit (dictionaries of the address of every register
+        # to a tuple (value, time read at))
+        self._units = {}
+        self._lock = threading.Lock()
+
+        # Statistics
+        self.requests = 0
+        self.exceptions = 0
+
+    # Store the given values (registers resp. bits) of the given unit read with
+    # the given function code starting at the given address
+    def update(self, unit, function, address, values):
+        '''Store the given values of the given unit read with the given function code'''
+        now = time.monotonic()
+        with self._lock:
+            tables = self._units.get(unit)
+            if (tables == None):
+                tables = self._units[unit] = dict((code, {}) for code in TABLES)
+            table = tables[function]
+            for offset, value in enumerate(values):
+                table[address+offset] = (value, now)
+
+    # Read the given number of values of the given unit with the given function
+    # code starting at the given address; return the values resp. the exception
+    # code, if they can't be served
+    def read(self, unit, function, address, count):
+        '''Read the given number of values of the given unit with the given function code'''
+        with self._lock:
+            tables = self._units.get(unit)
+            if (tables == None):
+                return _GATEWAY_TARGET_FAILED
+            table = tables[function]
+
+            entries = []
+            for register in range(address, address+count):
+                entry = table.get(register)
+                if (entry == None):
+                    return _ILLEGAL_DATA_ADDRESS
+                entries.append(entry)
+
+        if (self._max_age and time.monotonic()-min(entry[1] for entry in entries) > self._max_age):
+            return _GATEWAY_TARGET_FAILED
+        return [entry[0] for entry in entries]
+
+    # Handle the given request PDU (function code and data) addressed to the
+    # given unit; return the response PDU
+    def handle(self, unit, pdu):
+        '''Handle the given request PDU addressed to the given unit'''
+        # The requests of every client connection are handled by a separate
+        # thread
+        with self._lock:
+            self.requests+=1
+        function = pdu[0]
+        if (function not in TABLES):
+            return self._exception(function, _ILLEGAL_FUNCTION)
+        if (len(pdu) != 5):
+            return self._exception(function, _ILLEGAL_DATA_VALUE)
+
+        address, count = struct.unpack('>HH', pdu[1:5])
+        limit = TABLES[function][1]
+        if (count < 1 or count > limit or address+count > 0x10000):
+            return self._exception(function, _ILLEGAL_DATA_VALUE)
+
+        values = self.read(unit, function, address, count)
+        if (isinstance(values, int)):
+            return self._exception(function, values)
+
+        if (limit == 2000):
+            # Pack the bits LSB first
+            data = bytearray((count+7)//8)
+            for index, value in enumerate(values):
+                if (value):
+                    data[index//8]|=1 << (index%8)
+        else:
+            data = struct.pack('>'+str(count)+'H', *values)
+        return bytes((function, len(data)))+bytes(data)
+
+    # Build the exception response of the given function code
+    def _exception(self, function, code):
+        '''Build the exception response of the given function code'''
+        with self._lock:
+            self.exceptions+=1
+        return bytes(((function | 0x80) & 0xFF, code))
+
+class _Modbus_Handler(socketserver.BaseRequestHandler):
+    '''
+    Request handler serving the register image of the server to one client
+    connection.
+    '''
+
+    # Answer the requests of the client until it closes the connection
+    def handle(self):
+        '''Answer the requests of the client until it closes the connection'''
+        self.request.settimeout(self.server.idle_timeout)
+        while (True):
+            header = self._receive(_HEADER.size)
+            if (header == None):
+                return
+            transaction, protocol, length, unit = _HEADER.unpack(header)
+
+            # Only Modbus (protocol id 0) requests with a PDU are valid
+            if (protocol != 0 or length < 2 or length > 254):
+                return
+            pdu = self._receive(length-1)
+            if (pdu == None):
+                return
+
+            response = self.server.image.handle(unit, pdu)
+            self.request.sendall(_HEADER.pack(transaction, 0, len(response)+1, unit)+response)
+
+    # Receive exactly the given number of bytes; return None, if the connection
+    # has been closed resp. timed out
+    def _receive(self, size):
+        '''Receive exactly the given number of bytes'''
+        data = b''
+        try:
+            while (len(data) < size):
+                chunk = self.request.recv(size-len(data))
+                if (not chunk):
+                    return None
+                data+=chunk
+        except OSError:
+            return None
+        return data
+
+class Modbus_Server(socketserver.ThreadingTCPServer):
+    '''
+    Modbus TCP server serving a register image in a separate thread.
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Initialization method; bind the server to the given host and port and
+    # start serving the given register image
+    def __init__(self, image, host, port, **kwargs):
+        '''
+        Initialization method; bind the server to the given host and port and
+        start serving the given register image
+
+        Permitted transfer parameters:
+        - timeout   (default: 60; time (in s) idle connections are closed
+                    after)
+        '''
+        self.image = image
+        self.idle_timeout = kwargs.get('timeout', 60)
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _Modbus_Handler)
+
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
@@ -0,0 +1,300 @@
+# node_scheduler.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Scheduling of the readout procedures of mqtt_node_client.py.
+#
+# The deadline scheduler fires on absolute ticks of the monotonic clock instead
+# of sleeping for a fixed period after every readout procedure, so the duration
+# of the readout itself (bus timeouts, logging, publishing, ...) doesn't add up
+# to the actual period. Optionally, the ticks are aligned to the boundaries of
+# the wall clock (e.g. to every full 5 seconds), so the values of different
+# nodes are sampled at the same instant. Ticks, that are due while the previous
+# readout procedure is still running, are reported as overruns resp. skipped
+# instead of silently stretching the period.
+#
+# The poll budget accounts for the time the single requests occupy the bus and
+# derives the utilisation of the bus. If the requests of one readout procedure
+# don't fit into the share of the interval reserved for them, the requests of
+# low-priority devices are only sent on every 2nd, 4th, ... tick, so the
+# critical devices are still read out on every tick.
+#
+# The rate scheduler allows every request to be polled with its own period
+# (e.g. the active power every second, the energy counters every 15 minutes and
+# the nameplate data once per day). On every tick, the requests, whose period
+# has elapsed, are sent earliest deadline first, with the requests of a higher
+# priority always preceding the ones of a lower priority. The next request is
+# selected anew after every request, so a high-rate request released while a
+# bulk of slow requests is being read out is sent before the rest of them.
+
+import math
+import time
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Deadline_Scheduler(object):
+    '''
+    Scheduler firing on absolute, drift-free ticks of the monotonic clock,
+    optionally aligned to the boundaries of the wall clock.
+    '''
+
+    # Initialization method; set the interval and schedule the first tick
+    def __init__(self, interval, **kwargs):
+        '''
+        Initialization method; set the interval and schedule the first tick
+
+        Permitted transfer parameters:
+        - align     (default: 0; if set, the ticks are aligned to multiples of
+                    interval of the wall clock)
+        - tolerance (default: 0.1; lateness (in s) of a tick up to which it
+                    isn't reported as overrun)
+        '''
+        # Evaluate the transfer parameters
+        self._align = kwargs.get('align', 0)
+        self._tolerance = kwargs.get('tolerance', 0.1)
+
+        if (interval <= 0):
+            raise Exception('Invalid interval!')
+        self._interval = interval
+
+        # Statistics
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.lateness = 0.0
+
+        # Wall clock time of the current tick
+        self.tick_time = None
+
+        # Schedule the first tick either immediately or on the next boundary of
+        # the wall clock
+        self._next = time.monotonic()
+        if (self._align):
+            self._next+=-time.time()%self._interval
+
+    # Get the time (in s) left until the next tick is due
+    def delay(self):
+        '''Get the time (in s) left until the next tick is due'''
+        return max(0.0, self._next-time.monotonic())
+
+    # Mark the current tick as fired and schedule the next one; return the number
+    # of ticks skipped because they were already due when this tick fired
+    def fire(self):
+        '''Mark the current tick as fired and schedule the next one'''
+        now = time.monotonic()
+        scheduled = self._next
+
+        self.ticks+=1
+        self.lateness = max(0.0, now-scheduled)
+        self.tick_time = time.time()-(now-scheduled)
+
+        # Skip all ticks, that have already passed, so the schedule stays in
+        # phase instead of firing in quick succession to catch up
+        skipped = int(math.floor(self.lateness/self._interval))
+        self._next = scheduled+(skipped+1)*self._interval
+
+        if (self.lateness > self._tolerance):
+            self.overruns+=1
+        self.skipped+=skipped
+
+        return skipped
+
+    # Block until the next tick is due and fire it; return the number of ticks
+    # skipped
+    def wait(self):
+        '''Block until the next tick is due and fire it'''
+        delay = self.delay()
+        if (delay > 0):
+            time.sleep(delay)
+        return self.fire()
+
+class Poll_Budget(object):
+    '''
+    Accounting of the time the requests of a readout procedure occupy the bus
+    and stretching of the polling intervals of low-priority requests, if the
+    bus is oversubscribed.
+    '''
+
+    # Initialization method; set the interval and the share of it available to
+    # the requests
+    def __init__(self, interval, **kwargs):
+        '''
+        Initialization method; set the interval and the share of it available
+        to the requests
+
+        Permitted transfer parameters:
+        - budget        (default: 0.8; share of the interval available to the
+                        requests; 0 disables the stretching)
+        - max_stretch   (default: 64; maximum factor the polling interval of a
+                        priority is stretched by)
+        - smoothing     (default: 0.2; weight of the latest duration of a request
+                        in its moving average)
+        '''
+        # Evaluate the transfer parameters
+        self._budget = kwargs.get('budget', 0.8)
+        self._max_stretch = kwargs.get('max_stretch', 64)
+        self._smoothing = kwargs.get('smoothing', 0.2)
+
+        self._interval = interval
+
+        # Moving average of the duration (in s), priority, period, phase and
+        # number of releases of every request
+        self._costs = {}
+        self._priorities = {}
+        self._periods = {}
+        self._phases = {}
+        self._releases = {}
+
+        self._busy = 0.0
+
+        # Factor the polling interval of every priority is stretched by
+        self.stretch = {}
+
+        # Statistics: share of the interval the bus was occupied during the
+        # last readout procedure resp. would be occupied without stretching
+        self.utilisation = 0.0
+        self.demand = 0.0
+
+    # Start a new readout procedure; update the statistics and the stretching
+    # of the priorities; return True, if the stretching changed
+    def tick(self):
+        '''Start a new readout procedure; update the statistics and the stretching of the priorities'''
+        self.utilisation = self._busy/self._interval
+        self._busy = 0.0
+
+        # Sum up the durations of the requests per priority (normalized to the
+        # interval, if they are polled with another period)
+        costs = {}
+        for item, cost in self._costs.items():
+            priority = self._priorities[item]
+            costs[priority] = costs.get(priority, 0.0)+cost*self._interval/self._periods.get(item, self._interval)
+        self.demand = sum(costs.values())/self._interval
+
+        # Stretch the intervals of the lowest priorities until the requests fit
+        # into the budget; critical requests (priority 0) are never stretched
+        stretch = dict((priority, 1) for priority in costs)
+        if (self._budget):
+            available = self._budget*self._interval
+            for priority in sorted(costs, reverse=True):
+                if (priority <= 0):
+                    break
+                while (sum(cost/stretch[level] for level, cost in costs.items()) > available and stretch[priority] < self._max_stretch):
+                    stretch[priority]*=2
+
+        changed = (dict((priority, factor) for priority, factor in stretch.items() if factor > 1) != dict((priority, factor) for priority, factor in self.stretch.items() if factor > 1))
+        self.stretch = stretch
+        return changed
+
+    # Check, if the given request of the given priority is due in the current
+    # readout procedure resp. on its current release (if it's polled with its
+    # own period)
+    def due(self, item, priority):
+        '''Check, if the given request of the given priority is due in the current readout procedure'''
+        if (item not in self._phases):
+            # Spread the stretched requests evenly over the ticks
+            self._phases[item] = len(self._phases)
+            self._priorities[item] = priority
+            self._releases[item] = 0
+        self._releases[item]+=1
+        return ((self._releases[item]+self._phases[item]) % self.stretch.get(priority, 1) == 0)
+
+    # Record the given duration (in s) the given request of the given priority
+    # occupied the bus
+    def record(self, item, priority, duration, **kwargs):
+        '''
+        Record the given duration the given request of the given priority
+        occupied the bus
+
+        Permitted transfer parameters:
+        - period    (default: interval; period the request is polled with)
+        '''
+        self._busy+=duration
+        self._priorities[item] = priority
+        self._periods[item] = kwargs.get('period', self._interval)
+        if (item in self._costs):
+            self._costs[item]+=self._smoothing*(duration-self._costs[item])
+        else:
+            self._costs[item] = duration
+
+class Rate_Scheduler(object):
+    '''
+    Earliest deadline first scheduler of requests polled with individual
+    periods and priorities.
+    '''
+
+    # Initialization method; set the alignment of the releases
+    def __init__(self, **kwargs):
+        '''
+        Initialization method; set the alignment of the releases
+
+        Permitted transfer parameters:
+        - align     (default: 0; if set, the releases of every request are
+                    aligned to multiples of its period of the wall clock)
+        - tolerance (default: 0.01; time (in s) a request is considered due
+                    ahead of its release, so it isn't missed by a tick firing
+                    marginally earlier)
+        '''
+        # Evaluate the transfer parameters
+        self._align = kwargs.get('align', 0)
+        self._tolerance = kwargs.get('tolerance', 0.01)
+
+        # Release (monotonic time), period, priority and position of every
+        # request
+        self._items = {}
+
+        # Statistics: number of requests sent after their deadline (the end of
+        # their period) had passed
+        self.missed = 0
+
+    # Add the given request to poll every period seconds with the given priority
+    # (0 - highest)
+    def add(self, item, period, priority=1):
+        '''Add the given request to poll every period seconds with the given priority'''
+        if (period <= 0):
+            raise Exception('Invalid period!')
+
+        # Release the request either immediately or on the next boundary of
+        # the wall clock
+        release = time.monotonic()
+        if (self._align):
+            release+=-time.time()%period
+        self._items[item] = [release, period, priority, len(self._items)]
+
+    # Get the period the given request is polled with
+    def period(self, item):
+        '''Get the period the given request is polled with'''
+        return self._items[item][1]
+
+    # Get the request due of the highest priority and the earliest deadline,
+    # that isn't contained in exclude (None, if there's none)
+    def next(self, exclude=()):
+        '''Get the request due of the highest priority and the earliest deadline'''
+        now = time.monotonic()+self._tolerance
+        selected = None
+        selected_key = None
+        for item, (release, period, priority, position) in self._items.items():
+            if (release > now or item in exclude):
+                continue
+            key = (priority, release+period, position)
+            if (selected_key == None or key < selected_key):
+                selected = item
+                selected_key = key
+        return selected
+
+    # Mark the given request as sent and schedule its next release
+    def done(self, item):
+        '''Mark the given request as sent and schedule its next release'''
+        entry = self._items[item]
+        now = time.monotonic()
+        if (now > entry[0]+entry[1]):
+            self.missed+=1
+
+        # Skip all releases, that have already passed, so the request stays in
+        # phase instead of being sent in quick succession to catch up
+        entry[0]+=entry[1]
+        if (entry[0] <= now):
+            entry[0]+=(math.floor((now-entry[0])/entry[1])+1)*entry[1]
@@ -0,0 +1,537 @@
+# node_storage.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Local storage of the values read out by mqtt_node_client.py.
+#
+# The ring buffer store keeps the history of the values in a fixed-size binary
+# file, that is memory-mapped and contains records of the format (timestamp,
+# point id, value). Once the file is full, the oldest records are overwritten,
+# so the disk usage is predictable and there is no need to trim the file
+# periodically. Appending a record is O(1). The number of records written is
+# kept in two alternately written header slots protected by a checksum. It is
+# only advanced by flush(), after the records appended since the last flush have
+# been written to the storage device, so the header never points at records,
+# that haven't reached the storage device, and the store stays consistent even
+# if the program (or the system) crashes; the records appended since the last
+# flush are lost in this case.
+#
+# The outbound queue stores the messages to be published on disk until their
+# reception has been acknowledged by the broker, so no message is lost if the
+# connection to the broker is interrupted and the program is restarted in the
+# meantime. The messages are appended to segment files; the position of the
+# oldest unacknowledged message is persisted in a separate cursor file, so the
+# queue is replayed from there after a restart.
+
+import collections
+import threading
+import atexit
+import struct
+import mmap
+import zlib
+import os
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Identification of the file format
+_MAGIC=b'RBS1'
+
+# Header slot: magic, record size, capacity (in records), sequence number of the
+# slot, number of records written in total, checksum
+_HEADER=struct.Struct('<4sIIQQI')
+
+# Size reserved for each of the two header slots
+_HEADER_SLOT_SIZE=64
+
+# Record: timestamp (s since the epoch), point id, value
+_RECORD=struct.Struct('<dId')
+
+# Header of the messages stored in the segment files of the outbound queue:
+# length of the message, checksum of the message, length of the topic
+_MESSAGE=struct.Struct('<IIH')
+
+# Suffix of the segment files of the outbound queue
+_SEGMENT_SUFFIX='.seg'
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Get the id of the point with the given name (e.g. the topic suffix of a device
+# table entry) as stored in the ring buffer
+def point_id(name):
+    '''Get the id of the point with the given name as stored in the ring buffer'''
+    return zlib.crc32(str(name).encode('utf-8')) & 0xffffffff
+
+class Ring_Buffer_Store(object):
+    '''
+    Fixed-size, memory-mapped ring buffer of (timestamp, point id, value)
+    records, whose head pointer is only advanced once the records have been
+    written to the storage device (cf. flush()).
+    '''
+
+    # Initialization method; open resp. create the file and map it into memory
+    def __init__(self, path, capacity):
+        '''
+        Initialization method; open resp. create the file and map it into memory
+
+        If the file doesn't exist yet, is corrupted or was created with a
+        different capacity, it is (re-)initialized and all records contained are
+        discarded.
+        '''
+        if (capacity < 1):
+            raise Exception('Invalid capacity!')
+
+        self.path = path
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._size = 2*_HEADER_SLOT_SIZE+capacity*_RECORD.size
+
+        # Open resp. create the file and make sure it has the size needed
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            initialize = (os.fstat(fd).st_size != self._size)
+            if (initialize):
+                os.ftruncate(fd, self._size)
+            self._mmap = mmap.mmap(fd, self._size)
+        finally:
+            os.close(fd)
+
+        # Restore the state from the most recent valid header slot
+        self._sequence = 0
+        self.written = 0
+        state = None if initialize else self._read_header()
+        if (state == None):
+            self._write_header()
+            self._write_header()
+            self._mmap.flush(0, min(mmap.PAGESIZE, self._size))
+        else:
+            self._sequence, self.written = state
+
+        # Number of records written to the storage device and recorded in the
+        # header
+        self._committed = self.written
+
+        # Records appended after the last flush before a crash may have
+        # overwritten the oldest records recorded in the header; these slots
+        # (newer than the newest record recorded) are skipped until they are
+        # overwritten again
+        self._skipped = 0
+        count = min(self.written, self.capacity)
+        if (count):
+            newest = self._slot(self.written-1)[0]
+            while (self._skipped < count-1 and self._slot(self.written-count+self._skipped)[0] > newest):
+                self._skipped+=1
+
+        atexit.register(self.close)
+
+    # Read both header slots and return the state (sequence number, number of
+    # records written) of the most recent valid one or None, if there is none
+    def _read_header(self):
+        '''Read both header slots and return the state of the most recent valid one'''
+        state = None
+        for slot in range(2):
+            offset = slot*_HEADER_SLOT_SIZE
+            magic, record_size, capacity, sequence, written, checksum = _HEADER.unpack_from(self._mmap, offset)
+            if (magic != _MAGIC or record_size != _RECORD.size or capacity != self.capacity):
+                continue
+            if (zlib.crc32(self._mmap[offset:offset+_HEADER.size-4]) & 0xffffffff != checksum):
+                continue
+            if (state == None or sequence > state[0]):
+                state = (sequence, written)
+        return state
+
+    # Write the given number of records written (default: the current one) to
+    # the header slot, that doesn't contain the most recent state, so a torn
+    # write never destroys the last valid state
+    def _write_header(self, written=None):
+        '''Write the given number of records written to the older header slot'''
+        self._sequence+=1
+        offset = (self._sequence%2)*_HEADER_SLOT_SIZE
+        header = _HEADER.pack(_MAGIC, _RECORD.size, self.capacity, self._sequence, self.written if written == None else written, 0)
+        checksum = zlib.crc32(header[:-4]) & 0xffffffff
+        self._mmap[offset:offset+_HEADER.size] = header[:-4]+struct.pack('<I', checksum)
+
+    # Get the number of records currently stored
+    def __len__(self):
+        '''Get the number of records currently stored'''
+        return min(self.written, self.capacity)-self._skipped
+
+    # Get the record with the given number (counting all records written)
+    def _slot(self, number):
+        '''Get the record with the given number'''
+        return _RECORD.unpack_from(self._mmap, 2*_HEADER_SLOT_SIZE+(number%self.capacity)*_RECORD.size)
+
+    # Append a record, overwriting the oldest one if the ring buffer is full
+    def append(self, timestamp, point, value):
+        '''Append a record, overwriting the oldest one if the ring buffer is full'''
+        with self._lock:
+            if (self._mmap == None):
+                raise Exception('Ring buffer already closed!')
+
+            # The head pointer in the header is only advanced by flush()
+            _RECORD.pack_into(self._mmap, 2*_HEADER_SLOT_SIZE+(self.written%self.capacity)*_RECORD.size, timestamp, point, value)
+            self.written+=1
+            if (self._skipped and self.written > self.capacity):
+                self._skipped-=1
+
+    # Get the record with the given index (0 being the oldest record stored; the
+    # lock has to be held by the caller)
+    def _record(self, idx):
+        '''Get the record with the given index (0 being the oldest record stored)'''
+        position = (self.written-len(self)+idx)%self.capacity
+        return _RECORD.unpack_from(self._mmap, 2*_HEADER_SLOT_SIZE+position*_RECORD.size)
+
+    # Iterate over the records stored in the given time range in chronological
+    # order
+    def read(self, **kwargs):
+        '''
+        Iterate over the records (timestamp, point id, value) stored in the
+        given time range in chronological order
+
+        The start of the range is located via binary search, which requires the
+        records to have been appended in chronological order.
+
+        Permitted transfer parameters:
+        - start (default: None; timestamp of the oldest record to return)
+        - end   (default: None; timestamp of the newest record to return)
+        - point (default: None; only return records of this point id)
+        '''
+        # Evaluate the transfer parameters
+        start = kwargs.get('start', None)
+        end = kwargs.get('end', None)
+        point = kwargs.get('point', None)
+
+        with self._lock:
+            if (self._mmap == None):
+                raise Exception('Ring buffer already closed!')
+
+            # Take a snapshot of the records stored, so the iteration isn't
+            # affected by records appended in the meantime (except for the
+            # oldest ones being overwritten if the ring buffer wraps around)
+            written = self.written
+            count = len(self)
+
+            # Locate the first record of the time range
+            low = 0
+            if (start != None):
+                high = count
+                while (low < high):
+                    middle = (low+high)//2
+                    if (self._record(middle)[0] < start):
+                        low = middle+1
+                    else:
+                        high = middle
+
+        for idx in range(low, count):
+            with self._lock:
+                if (self._mmap == None):
+                    return
+                record = _RECORD.unpack_from(self._mmap, 2*_HEADER_SLOT_SIZE+((written-count+idx)%self.capacity)*_RECORD.size)
+
+            if (end != None and record[0] > end):
+                return
+            if (point == None or record[1] == point):
+                yield record
+
+    # Write the records appended since the last flush to the storage device and
+    # only then advance the head pointer in the header and write the header
+    # (records appended in the meantime are part of the next flush)
+    def flush(self):
+        '''Write the records appended since the last flush and then the header to the storage device'''
+        with self._flush_lock:
+            with self._lock:
+                if (self._mmap == None):
+                    return
+                written = self.written
+            if (written == self._committed):
+                return
+
+            for offset, size in self._record_ranges(self._committed, written):
+                aligned = offset-offset%mmap.PAGESIZE
+                self._mmap.flush(aligned, size+offset-aligned)
+
+            self._write_header(written)
+            self._mmap.flush(0, min(mmap.PAGESIZE, self._size))
+            self._committed = written
+
+    # Get the ranges (offset, size) of the file containing the records with the
+    # given numbers (from start up to end, exclusively)
+    def _record_ranges(self, start, end):
+        '''Get the ranges of the file containing the records with the given numbers'''
+        if (end-start >= self.capacity):
+            return [(2*_HEADER_SLOT_SIZE, self.capacity*_RECORD.size)]
+
+        first = start%self.capacity
+        last = end%self.capacity
+        if (first < last):
+            return [(2*_HEADER_SLOT_SIZE+first*_RECORD.size, (last-first)*_RECORD.size)]
+        ranges = [(2*_HEADER_SLOT_SIZE+first*_RECORD.size, (self.capacity-first)*_RECORD.size)]
+        if (last):
+            ranges.append((2*_HEADER_SLOT_SIZE, last*_RECORD.size))
+        return ranges
+
+    # Write the records and the header to the storage device (cf. flush()) and
+    # unmap the file
+    def close(self):
+        '''Write the records and the header to the storage device and unmap the file'''
+        self.flush()
+        with self._flush_lock:
+            with self._lock:
+                if (self._mmap != None):
+                    self._mmap.close()
+                    self._mmap = None
+
+class Outbound_Queue(object):
+    '''
+    Persistent, segmented FIFO queue of (topic, payload) messages to be
+    published, whose read position only advances once the messages have been
+    acknowledged.
+    '''
+
+    # Initialization method; open resp. create the queue directory and restore
+    # the position of the oldest unacknowledged message
+    def __init__(self, directory, **kwargs):
+        '''
+        Initialization method; open resp. create the queue directory and restore
+        the position of the oldest unacknowledged message
+
+        Permitted transfer parameters:
+        - segment_size      (default: 1048576; size (in bytes) after which a
+                            new segment file is started)
+        - max_bytes         (default: 67108864; maximum size (in bytes) of all
+                            segment files; if exceeded, the oldest segment is
+                            dropped)
+        - commit_interval   (default: 20; number of acknowledged messages after
+                            which the cursor file is updated; after a restart,
+                            at most this many messages are published twice)
+        - fsync             (default: 0; if set, force every message to be
+                            written to the storage device)
+        '''
+        # Evaluate the transfer parameters
+        self._segment_size = kwargs.get('segment_size', 1048576)
+        self._max_bytes = kwargs.get('max_bytes', 67108864)
+        self._commit_interval = kwargs.get('commit_interval', 20)
+        self._fsync = kwargs.get('fsync', 0)
+
+        self.directory = directory
+        self._cursor_path = os.path.join(directory, 'cursor')
+
+        self._lock = threading.Lock()
+
+        # Statistics: number of segments dropped, that contained messages not
+        # yet acknowledged
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Find the existing segment files
+        self._segments = sorted(int(name[:-len(_SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(_SEGMENT_SUFFIX))
+        if (not self._segments):
+            self._segments.append(0)
+
+        # Restore the position (segment, offset) of the oldest unacknowledged
+        # message
+        self._ack = (self._segments[0], 0)
+        try:
+            with open(self._cursor_path, 'r') as cursor:
+                position = tuple(int(value) for value in cursor.read().split())
+            if (len(position) == 2 and position[0] >= self._segments[0]):
+                self._ack = position
+        except (FileNotFoundError, ValueError):
+            pass
+        self._acked = 0
+
+        # Open the newest segment for appending and cut off a message, that
+        # might have been written only partially before a crash
+        self._write_file = open(self._segment_path(self._segments[-1]), 'ab')
+        self._write_file.truncate(self._valid_size(self._segments[-1]))
+        self._write_file.seek(0, os.SEEK_END)
+
+        # Messages handed out by get() and not yet acknowledged (in order)
+        self._send = self._ack
+        self._read_file = None
+        self._read_segment = None
+        self._pending = collections.deque()
+
+        # Count the messages not yet acknowledged
+        self._depth = self._count(self._ack)
+
+        atexit.register(self.close)
+
+    # Get the path of the segment file with the given number
+    def _segment_path(self, segment):
+        '''Get the path of the segment file with the given number'''
+        return os.path.join(self.directory, '%012d' % segment+_SEGMENT_SUFFIX)
+
+    # Read the message at the given position of the given (open) file; return
+    # (topic, payload, size) or None, if there is no complete, valid message
+    def _read_message(self, segment_file, offset):
+        '''Read the message at the given position of the given file'''
+        segment_file.seek(offset)
+        header = segment_file.read(_MESSAGE.size)
+        if (len(header) < _MESSAGE.size):
+            return None
+
+        length, checksum, topic_length = _MESSAGE.unpack(header)
+        message = segment_file.read(length)
+        if (len(message) < length or zlib.crc32(message) & 0xffffffff != checksum or topic_length > length):
+            return None
+
+        return (message[:topic_length].decode('utf-8'), message[topic_length:], _MESSAGE.size+length)
+
+    # Get the size of the valid part of the given segment file
+    def _valid_size(self, segment):
+        '''Get the size of the valid part of the given segment file'''
+        offset = 0
+        with open(self._segment_path(segment), 'rb') as segment_file:
+            while (True):
+                message = self._read_message(segment_file, offset)
+                if (message == None):
+                    return offset
+                offset+=message[2]
+
+    # Count the messages stored from the given position on
+    def _count(self, position):
+        '''Count the messages stored from the given position on'''
+        count = 0
+        for segment in self._segments:
+            if (segment < position[0]):
+                continue
+            offset = position[1] if segment == position[0] else 0
+            with open(self._segment_path(segment), 'rb') as segment_file:
+                while (True):
+                    message = self._read_message(segment_file, offset)
+                    if (message == None):
+                        break
+                    offset+=message[2]
+                    count+=1
+        return count
+
+    # Persist the position of the oldest unacknowledged message and delete the
+    # segment files, that have been acknowledged completely (the lock has to be
+    # held by the caller)
+    def _commit(self):
+        '''Persist the position of the oldest unacknowledged message'''
+        with open(self._cursor_path+'.temp', 'w') as cursor:
+            cursor.write(str(self._ack[0])+' '+str(self._ack[1])+'\n')
+            cursor.flush()
+            if (self._fsync):
+                os.fsync(cursor.fileno())
+        os.rename(self._cursor_path+'.temp', self._cursor_path)
+
+        while (len(self._segments) > 1 and self._segments[0] < self._ack[0]):
+            os.remove(self._segment_path(self._segments.pop(0)))
+
+        self._acked = 0
+
+    # Get the number of messages not yet acknowledged
+    def depth(self):
+        '''Get the number of messages not yet acknowledged'''
+        with self._lock:
+            return self._depth
+
+    # Append a message to the queue
+    def put(self, topic, payload):
+        '''Append a message to the queue'''
+        if (not isinstance(payload, bytes)):
+            payload = str(payload).encode('utf-8')
+        topic = topic.encode('utf-8')
+        message = topic+payload
+
+        with self._lock:
+            if (self._write_file == None):
+                raise Exception('Queue already closed!')
+
+            self._write_file.write(_MESSAGE.pack(len(message), zlib.crc32(message) & 0xffffffff, len(topic))+message)
+            self._write_file.flush()
+            if (self._fsync):
+                os.fsync(self._write_file.fileno())
+            self._depth+=1
+
+            # Start a new segment, if the current one is full
+            if (self._write_file.tell() >= self._segment_size):
+                self._write_file.close()
+                self._segments.append(self._segments[-1]+1)
+                self._write_file = open(self._segment_path(self._segments[-1]), 'ab')
+
+                # Drop the oldest segments, if the queue exceeds its maximum
+                # size (the messages contained are lost)
+                while (len(self._segments) > 2 and len(self._segments)*self._segment_size > self._max_bytes):
+                    segment = self._segments.pop(0)
+                    os.remove(self._segment_path(segment))
+                    if (self._ack[0] <= segment):
+                        self.dropped+=1
+                        self._ack = (self._segments[0], 0)
+                        self._send = max(self._send, self._ack)
+                        self._depth = self._count(self._ack)
+                        self._commit()
+
+    # Get the next message, that hasn't been handed out yet; return a tuple
+    # (token, topic, payload) or None, if the queue is empty (the token has to
+    # be passed to ack() once the message has been acknowledged)
+    def get(self):
+        '''Get the next message, that hasn't been handed out yet'''
+        with self._lock:
+            if (self._write_file == None):
+                raise Exception('Queue already closed!')
+
+            while (True):
+                segment, offset = self._send
+                if (self._read_segment != segment):
+                    if (self._read_file != None):
+                        self._read_file.close()
+                    self._read_file = open(self._segment_path(segment), 'rb')
+                    self._read_segment = segment
+
+                message = self._read_message(self._read_file, offset)
+                if (message != None):
+                    break
+
+                # Continue with the next segment, if the current one has been
+                # read completely
+                if (segment == self._segments[-1]):
+                    return None
+                self._send = (self._segments[self._segments.index(segment)+1] if segment in self._segments else self._segments[0], 0)
+
+            self._send = (segment, offset+message[2])
+            token = [self._send, False]
+            self._pending.append(token)
+
+            return (token, message[0], message[1])
+
+    # Mark the message with the given token as acknowledged and advance the
+    # position of the oldest unacknowledged message as far as possible
+    def ack(self, token):
+        '''Mark the message with the given token as acknowledged'''
+        with self._lock:
+            token[1] = True
+
+            while (self._pending and self._pending[0][1]):
+                position = self._pending.popleft()[0]
+                if (position > self._ack):
+                    self._ack = position
+                    self._depth-=1
+                    self._acked+=1
+
+            if (self._acked >= self._commit_interval and self._write_file != None):
+                self._commit()
+
+    # Persist the position of the oldest unacknowledged message and close the
+    # segment files
+    def close(self):
+        '''Persist the position of the oldest unacknowledged message and close the segment files'''
+        with self._lock:
+            if (self._write_file != None):
+                self._commit()
+                self._write_file.close()
+                self._write_file = None
+                if (self._read_file != None):
+                    self._read_file.close()
+                    self._read_file = None
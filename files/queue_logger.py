@@ -0,0 +1,261 @@
+# queue_logger.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Asynchronous logger of mqtt_node_client.py and
+# mqtt_server_client.py.
+#
+# Log messages are only queued by the threads logging them (e.g. the bus
+# workers or the network thread of the MQTT client); a separate writer thread
+# formats them and appends them to the log file (cf. buffered_writer.py), so
+# neither formatting nor file I/O delays the bus requests or the network
+# traffic. Messages below the configured severity level are discarded right
+# away. Repetitive messages (e.g. one per value read or per message published)
+# can be rate-limited per source; the number of messages suppressed is
+# appended to the next message of the source let through. If the writer thread
+# falls behind (e.g. the storage device stalls), further messages are dropped
+# instead of blocking the caller.
+
+import buffered_writer
+import collections
+import threading
+import atexit
+import time
+import sys
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Severity levels
+DEBUG=10
+INFO=20
+WARNING=30
+ERROR=40
+
+# Names of the severity levels (e.g. in the configuration)
+LEVELS={
+    'debug':    DEBUG,
+    'info':     INFO,
+    'warning':  WARNING,
+    'error':    ERROR,
+}
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+class Queue_Logger(object):
+    '''
+    Logger queueing the messages and writing them to the log file in a
+    separate thread, with severity levels and rate limits per source.
+    '''
+
+    # Initialization method; open the log file and start the writer thread
+    def __init__(self, path, **kwargs):
+        '''
+        Initialization method; open the log file and start the writer thread
+
+        Permitted transfer parameters:
+        - level         (default: INFO; messages of a lower severity are
+                        discarded)
+        - rate_limits   (default: {}; maximum number of messages per second
+                        of the given sources (e.g. {'_on_publish_cb': 1});
+                        further messages of the same source and level are
+                        suppressed)
+        - stamp         (default: seconds since the creation of the logger;
+                        function formatting the time (in s since the epoch) a
+                        message was logged at as prefix of the message)
+        - max_pending   (default: 10000; maximum number of messages queued;
+                        further messages are dropped)
+        - flush_bytes, flush_records, flush_interval, fsync
+                        (flush policy of the log file; cf. buffered_writer.py)
+        '''
+        # Evaluate the transfer parameters
+        self._level = kwargs.get('level', INFO)
+        self._rate_limits = dict(kwargs.get('rate_limits', {}))
+        self._stamp = kwargs.get('stamp', None)
+        self._max_pending = kwargs.get('max_pending', 10000)
+        self._flush_interval = kwargs.get('flush_interval', 30)
+
+        self._writer = buffered_writer.Buffered_Writer(path, flush_bytes=kwargs.get('flush_bytes', 4096), flush_records=kwargs.get('flush_records', 50), flush_interval=self._flush_interval, fsync=kwargs.get('fsync', 0), flush_thread=0)
+        self._created = time.time()
+
+        # Messages queued (tuples (time, level, source, parts) resp. events to
+        # set once the messages queued before have been written)
+        self._pending = collections.deque()
+        self._wake = threading.Event()
+        self._closed = False
+
+        # State of the rate limits per source and level (tokens left, time of
+        # the last message and number of messages suppressed since the last
+        # message let through)
+        self._limits = {}
+
+        # Statistics
+        self.dropped = 0
+        self.suppressed = 0
+        self._dropped_reported = 0
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+        # Make sure, that the queued messages aren't lost on exit
+        atexit.register(self.close)
+
+    # Check, if messages of the given level are logged
+    def enabled(self, level):
+        '''Check, if messages of the given level are logged'''
+        return level >= self._level
+
+    # Set the severity level (messages of a lower severity are discarded)
+    def set_level(self, level):
+        '''Set the severity level'''
+        self._level = level
+
+    # Set the rate limits per source (cf. __init__(...))
+    def set_rate_limits(self, rate_limits):
+        '''Set the rate limits per source'''
+        self._rate_limits = dict(rate_limits)
+
+    # Queue the message of the given level from the given source (e.g. the
+    # name of the function logging it); the parts of the message are converted
+    # to strings and concatenated by the writer thread, so they mustn't be
+    # modified afterwards
+    def log(self, level, source, *parts):
+        '''Queue the message of the given level from the given source'''
+        if (level < self._level):
+            return
+        self._queue((time.time(), level, source, parts))
+
+    # Queue a message of the level DEBUG (cf. log(...))
+    def debug(self, source, *parts):
+        '''Queue a message of the level DEBUG'''
+        if (DEBUG >= self._level):
+            self._queue((time.time(), DEBUG, source, parts))
+
+    # Queue a message of the level INFO (cf. log(...))
+    def info(self, source, *parts):
+        '''Queue a message of the level INFO'''
+        if (INFO >= self._level):
+            self._queue((time.time(), INFO, source, parts))
+
+    # Queue a message of the level WARNING (cf. log(...))
+    def warning(self, source, *parts):
+        '''Queue a message of the level WARNING'''
+        if (WARNING >= self._level):
+            self._queue((time.time(), WARNING, source, parts))
+
+    # Queue a message of the level ERROR (cf. log(...))
+    def error(self, source, *parts):
+        '''Queue a message of the level ERROR'''
+        if (ERROR >= self._level):
+            self._queue((time.time(), ERROR, source, parts))
+
+    # Append the given item to the queue and wake the writer thread
+    def _queue(self, item):
+        '''Append the given item to the queue and wake the writer thread'''
+        if (len(self._pending) >= self._max_pending):
+            self.dropped+=1
+            return
+        self._pending.append(item)
+
+        # Always wake the writer thread (checking, if the queue was empty,
+        # races with other threads logging at the same time)
+        self._wake.set()
+
+    # Check the rate limit of the given source and level for a message logged at
+    # the given time; return None, if the message is suppressed, otherwise the
+    # number of messages suppressed before
+    def _admit(self, source, level, timestamp):
+        '''Check the rate limit of the given source and level'''
+        rate = self._rate_limits.get(source)
+        if (not rate):
+            return 0
+
+        limit = self._limits.get((source, level))
+        if (limit == None):
+            limit = self._limits[(source, level)] = [max(rate, 1.0), timestamp, 0]
+
+        # Refill the tokens according to the time passed (up to a burst of one
+        # second)
+        limit[0] = min(max(rate, 1.0), limit[0]+(timestamp-limit[1])*rate)
+        limit[1] = timestamp
+        if (limit[0] < 1.0):
+            limit[2]+=1
+            self.suppressed+=1
+            return None
+
+        limit[0]-=1.0
+        suppressed = limit[2]
+        limit[2] = 0
+        return suppressed
+
+    # Format the given message
+    def _format(self, timestamp, level, source, parts):
+        '''Format the given message'''
+        suppressed = self._admit(source, level, timestamp)
+        if (suppressed == None):
+            return None
+
+        stamp = self._stamp(timestamp) if self._stamp != None else str(int(timestamp-self._created))
+        entry = stamp+' '+source+': '+''.join([part if isinstance(part, str) else str(part) for part in parts])
+        if (suppressed):
+            entry+=' ('+str(suppressed)+' similar message(s) suppressed)'
+        return entry+'\n'
+
+    # Write the queued messages to the log file until the logger is closed
+    def _write_loop(self):
+        '''Write the queued messages to the log file until the logger is closed'''
+        while (True):
+            self._wake.wait(self._flush_interval or None)
+            self._wake.clear()
+
+            while (self._pending):
+                item = self._pending.popleft()
+                if (isinstance(item, threading.Event)):
+                    self._writer.flush()
+                    item.set()
+                    continue
+
+                try:
+                    entry = self._format(*item)
+                    if (entry != None):
+                        self._writer.write(entry)
+                except:
+                    # Never let a faulty message stop the writer thread
+                    sys.stderr.write('Queue_Logger: Error: '+str(sys.exc_info()[1])+'\n')
+
+            # Note the messages dropped since the last time in the log file
+            dropped = self.dropped
+            if (dropped != self._dropped_reported):
+                self._writer.write(self._format(time.time(), ERROR, 'Queue_Logger', ('Error: ', dropped-self._dropped_reported, ' message(s) dropped; the log file can\'t keep up!')))
+                self._dropped_reported = dropped
+
+            if (self._closed):
+                return
+            self._writer.flush_if_due()
+
+    # Write the messages queued so far and flush the log file; wait no longer
+    # than the given timeout (in s)
+    def flush(self, timeout=5):
+        '''Write the messages queued so far and flush the log file'''
+        if (not self._thread.is_alive()):
+            return
+        done = threading.Event()
+        self._pending.append(done)
+        self._wake.set()
+        done.wait(timeout)
+
+    # Write the messages queued so far and close the log file
+    def close(self):
+        '''Write the messages queued so far and close the log file'''
+        if (self._closed):
+            return
+        self.flush()
+        self._closed = True
+        self._wake.set()
+        self._thread.join(5)
+        self._writer.close()
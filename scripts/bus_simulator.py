@@ -0,0 +1,541 @@
+#!/usr/bin/python3
+
+# bus_simulator.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Simulation of the Modbus RTU slaves resp. M-Bus devices read out
+# by mqtt_node_client.py on virtual serial ports.
+#
+# Every simulated bus is a pseudo terminal; its slave side is linked to a
+# configurable path (e.g. /tmp/bus_simulator/ttySIM0), that the node opens like
+# the port of an USB-RS485 resp. USB-M-Bus adapter, while the simulator serves
+# the requests received on the master side. The time the frames occupy the wire
+# at the configured baud rate is emulated, so bus cycle times are comparable to
+# the ones of a real bus. The devices answer from register maps (Modbus RTU;
+# function codes 01-04) resp. data records (M-Bus; REQ_UD2, SND_NKE and the
+# selection of secondary addresses) and can be configured to answer late, not
+# at all or with corrupted frames. Counters (registers resp. records, that are
+# increased on every response) allow to trace every value published back to the
+# time it was read from the device (cf. node_benchmark.py).
+#
+# Usage: python3 bus_simulator.py [configuration file]
+#
+# The configuration file (JSON) defines the ports and their devices, e.g.
+#
+#   {
+#       "ports": [
+#           {"path": "/tmp/bus_simulator/ttySIM0", "protocol": "modbus", "baudrate": 9600, "devices": [
+#               {"address": 1, "holding_registers": {"50536": [0, 1000]}, "counters": {"50536": 1}, "delay": 0.01, "drop": 0.01}
+#           ]},
+#           {"path": "/tmp/bus_simulator/ttySIM1", "protocol": "mbus", "baudrate": 2400, "devices": [
+#               {"address": 5, "id": 12345678, "manufacturer": "KAM", "records": [{"vif": 6, "value": 1000, "step": 1}]}
+#           ]}
+#       ]
+#   }
+
+import threading
+import random
+import select
+import struct
+import json
+import time
+import tty
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files'))
+
+import mbus_scan
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Ports simulated, if no configuration file is given
+_PORTS=[
+    {'path': '/tmp/bus_simulator/ttySIM0', 'protocol': 'modbus', 'baudrate': 9600, 'devices': [
+        {'address': 1, 'holding_registers': {'50536': [0, 1000]}, 'counters': {'50536': 1}},
+    ]},
+]
+
+# Bits per character on the wire (start bit, 8 data bits, stop bit)
+_CHARACTER_BITS=10
+
+# Modbus exception codes
+_ILLEGAL_FUNCTION=0x01
+_ILLEGAL_DATA_ADDRESS=0x02
+_ILLEGAL_DATA_VALUE=0x03
+
+# Tables of the Modbus data model per read function code and the maximum number
+# of coils resp. registers per request
+_MODBUS_TABLES={
+    0x01: ('coils', 2000),
+    0x02: ('discrete_inputs', 2000),
+    0x03: ('holding_registers', 125),
+    0x04: ('input_registers', 125),
+}
+
+# M-Bus frames and control fields
+_MBUS_ACK=b'\xe5'
+_MBUS_SHORT_START=0x10
+_MBUS_LONG_START=0x68
+_MBUS_STOP=0x16
+_MBUS_SND_NKE=0x40
+_MBUS_REQ_UD2=(0x5B, 0x7B)
+_MBUS_SND_UD=(0x53, 0x73)
+_MBUS_RSP_UD=0x08
+_MBUS_CI_SELECT=0x52
+_MBUS_CI_RESPONSE=0x72
+_MBUS_BROADCAST=(254, 255)
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Table of the CRC-16 of Modbus RTU (polynomial 0xA001, reflected)
+def _crc_table():
+    '''Table of the CRC-16 of Modbus RTU'''
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+_CRC_TABLE=_crc_table()
+
+# Calculate the CRC-16 of the given Modbus RTU frame; return it in wire order
+# (low byte first)
+def modbus_crc(frame):
+    '''Calculate the CRC-16 of the given Modbus RTU frame'''
+    crc = 0xFFFF
+    for byte in frame:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return struct.pack('<H', crc)
+
+# Calculate the checksum of the given M-Bus frame data (control field up to the
+# last data byte)
+def mbus_checksum(data):
+    '''Calculate the checksum of the given M-Bus frame data'''
+    return sum(data) & 0xFF
+
+class Simulated_Device(object):
+    '''
+    Base of the simulated devices: address, response delay and error injection.
+    '''
+
+    # Initialization method; evaluate the common keys of the given device
+    # configuration
+    def __init__(self, config):
+        '''
+        Initialization method; evaluate the common keys of the given device
+        configuration
+
+        Permitted keys:
+        - address   (required; primary address)
+        - delay     (default: 0.005; time (in s) the device takes to answer)
+        - jitter    (default: 0; maximum random time (in s) added to delay)
+        - drop      (default: 0; probability of not answering a request)
+        - corrupt   (default: 0; probability of answering with a corrupted
+                    checksum)
+        '''
+        if ('address' not in config):
+            raise Exception('Missing address!')
+
+        self.address = config['address']
+        self.delay = config.get('delay', 0.005)
+        self.jitter = config.get('jitter', 0)
+        self.drop = config.get('drop', 0)
+        self.corrupt = config.get('corrupt', 0)
+
+        # Statistics
+        self.requests = 0
+        self.dropped = 0
+        self.corrupted = 0
+
+    # Get the time (in s) the device takes to answer the next request
+    def response_delay(self):
+        '''Get the time the device takes to answer the next request'''
+        return self.delay+random.uniform(0, self.jitter)
+
+    # Apply the error injection to the given response; return the response to
+    # send (None, if it's dropped)
+    def inject(self, response):
+        '''Apply the error injection to the given response'''
+        if (response == None):
+            return None
+        if (random.random() < self.drop):
+            self.dropped+=1
+            return None
+        if (random.random() < self.corrupt and len(response) > 1):
+            self.corrupted+=1
+            response = bytearray(response)
+            response[-2]^=0xFF
+            return bytes(response)
+        return response
+
+class Modbus_Slave(Simulated_Device):
+    '''
+    Simulated Modbus RTU slave answering the read function codes 01-04 from its
+    register maps.
+    '''
+
+    # Initialization method; build the register maps of the given device
+    # configuration
+    def __init__(self, config):
+        '''
+        Initialization method; build the register maps of the given device
+        configuration
+
+        Permitted keys (additionally to the ones of Simulated_Device):
+        - coils, discrete_inputs, holding_registers, input_registers
+                    (default: {}; maps of the start addresses (as strings) to
+                    lists of the values (bits resp. 16 bit registers) stored
+                    from there on)
+        - counters  (default: {}; maps of the addresses of 32 bit counters
+                    (two registers, high word first) of the holding and input
+                    registers to the amount they're increased by after every
+                    response covering them)
+        '''
+        Simulated_Device.__init__(self, config)
+
+        self.tables = {}
+        for name, limit in _MODBUS_TABLES.values():
+            table = {}
+            for start, values in config.get(name, {}).items():
+                for offset, value in enumerate(values):
+                    table[int(start)+offset] = value & (0x1 if limit == 2000 else 0xFFFF)
+            self.tables[name] = table
+
+        self.counters = dict((int(address), step) for address, step in config.get('counters', {}).items())
+
+        # Callback notified of every response (cf. set_listener(...))
+        self._listener = None
+
+    # Set the callback, that is notified of every response with the slave, the
+    # function code, the start address, the values read and the time the
+    # request was handled (i.e. the time the values were sampled)
+    def set_listener(self, listener):
+        '''Set the callback, that is notified of every response'''
+        self._listener = listener
+
+    # Handle the given request PDU (function code and data); return the response
+    # PDU
+    def handle(self, pdu):
+        '''Handle the given request PDU; return the response PDU'''
+        self.requests+=1
+        function = pdu[0]
+        if (function not in _MODBUS_TABLES):
+            return bytes((function | 0x80, _ILLEGAL_FUNCTION))
+        if (len(pdu) != 5):
+            return bytes((function | 0x80, _ILLEGAL_DATA_VALUE))
+
+        name, limit = _MODBUS_TABLES[function]
+        start, count = struct.unpack('>HH', pdu[1:5])
+        if (count < 1 or count > limit):
+            return bytes((function | 0x80, _ILLEGAL_DATA_VALUE))
+
+        table = self.tables[name]
+        if (any(address not in table for address in range(start, start+count))):
+            return bytes((function | 0x80, _ILLEGAL_DATA_ADDRESS))
+        values = [table[address] for address in range(start, start+count)]
+
+        if (limit == 2000):
+            # Pack the bits LSB first
+            data = bytearray((count+7)//8)
+            for index, value in enumerate(values):
+                data[index//8]|=value << (index%8)
+        else:
+            data = struct.pack('>'+str(count)+'H', *values)
+            self._count(table, start, count)
+
+        if (self._listener != None):
+            self._listener(self, function, start, values, time.time())
+        return bytes((function, len(data)))+bytes(data)
+
+    # Increase the counters covered by the given request
+    def _count(self, table, start, count):
+        '''Increase the counters covered by the given request'''
+        for address, step in self.counters.items():
+            if (start <= address and address+1 < start+count and address in table and address+1 in table):
+                value = ((table[address] << 16 | table[address+1])+step) & 0xFFFFFFFF
+                table[address] = value >> 16
+                table[address+1] = value & 0xFFFF
+
+class Mbus_Device(Simulated_Device):
+    '''
+    Simulated M-Bus device answering REQ_UD2 with a variable data structure and
+    taking part in the selection via secondary addresses.
+    '''
+
+    # Initialization method; build the identification and the records of the
+    # given device configuration
+    def __init__(self, config):
+        '''
+        Initialization method; build the identification and the records of the
+        given device configuration
+
+        Permitted keys (additionally to the ones of Simulated_Device):
+        - id            (default: 10000000+address; identification number (8
+                        decimal digits))
+        - manufacturer  (default: SIM; three letters)
+        - version       (default: 1)
+        - medium        (default: 2 (electricity))
+        - records       (default: []; data records, each given as object with
+                        the keys vif (value information field, e.g. 6 for
+                        energy in kWh), value (32 bit integer) and step
+                        (default: 0; amount the value is increased by after
+                        every response))
+        '''
+        Simulated_Device.__init__(self, config)
+
+        self.id = config.get('id', 10000000+self.address)
+        manufacturer = config.get('manufacturer', 'SIM').upper()
+        if (len(manufacturer) != 3 or not manufacturer.isalpha()):
+            raise Exception('Invalid manufacturer!')
+        self.manufacturer = struct.pack('<H', (ord(manufacturer[0])-64) << 10 | (ord(manufacturer[1])-64) << 5 | (ord(manufacturer[2])-64))
+        self.version = config.get('version', 1)
+        self.medium = config.get('medium', 2)
+        self.records = [dict(record) for record in config.get('records', [])]
+
+        self.selected = False
+        self._access = 0
+
+    # Get the secondary address of the device (16 hex digits, cf.
+    # mbus_frame_get_secondary_address(...) of libmbus)
+    def secondary(self):
+        '''Get the secondary address of the device'''
+        return '%08d' % self.id+self.manufacturer.hex().upper()+'%02X%02X' % (self.version, self.medium)
+
+    # Check, if the device is addressed by the given primary address
+    def addressed(self, address):
+        '''Check, if the device is addressed by the given primary address'''
+        return (address == self.address or (address == mbus_scan.ADDRESS_NETWORK_LAYER and self.selected))
+
+    # Handle a selection via the given secondary address mask (16 hex digits;
+    # wildcards F); return the acknowledgement, if the device is selected
+    def select(self, mask):
+        '''Handle a selection via the given secondary address mask'''
+        self.selected = mbus_scan.matches(mask, self.secondary())
+        return _MBUS_ACK if self.selected else None
+
+    # Handle SND_NKE; return the acknowledgement
+    def reset(self):
+        '''Handle SND_NKE; return the acknowledgement'''
+        self.requests+=1
+        return _MBUS_ACK
+
+    # Handle REQ_UD2; return the RSP_UD frame containing the records
+    def request(self):
+        '''Handle REQ_UD2; return the RSP_UD frame containing the records'''
+        self.requests+=1
+        self._access = (self._access+1) & 0xFF
+
+        # Fixed data header: identification number (BCD), manufacturer, version,
+        # medium, access number, status and signature
+        data = bytearray((_MBUS_RSP_UD, self.address, _MBUS_CI_RESPONSE))
+        data+=bytes.fromhex('%08d' % self.id)[::-1]
+        data+=self.manufacturer+bytes((self.version, self.medium, self._access, 0, 0, 0))
+
+        # Data records (32 bit integers)
+        for record in self.records:
+            data+=bytes((0x04, record['vif']))+struct.pack('<i', record['value'])
+            record['value']+=record.get('step', 0)
+
+        return bytes((_MBUS_LONG_START, len(data), len(data), _MBUS_LONG_START))+bytes(data)+bytes((mbus_checksum(data), _MBUS_STOP))
+
+class Virtual_Port(object):
+    '''
+    Pseudo terminal linked to the given path, on which the given devices are
+    served in a separate thread.
+    '''
+
+    # Initialization method; create the pseudo terminal and the devices of the
+    # given port configuration
+    def __init__(self, config):
+        '''
+        Initialization method; create the pseudo terminal and the devices of the
+        given port configuration
+
+        Permitted keys:
+        - path      (required; path the port is linked to)
+        - protocol  (default: modbus; modbus or mbus)
+        - baudrate  (default: 9600; baud rate emulated)
+        - devices   (default: []; configurations of the devices (cf.
+                    Modbus_Slave resp. Mbus_Device))
+        '''
+        self.path = config['path']
+        self.protocol = config.get('protocol', 'modbus')
+        if (self.protocol not in ('modbus', 'mbus')):
+            raise Exception('Invalid protocol '+self.protocol+'!')
+        baudrate = config.get('baudrate', 9600)
+        device_type = Modbus_Slave if self.protocol == 'modbus' else Mbus_Device
+        self.devices = [device_type(device) for device in config.get('devices', [])]
+
+        # Time (in s) one character occupies the wire; the end of a frame is
+        # detected by a silence of 3.5 characters (at least 1.75 ms, cf. the
+        # Modbus over serial line specification)
+        self._character = _CHARACTER_BITS/float(baudrate)
+        self._silence = max(3.5*self._character, 0.00175)
+
+        # Create the pseudo terminal; the slave side is kept open, so the
+        # master side doesn't report hang-ups while no client has the port
+        # opened
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        directory = os.path.dirname(self.path)
+        if (directory):
+            os.makedirs(directory, exist_ok=True)
+        if (os.path.lexists(self.path)):
+            os.unlink(self.path)
+        os.symlink(os.ttyname(self._slave), self.path)
+
+        # Statistics
+        self.frames = 0
+        self.invalid = 0
+
+        self._running = True
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    # Serve the requests received until the port is closed
+    def _serve(self):
+        '''Serve the requests received until the port is closed'''
+        frame = b''
+        while (self._running):
+            # Collect the bytes of a frame until the line is silent
+            try:
+                readable = select.select([self._master], [], [], self._silence if frame else 0.5)[0]
+                if (readable):
+                    frame+=os.read(self._master, 4096)
+                    continue
+            except (OSError, ValueError):
+                if (not self._running):
+                    return
+                time.sleep(0.1)
+                continue
+            if (not frame):
+                continue
+
+            self.frames+=1
+            received = time.monotonic()
+            try:
+                if (self.protocol == 'modbus'):
+                    delay, response = self._modbus_frame(frame)
+                else:
+                    delay, response = self._mbus_frame(frame)
+            except:
+                sys.stderr.write(self.path+': Error: '+str(sys.exc_info()[1])+'\n')
+                delay, response = 0, None
+            frame = b''
+
+            # Emulate the time the response takes to be processed by the device
+            # and to be transmitted
+            if (response != None):
+                remaining = received+delay+len(response)*self._character-time.monotonic()
+                if (remaining > 0):
+                    time.sleep(remaining)
+                try:
+                    os.write(self._master, response)
+                except OSError:
+                    pass
+
+    # Handle the given Modbus RTU request; return the response delay and frame
+    def _modbus_frame(self, frame):
+        '''Handle the given Modbus RTU request; return the response delay and frame'''
+        if (len(frame) < 4 or modbus_crc(frame[:-2]) != frame[-2:]):
+            self.invalid+=1
+            return 0, None
+
+        # Broadcasts (address 0) aren't answered
+        for device in self.devices:
+            if (device.address == frame[0]):
+                response = frame[:1]+device.handle(frame[1:-2])
+                return device.response_delay(), device.inject(response+modbus_crc(response))
+        return 0, None
+
+    # Handle the given M-Bus request; return the response delay and frame
+    # (several devices answering at once collide)
+    def _mbus_frame(self, frame):
+        '''Handle the given M-Bus request; return the response delay and frame'''
+        responses = []
+        if (len(frame) == 5 and frame[0] == _MBUS_SHORT_START and frame[4] == _MBUS_STOP and mbus_checksum(frame[1:3]) == frame[3]):
+            control, address = frame[1], frame[2]
+            for device in self.devices:
+                if (address in _MBUS_BROADCAST or not device.addressed(address)):
+                    continue
+                if (control == _MBUS_SND_NKE):
+                    responses.append((device, device.reset()))
+                    if (address == mbus_scan.ADDRESS_NETWORK_LAYER):
+                        device.selected = False
+                elif (control in _MBUS_REQ_UD2):
+                    responses.append((device, device.request()))
+        elif (len(frame) >= 9 and frame[0] == _MBUS_LONG_START and frame[3] == _MBUS_LONG_START and frame[1] == frame[2] == len(frame)-6 and frame[-1] == _MBUS_STOP and mbus_checksum(frame[4:-2]) == frame[-2]):
+            control, address, ci = frame[4], frame[5], frame[6]
+            if (control in _MBUS_SND_UD and address == mbus_scan.ADDRESS_NETWORK_LAYER and ci == _MBUS_CI_SELECT and len(frame) == 17):
+                # Secondary address mask: identification number (BCD, least
+                # significant byte first), manufacturer, version and medium
+                data = frame[7:15]
+                mask = data[3::-1].hex().upper()+data[4:].hex().upper()
+                for device in self.devices:
+                    acknowledgement = device.select(mask)
+                    if (acknowledgement != None):
+                        responses.append((device, acknowledgement))
+        else:
+            self.invalid+=1
+
+        responses = [(device, device.inject(response)) for device, response in responses]
+        responses = [(device, response) for device, response in responses if response != None]
+        if (not responses):
+            return 0, None
+        return max(device.response_delay() for device, response in responses), b''.join(response for device, response in responses)
+
+    # Stop serving the devices and remove the port
+    def close(self):
+        '''Stop serving the devices and remove the port'''
+        self._running = False
+        self.thread.join()
+        if (os.path.islink(self.path)):
+            os.unlink(self.path)
+        os.close(self._master)
+        os.close(self._slave)
+
+    # Get the statistics of the port and its devices
+    def statistics(self):
+        '''Get the statistics of the port and its devices'''
+        return {
+            'frames': self.frames,
+            'invalid': self.invalid,
+            'requests': sum(device.requests for device in self.devices),
+            'dropped': sum(device.dropped for device in self.devices),
+            'corrupted': sum(device.corrupted for device in self.devices),
+        }
+
+#------------------------------#
+######### Main program #########
+#------------------------------#
+
+if (__name__ == '__main__'):
+    ports = _PORTS
+    if (len(sys.argv) > 1):
+        with open(sys.argv[1], 'r') as config_file:
+            ports = json.load(config_file)['ports']
+
+    simulated = [Virtual_Port(port) for port in ports]
+    for port in simulated:
+        print(port.path+': '+port.protocol+', '+str(len(port.devices))+' devices')
+
+    try:
+        while (True):
+            time.sleep(60)
+            for port in simulated:
+                print(port.path+': '+', '.join(key+' '+str(value) for key, value in sorted(port.statistics().items())))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for port in simulated:
+            port.close()
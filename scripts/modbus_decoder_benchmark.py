@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+# modbus_decoder_benchmark.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: Micro-benchmark comparing the struct-based register decoding of
+# modbus_registers.py with the former decoding of mqtt_node_client.py, which
+# converted the registers to bit strings via bin(). Both variants decode the
+# same response of a Modbus RTU device containing several 32 bit values.
+#
+# Usage: python3 modbus_decoder_benchmark.py [number of values per response]
+
+import timeit
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files'))
+
+import modbus_registers
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Number of values (of two registers each) contained in the response
+_POINT_COUNT=int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+# Number of responses to decode per measurement
+_REPETITIONS=10000
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Former decoding of the registers of one value (cf. _modbus_rtu_loop of
+# mqtt_node_client.py before the introduction of modbus_registers.py)
+def legacy_decode(registers, register_count, signed, endianness, bit_significance):
+    '''Former decoding of the registers of one value'''
+    registers = list(registers)
+
+    if (not endianness):
+        registers = registers[::-1]
+        for idx in range(len(registers)):
+            registers[idx] = int(bin(registers[idx])[10:]+bin(registers[idx])[2:10], 2)
+
+    if (bit_significance):
+        for idx in range(len(registers)):
+            registers[idx] = int(bin(registers[idx])[:1:-1] ,2)
+
+    data = 0
+    for idx in range(len(registers)):
+        data+=registers[idx]<<((len(registers)-idx-1)*16)
+
+    if (signed):
+        if (bin(data)[2]):
+            data = -((data-1)^int('FFFF'*register_count, 16))
+
+    return data
+
+# Decode all values of the response with the former decoding
+def legacy_decode_response(registers):
+    '''Decode all values of the response with the former decoding'''
+    return [legacy_decode(registers[2*idx:2*idx+2], 2, 0, 1, 0) for idx in range(_POINT_COUNT)]
+
+#------------------------------#
+######### Main program #########
+#------------------------------#
+
+# Response containing values with all bits set in the high byte (the former
+# decoding only works correctly for registers without leading zero bits)
+registers = [0xff00+idx for idx in range(2*_POINT_COUNT)]
+
+# Compile the read plan for the values of the response
+points = [{'address': 1, 'register': 2*idx, 'type': 'uint32'} for idx in range(_POINT_COUNT)]
+block = modbus_registers.plan_reads(points)[0]
+
+# Make sure, that both variants produce the same result
+if ([value for point, value in block.decode(registers)] != legacy_decode_response(registers)):
+    sys.exit('Decoding results differ!')
+
+for name, statement in (('bin() decoding', lambda: legacy_decode_response(registers)), ('struct decoding', lambda: block.decode(registers))):
+    duration = min(timeit.repeat(statement, number=_REPETITIONS, repeat=5))
+    print(name+': '+str(round(duration/_REPETITIONS*1e6, 2))+' us per response of '+str(_POINT_COUNT)+' values')
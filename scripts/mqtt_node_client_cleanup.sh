@@ -11,6 +11,10 @@ DB_LINES=1728
 tail -n $LOG_LINES $LOG_PATH > $LOG_PATH.temp
 mv $LOG_PATH.temp $LOG_PATH
 
-# Delete all lines but the last DB_LINES from mqtt_node_client.db
-tail -n $DB_LINES $DB_PATH.temp > $DB_PATH.temp
-mv $DB_PATH.temp $DB_PATH
+# Delete all lines but the last DB_LINES from mqtt_node_client.db (only needed if the
+# CSV database is used instead of the fixed-size ring buffer, cf. _STORAGE_MODE
+# in mqtt_node_client.py)
+if [ -f $DB_PATH ]; then
+  tail -n $DB_LINES $DB_PATH > $DB_PATH.temp
+  mv $DB_PATH.temp $DB_PATH
+fi
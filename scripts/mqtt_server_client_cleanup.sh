@@ -13,7 +13,7 @@ tail -n $LOG_LINES $LOG_PATH > $LOG_PATH.temp
 mv $LOG_PATH.temp $LOG_PATH
 
 # Delete all lines but the last DB_LINES from mqtt_server_client.db
-tail -n $DB_LINES $DB_PATH.temp > $DB_PATH.temp
+tail -n $DB_LINES $DB_PATH > $DB_PATH.temp
 mv $DB_PATH.temp $DB_PATH
 
 # Clean up the data-exchange-directory (delete all files that weren't
@@ -0,0 +1,443 @@
+#!/usr/bin/python3
+
+# node_benchmark.py
+# Copyright 2017 Lukas Friedrichsen
+# License: Apache License Version 2.0
+#
+# 2026-10-18
+#
+# Description: End-to-end benchmark of mqtt_node_client.py against simulated
+# Modbus RTU slaves (cf. bus_simulator.py) and a local MQTT broker.
+#
+# The benchmark runs the unmodified node as a separate process with a generated
+# configuration file (passed via MQTT_NODE_CLIENT_CONFIG; no TLS, all files in a
+# temporary directory), that reads out the given number of simulated slaves on
+# one virtual serial port and publishes to a mosquitto instance started for the
+# benchmark (resp. the given broker). Every data point is a 32 bit counter, that
+# the simulated slave increases on every request, so every value received by
+# the subscriber of the benchmark can be traced back to the time it was read
+# from the bus. The benchmark reports
+# - the samples received per second (compared to the samples expected by the
+#   readout schedule),
+# - the bus cycle time (time between two consecutive reads of the same data
+#   point) and the utilisation of the bus reported by the node,
+# - the end-to-end latency from reading a value from the bus until it's
+#   received from the broker.
+# The results can be stored and compared against a baseline, so performance
+# regressions are caught before a rollout (the exit code is 1, if any result is
+# worse than the baseline by more than the tolerance).
+#
+# Usage: python3 node_benchmark.py [--devices 4] [--points 10] [--interval 1]
+#        [--duration 60] [--batch] [--set drain_rate=0] [--output results.json]
+#        [--baseline results.json] (cf. --help)
+
+import urllib.request
+import subprocess
+import argparse
+import tempfile
+import shutil
+import socket
+import signal
+import json
+import time
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files'))
+
+import paho.mqtt.client as mqtt
+import mqtt_payload
+import bus_simulator
+
+#------------------------------#
+########### Settings ###########
+#------------------------------#
+
+# Program under test
+_NODE=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files', 'mqtt_node_client.py')
+
+# Username of the node (the node publishes to emra/<username>)
+_USERNAME='benchmark'
+
+# First register of the data points of every slave
+_FIRST_REGISTER=1000
+
+# Time (in s) to wait for the broker resp. the node to start
+_START_TIMEOUT=10
+
+# Results compared against the baseline and whether higher values are better
+_COMPARED={
+    'samples_per_second': True,
+    'cycle_time_mean': False,
+    'latency_p95': False,
+}
+
+#------------------------------#
+######## Implementation ########
+#------------------------------#
+
+# Get a free TCP port on the loopback interface
+def free_port():
+    '''Get a free TCP port on the loopback interface'''
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+# Wait until the given TCP port accepts connections; return True, if it did
+# within the timeout
+def wait_for_port(host, port, timeout):
+    '''Wait until the given TCP port accepts connections'''
+    deadline = time.monotonic()+timeout
+    while (time.monotonic() < deadline):
+        try:
+            socket.create_connection((host, port), 0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+# Get the given percentile of the given sorted values
+def percentile(values, share):
+    '''Get the given percentile of the given sorted values'''
+    if (not values):
+        return None
+    return values[min(len(values)-1, int(len(values)*share/100.0))]
+
+# Sum up the samples of every metric (over all label sets) of the given text
+# exposition
+def parse_metrics(text):
+    '''Sum up the samples of every metric of the given text exposition'''
+    metrics = {}
+    for line in text.splitlines():
+        if (not line or line.startswith('#')):
+            continue
+        name, value = line.rsplit(' ', 1)
+        name = name.split('{')[0]
+        metrics[name] = metrics.get(name, 0.0)+float(value)
+    return metrics
+
+class Benchmark(object):
+    '''
+    One run of the node against simulated slaves and a local broker.
+    '''
+
+    # Initialization method; evaluate the given command line arguments
+    def __init__(self, args):
+        '''Initialization method; evaluate the given command line arguments'''
+        self.args = args
+        self.directory = tempfile.mkdtemp(prefix='node_benchmark_')
+        self.topic = 'emra/'+_USERNAME
+
+        # Times the values of every data point (topic relative to the topic of
+        # the node) were read from the bus by value
+        self._read = {}
+        # Times of the reads of the first data point of every slave
+        self._reads = {}
+        # End-to-end latencies and number of the samples received (only the
+        # samples read after the start of the measurement are counted)
+        self._latencies = []
+        self._received = 0
+        self._unknown = 0
+        self._measuring = False
+        self._started = 0.0
+
+        self._broker = None
+        self._node = None
+        self._port = None
+
+    # Name of the given data point of the given slave
+    def _name(self, address, point):
+        '''Name of the given data point of the given slave'''
+        return 'd'+str(address)+'/p'+str(point)
+
+    # Record the values read from the simulated slaves (cf.
+    # Modbus_Slave.set_listener(...))
+    def _on_read(self, slave, function, start, values, timestamp):
+        '''Record the values read from the simulated slaves'''
+        for point in range(self.args.points):
+            offset = _FIRST_REGISTER+2*point-start
+            if (offset < 0 or offset+1 >= len(values)):
+                continue
+            self._read.setdefault(self._name(slave.address, point), {})[values[offset] << 16 | values[offset+1]] = timestamp
+            if (point == 0 and self._measuring):
+                self._reads.setdefault(slave.address, []).append(timestamp)
+
+    # Record the values received from the broker
+    def _on_message(self, client, userdata, msg):
+        '''Record the values received from the broker'''
+        received = time.time()
+        if (msg.topic == self.topic+'/$batch'):
+            try:
+                values = [(name, value) for name, timestamp, value in mqtt_payload.decode_batch(msg.payload)]
+            except:
+                return
+        elif (msg.topic.startswith(self.topic+'/d')):
+            values = [(msg.topic[len(self.topic)+1:], msg.payload.decode('utf-8', 'replace'))]
+        else:
+            return
+
+        for name, value in values:
+            try:
+                read = self._read.get(name, {}).pop(int(float(value)), None)
+            except ValueError:
+                read = None
+            if (not self._measuring or (read != None and read < self._started)):
+                continue
+            if (read == None):
+                self._unknown+=1
+                continue
+            self._received+=1
+            self._latencies.append(received-read)
+
+    # Start the simulated slaves
+    def _start_simulator(self):
+        '''Start the simulated slaves'''
+        registers = []
+        for point in range(self.args.points):
+            registers+=[0, point]
+        devices = []
+        for address in range(1, self.args.devices+1):
+            devices.append({'address': address, 'holding_registers': {str(_FIRST_REGISTER): registers}, 'counters': dict((str(_FIRST_REGISTER+2*point), 1) for point in range(self.args.points)), 'delay': self.args.delay, 'drop': self.args.drop, 'corrupt': self.args.corrupt})
+
+        self._port = bus_simulator.Virtual_Port({'path': os.path.join(self.directory, 'ttySIM0'), 'protocol': 'modbus', 'baudrate': self.args.baudrate, 'devices': devices})
+        for slave in self._port.devices:
+            slave.set_listener(self._on_read)
+
+    # Start the broker (unless a broker is given); return its host and port
+    def _start_broker(self):
+        '''Start the broker (unless a broker is given); return its host and port'''
+        if (self.args.broker):
+            host, port = self.args.broker.rsplit(':', 1)
+            return host, int(port)
+
+        port = free_port()
+        config = os.path.join(self.directory, 'mosquitto.conf')
+        with open(config, 'w') as config_file:
+            config_file.write('listener '+str(port)+' 127.0.0.1\nallow_anonymous true\npersistence false\n')
+        self._broker = subprocess.Popen([self.args.mosquitto, '-c', config], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if (not wait_for_port('127.0.0.1', port, _START_TIMEOUT)):
+            raise Exception('The broker didn\'t start!')
+        return '127.0.0.1', port
+
+    # Start the node configured to read out the simulated slaves and to publish
+    # to the given broker; return the port of its metrics endpoint
+    def _start_node(self, host, port):
+        '''Start the node configured to read out the simulated slaves'''
+        credentials = os.path.join(self.directory, 'user_credentials')
+        with open(credentials, 'w') as credentials_file:
+            credentials_file.write(_USERNAME+'\n'+_USERNAME+'\n')
+
+        devices = []
+        for address in range(1, self.args.devices+1):
+            for point in range(self.args.points):
+                devices.append({'address': address, 'topic': self._name(address, point), 'register': _FIRST_REGISTER+2*point, 'register_count': 2})
+
+        metrics_port = free_port()
+        config = {
+            'log': os.path.join(self.directory, 'mqtt_node_client.log'),
+            'db': os.path.join(self.directory, 'mqtt_node_client.db.csv'),
+            'history': os.path.join(self.directory, 'mqtt_node_client.history'),
+            'queue': os.path.join(self.directory, 'queue'),
+            'mbus_address_map': os.path.join(self.directory, 'mbus_addresses'),
+            'user_credentials': credentials,
+            'ca': None,
+            'local_interface': '',
+            'ip_addr_remote': host,
+            'mqtt_port': port,
+            'engine_mode': self.args.engine,
+            'op_mode': 0,
+            'bus_port': self._port.path,
+            'baudrate': self.args.baudrate,
+            'read_interval': self.args.interval,
+            'devices': devices,
+            'filter_mode': 0,
+            'batch_mode': 1 if self.args.batch else 0,
+            'metrics_port': metrics_port,
+            'metrics_host': '127.0.0.1',
+        }
+
+        # Further settings given on the command line (values in the JSON
+        # format, e.g. drain_rate=0)
+        for setting in self.args.set:
+            key, value = setting.split('=', 1)
+            try:
+                config[key] = json.loads(value)
+            except ValueError:
+                config[key] = value
+        with open(os.path.join(self.directory, 'config.json'), 'w') as config_file:
+            json.dump(config, config_file, indent=1)
+
+        # Install the node and its modules like set_up_guide.txt does; the
+        # ssl.py shipped in files is a replacement of the one of outdated
+        # Python installations and would shadow the one of the interpreter
+        installed = os.path.join(self.directory, 'sbin')
+        os.makedirs(installed)
+        source = os.path.dirname(os.path.abspath(self.args.node))
+        for name in os.listdir(source):
+            if (name.endswith('.py') and name != 'ssl.py'):
+                shutil.copy(os.path.join(source, name), installed)
+
+        environment = dict(os.environ, MQTT_NODE_CLIENT_CONFIG=os.path.join(self.directory, 'config.json'))
+        with open(os.path.join(self.directory, 'node.out'), 'w') as output:
+            self._node = subprocess.Popen([sys.executable, os.path.join(installed, os.path.basename(self.args.node))], env=environment, stdout=output, stderr=subprocess.STDOUT)
+        if (not wait_for_port('127.0.0.1', metrics_port, _START_TIMEOUT)):
+            raise Exception('The node didn\'t start (cf. '+os.path.join(self.directory, 'node.out')+')!')
+        return metrics_port
+
+    # Check, that the node is still running
+    def _check_node(self):
+        '''Check, that the node is still running'''
+        if (self._node.poll() != None):
+            raise Exception('The node exited with '+str(self._node.returncode)+' (cf. '+os.path.join(self.directory, 'node.out')+')!')
+
+    # Run the benchmark; return the results
+    def run(self):
+        '''Run the benchmark; return the results'''
+        subscriber = None
+        try:
+            self._start_simulator()
+            host, port = self._start_broker()
+
+            subscriber = mqtt.Client(client_id='node_benchmark_'+str(os.getpid()))
+            subscriber.on_message = self._on_message
+            subscriber.connect(host, port)
+            subscriber.subscribe(self.topic+'/#', qos=1)
+            subscriber.loop_start()
+
+            metrics_port = self._start_node(host, port)
+
+            # Let the node connect and settle, then measure
+            time.sleep(self.args.warmup)
+            self._check_node()
+            statistics = self._port.statistics()
+            self._started = time.time()
+            self._measuring = True
+            time.sleep(self.args.duration)
+            self._measuring = False
+            elapsed = time.time()-self._started
+            self._check_node()
+
+            with urllib.request.urlopen('http://127.0.0.1:'+str(metrics_port)+'/metrics', timeout=5) as response:
+                metrics = parse_metrics(response.read().decode('utf-8'))
+        finally:
+            if (subscriber != None):
+                subscriber.loop_stop()
+                subscriber.disconnect()
+            self.stop()
+
+        # Bus cycle time: time between two consecutive reads of the same data
+        # point
+        cycles = []
+        for reads in self._reads.values():
+            cycles+=[second-first for first, second in zip(reads, reads[1:])]
+        cycles.sort()
+        latencies = sorted(self._latencies)
+        requests = self._port.statistics()
+
+        return {
+            'devices': self.args.devices,
+            'points': self.args.points,
+            'interval': self.args.interval,
+            'baudrate': self.args.baudrate,
+            'batch': int(self.args.batch),
+            'engine': self.args.engine,
+            'duration': elapsed,
+            'samples': self._received,
+            'samples_unknown': self._unknown,
+            'samples_per_second': self._received/elapsed,
+            'samples_per_second_expected': self.args.devices*self.args.points/float(self.args.interval),
+            'cycle_time_mean': sum(cycles)/len(cycles) if cycles else None,
+            'cycle_time_max': cycles[-1] if cycles else None,
+            'bus_utilisation': metrics.get('node_bus_utilisation_ratio'),
+            'bus_request_mean': metrics['node_bus_request_seconds_sum']/metrics['node_bus_request_seconds_count'] if metrics.get('node_bus_request_seconds_count') else None,
+            'bus_errors': metrics.get('node_bus_errors_total', 0),
+            'bus_requests': requests['requests']-statistics['requests'],
+            'latency_mean': sum(latencies)/len(latencies) if latencies else None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': latencies[-1] if latencies else None,
+        }
+
+    # Stop the node, the broker and the simulated slaves and remove the
+    # temporary files (unless they're kept)
+    def stop(self):
+        '''Stop the node, the broker and the simulated slaves'''
+        for process in (self._node, self._broker):
+            if (process == None or process.poll() != None):
+                continue
+            process.send_signal(signal.SIGTERM)
+            try:
+                process.wait(_START_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if (self._port != None):
+            self._port.close()
+        if (self.args.keep):
+            print('Files kept in '+self.directory)
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+# Compare the given results against the given baseline; return the list of
+# regressions
+def compare(results, baseline, tolerance):
+    '''Compare the given results against the given baseline'''
+    regressions = []
+    for key, higher_is_better in sorted(_COMPARED.items()):
+        if (results.get(key) == None or not baseline.get(key)):
+            continue
+        change = (results[key]-baseline[key])/baseline[key]
+        if ((higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance)):
+            regressions.append(key+': '+'%.4g' % results[key]+' (baseline: '+'%.4g' % baseline[key]+', '+'%+.1f' % (change*100)+' %)')
+    return regressions
+
+#------------------------------#
+######### Main program #########
+#------------------------------#
+
+if (__name__ == '__main__'):
+    parser = argparse.ArgumentParser(description='End-to-end benchmark of mqtt_node_client.py against simulated Modbus RTU slaves.')
+    parser.add_argument('--devices', type=int, default=4, help='number of simulated slaves (default: 4)')
+    parser.add_argument('--points', type=int, default=10, help='data points (32 bit counters) per slave (default: 10)')
+    parser.add_argument('--interval', type=float, default=1, help='readout interval of the node in s (default: 1)')
+    parser.add_argument('--duration', type=float, default=60, help='duration of the measurement in s (default: 60)')
+    parser.add_argument('--warmup', type=float, default=5, help='time in s to let the node settle before measuring (default: 5)')
+    parser.add_argument('--baudrate', type=int, default=9600, help='baud rate of the simulated bus (default: 9600)')
+    parser.add_argument('--delay', type=float, default=0.005, help='response time of the slaves in s (default: 0.005)')
+    parser.add_argument('--drop', type=float, default=0, help='probability of a slave not answering (default: 0)')
+    parser.add_argument('--corrupt', type=float, default=0, help='probability of a corrupted answer (default: 0)')
+    parser.add_argument('--batch', action='store_true', help='publish the values in binary batches')
+    parser.add_argument('--engine', type=int, default=1, choices=(0, 1), help='engine of the node (0 - threads, 1 - asyncio; default: 1)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='override a setting of the node (cf. node_config.py), e.g. --set drain_rate=0')
+    parser.add_argument('--broker', default='', help='host:port of the broker to use instead of starting mosquitto')
+    parser.add_argument('--mosquitto', default='mosquitto', help='mosquitto executable (default: mosquitto)')
+    parser.add_argument('--node', default=_NODE, help='program under test (default: ../files/mqtt_node_client.py)')
+    parser.add_argument('--output', default='', help='store the results as JSON in the given file')
+    parser.add_argument('--baseline', default='', help='compare the results against the ones stored in the given file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative deviation from the baseline tolerated (default: 0.2)')
+    parser.add_argument('--keep', action='store_true', help='keep the temporary files (configuration, log, ...)')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args)
+    try:
+        results = benchmark.run()
+    except:
+        sys.exit('Error: '+str(sys.exc_info()[1]))
+
+    for key in sorted(results):
+        print('%-28s %s' % (key, '%.6g' % results[key] if isinstance(results[key], float) else results[key]))
+
+    if (args.output):
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=1, sort_keys=True)
+
+    if (args.baseline):
+        with open(args.baseline, 'r') as baseline:
+            regressions = compare(results, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print('Regression: '+regression)
+        if (regressions):
+            sys.exit(1)